@@ -0,0 +1,139 @@
+"""
+Cache of converted page content, so revisions with identical wikitext
+(reverts, rollbacks, null edits) are only parsed and converted once.
+
+Results are kept in memory (least recently used are dropped first), and
+optionally in a SQLite file so later runs can reuse them too. Entries are
+keyed by a hash of the page title, the wikitext, the file namespace settings
+and the source of the conversion code itself, so editing the converter
+never returns stale results.
+
+Copyright (C) 2014 Angus Gratton
+Licensed under New BSD License as described in the file LICENSE.
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+import collections, hashlib, threading, sqlite3, os.path
+import wikicontent, visitor, dokuwiki, names
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversions (key TEXT PRIMARY KEY, version TEXT NOT NULL, result TEXT NOT NULL);
+"""
+
+# commit after storing this many conversions in the cache file
+COMMIT_EVERY = 100
+
+def converter_version():
+    """
+    Return a hash of the source of the modules which convert page content, so that
+    cached conversions are only used with the exact converter that made them.
+    """
+    version = hashlib.sha1()
+    for module in (wikicontent, visitor, dokuwiki, names):
+        path = os.path.splitext(module.__file__)[0] + ".py"
+        with open(path, "rb") as f:
+            version.update(f.read())
+    return version.hexdigest()
+
+class ConversionCache(object):
+    def __init__(self, maxsize=200, path=None):
+        """
+        maxsize is the most conversions to keep in memory. path is a SQLite file to keep
+        conversions in between runs (created if it doesn't exist), or None to only cache in memory.
+        """
+        self.maxsize = maxsize
+        self.version = converter_version()
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._unsaved = 0
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.executescript(SCHEMA)
+            # anything made by a different converter can never be used again
+            self.db.execute("DELETE FROM conversions WHERE version != ?", (self.version,))
+            self.db.commit()
+
+    def convert_pagecontent(self, title, content, sections=None):
+        """
+        Return wikicontent.convert_pagecontent(title, content), from the cache if possible.
+        If it isn't cached, it is converted with the wikicontent.SectionConverter 'sections' if one is given.
+        """
+        result = self.get(title, content)
+        if result is None:
+            if sections is not None:
+                result = sections.convert_pagecontent(content)
+            else:
+                result = wikicontent.convert_pagecontent(title, content)
+            self.put(title, content, result)
+        return result
+
+    def get(self, title, content):
+        """
+        Return the cached conversion of 'content' for the page 'title', or None if it isn't cached
+        """
+        return self._get(self._key(title, content))
+
+    def put(self, title, content, result):
+        """
+        Cache 'result' as the conversion of 'content' for the page 'title'
+        """
+        self._put(self._key(title, content), result)
+
+    def count_repeat(self):
+        """
+        Count a lookup of content that is already being converted, for conversions done outside
+        the cache (see dokuwiki.Exporter._conversion_job.) It is a hit if the cache would have
+        kept the first conversion, as convert_pagecontent() would find it.
+        """
+        with self._lock:
+            if self.maxsize > 0 or self.db is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def close(self):
+        if self.db is not None:
+            with self._lock:
+                self.db.commit()
+                self.db.close()
+                self.db = None
+
+    def _key(self, title, content):
+        key = hashlib.sha1()
+        for part in (self.version, wikicontent.dw_file_namespace, wikicontent.mw_file_namespace_aliases.pattern, title, content):
+            key.update(part.encode("utf-8"))
+            key.update(b"\0")
+        return key.hexdigest()
+
+    def _get(self, key):
+        with self._lock:
+            result = self._entries.pop(key, None)
+            if result is None and self.db is not None:
+                row = self.db.execute("SELECT result FROM conversions WHERE key = ?", (key,)).fetchone()
+                result = row[0] if row is not None else None
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, result)
+            return result
+
+    def _put(self, key, result):
+        with self._lock:
+            self._remember(key, result)
+            if self.db is not None:
+                self.db.execute("INSERT OR REPLACE INTO conversions (key, version, result) VALUES (?, ?, ?)", (key, self.version, result))
+                self._unsaved += 1
+                if self._unsaved >= COMMIT_EVERY:
+                    self.db.commit()
+                    self._unsaved = 0
+
+    def _remember(self, key, result):
+        """ Add to the in-memory cache as the most recently used entry (call with the lock held) """
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = result
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""Tests for the cache of converted page content, in memory and in a SQLite file.
+
+Copyright (C) 2014 Angus Gratton
+Licensed under New BSD License as described in the file LICENSE.
+
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+import os, shutil, sqlite3, tempfile, unittest
+import convcache
+
+class FailingConverter(object):
+    """ Stands in for a wikicontent.SectionConverter whose conversion raises """
+    def convert_pagecontent(self, content):
+        raise ValueError("can't convert %s" % content)
+
+class ConversionCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "cache.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def stored_rows(self):
+        db = sqlite3.connect(self.path)
+        try:
+            return db.execute("SELECT COUNT(*) FROM conversions").fetchone()[0]
+        finally:
+            db.close()
+
+    def test_converted_once(self):
+        cache = convcache.ConversionCache()
+        first = cache.convert_pagecontent("Page", "'''Bold'''")
+        self.assertEqual(cache.convert_pagecontent("Page", "'''Bold'''"), first)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(cache.get("Other Page", "'''Bold'''"), None) # the title is part of the key
+
+    def test_least_recently_used_dropped(self):
+        cache = convcache.ConversionCache(maxsize=2)
+        cache.put("Page", "One", "1")
+        cache.put("Page", "Two", "2")
+        self.assertEqual(cache.get("Page", "One"), "1") # so "Two" is now the least recently used
+        cache.put("Page", "Three", "3")
+        self.assertEqual([ cache.get("Page", text) for text in ("One", "Two", "Three") ], [ "1", None, "3" ])
+
+    def test_kept_between_runs(self):
+        cache = convcache.ConversionCache(maxsize=0, path=self.path) # only in the file
+        cache.put("Page", "One", "1")
+        cache.close()
+        cache = convcache.ConversionCache(path=self.path)
+        self.assertEqual(cache.get("Page", "One"), "1")
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+        cache.close()
+
+    def test_converter_changed(self):
+        cache = convcache.ConversionCache(path=self.path)
+        cache.put("Page", "One", "1")
+        cache.close()
+        converter_version = convcache.converter_version
+        convcache.converter_version = lambda: "edited converter"
+        try:
+            cache = convcache.ConversionCache(path=self.path)
+        finally:
+            convcache.converter_version = converter_version
+        self.assertEqual(cache.get("Page", "One"), None)
+        cache.close()
+        self.assertEqual(self.stored_rows(), 0) # deleted, they can never be used again
+
+    def test_failed_conversion_not_cached(self):
+        cache = convcache.ConversionCache(path=self.path)
+        self.assertRaises(ValueError, cache.convert_pagecontent, "Page", "One", FailingConverter())
+        self.assertEqual(cache.get("Page", "One"), None)
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+        cache.close()
+        self.assertEqual(self.stored_rows(), 0)
+
+    def test_count_repeat(self):
+        cache = convcache.ConversionCache()
+        cache.count_repeat()
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+        cache = convcache.ConversionCache(maxsize=0) # would convert the repeat again
+        cache.count_repeat()
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,14 +7,30 @@ Copyright (C) 2014 Angus Gratton
 Licensed under New BSD License as described in the file LICENSE.
 """
 from __future__ import print_function, unicode_literals, absolute_import, division
-import os, os.path, gzip, shutil, re, requests, calendar, codecs, sys
-from requests.auth import HTTPBasicAuth
+import os, os.path, gzip, shutil, re, calendar, codecs, sys, threading, hashlib, json, collections, io, heapq, tempfile
+from multiprocessing.pool import ThreadPool
 import wikicontent
 import simplemediawiki
-import names
+import names, httpsession, workers
 
 class Exporter(object):
-    def __init__(self, rootpath):
+    def __init__(self, rootpath, conversion_cache=None, section_reuse=True):
+        """
+        conversion_cache is an optional convcache.ConversionCache to convert page content with,
+        so identical revisions are only converted once.
+
+        If section_reuse is set, only the sections of each revision which changed since the
+        revision before are converted (see wikicontent.SectionConverter.)
+        """
+        self.conversion_cache = conversion_cache
+        self.section_reuse = section_reuse
+        # dokuwiki page ids linked to by the current revisions of the exported pages
+        self.linked = set()
+        # (title, reason) of each page which failed to convert
+        self.failures = []
+        self.writer = DataWriter()
+        # lines added to the pages' .changes files by write_pages(append=True)
+        self.appended_changes = []
 
         # verify the dokuwiki rootpath exists
         self.root = rootpath
@@ -31,55 +47,261 @@ class Exporter(object):
         self.attic = os.path.join(self.data, "attic")
         self.pages = os.path.join(self.data, "pages")
         for subdir in [ self.meta, self.attic, self.pages]:
-            ensure_directory_exists(subdir)
+            self.writer.ensure_directory(subdir)
 
-    def write_pages(self, pages):
+    def write_pages(self, pages, append=False, convert_workers=1, time_limit=None, memory_limit=None, raw_on_failure=False):
         """
-        Given 'pages' as a list of mediawiki pages with revisions attached, export them to dokuwiki pages
+        Given 'pages' as an iterable of mediawiki pages with revisions attached, export them to dokuwiki pages
+
+        Pages are converted one at a time as they are consumed, so 'pages' can be a generator.
+
+        If append is set, the revisions are added to any existing history of each page instead
+        of replacing it (revisions already in the history are skipped), and the new changes are
+        merged into the existing wiki-wide changelog rather than rebuilding it from every page.
+
+        If convert_workers is more than one, or either of time_limit (seconds per revision) or
+        memory_limit (bytes) is set, the content of each page's revisions is converted in a pool
+        of that many processes while this process writes out the pages (in order.)
+
+        A page which goes over the limits, or fails to convert at all, is left out and added to
+        self.failures. If raw_on_failure is set it is exported anyway, with any revisions which
+        weren't converted shown as plain Mediawiki markup.
         """
-        for page in pages:
-            self._convert_page(page)
-        self._aggregate_changes(self.meta, "_dokuwiki.changes")
+        try:
+            if convert_workers > 1 or time_limit or memory_limit:
+                pool = workers.SupervisedPool(convert_workers, _convert_texts, _init_convert_worker, (wikicontent.file_namespaces,),
+                                              time_limit, memory_limit)
+                try:
+                    jobs = collections.deque() # (page, cached contents, texts converted by the pool) for each page in the pool
+                    def submit():
+                        for page in pages:
+                            job = self._conversion_job(page, append)
+                            jobs.append(job)
+                            yield (pagenames.add(page['title']), job[2], self.section_reuse)
+                    for converted, failure in pool.imap(submit(), 2 * convert_workers):
+                        page, contents, texts = jobs.popleft()
+                        if failure is not None:
+                            self._conversion_failed(page, failure, raw_on_failure)
+                            if not raw_on_failure:
+                                continue
+                        self._convert_page(page, append, self._finish_conversion(page, contents, texts, converted))
+                finally:
+                    pool.terminate()
+            else:
+                for page in pages:
+                    contents, failure = self._convert_revisions(page, append)
+                    if failure is not None:
+                        self._conversion_failed(page, failure, raw_on_failure)
+                        if not raw_on_failure:
+                            continue
+                    self._convert_page(page, append, contents)
+        finally:
+            self.writer.flush() # every page converted so far (even if one then failed) is written out whole
+        if append:
+            self._update_aggregate(self.meta, "_dokuwiki.changes", self.appended_changes)
+            self.appended_changes = []
+        else:
+            self._aggregate_changes(self.meta, "_dokuwiki.changes")
+        self._report_missing_links()
 
-    def write_images(self, images, file_namespace, http_user=None, http_pass=None):
+    def missing_links(self):
+        """
+        Return the sorted ids of any pages which are linked to, but don't exist in the Dokuwiki
+        """
+        return sorted(pagename for pagename in self.linked if not pagenames.is_page(pagename)
+                      and not os.path.exists(os.path.join(self.pages, pagename.replace(":", "/") + ".txt")))
+
+    def _report_missing_links(self):
+        """
+        Print how many pages are linked to but don't exist, and the first few of their ids
+        """
+        missing = self.missing_links()
+        if missing:
+            shown = ", ".join(missing[:MISSING_LINKS_SHOWN])
+            if len(missing) > MISSING_LINKS_SHOWN:
+                shown += " and %d more" % (len(missing) - MISSING_LINKS_SHOWN)
+            print("%d pages are linked to but don't exist (or weren't part of this export): %s" % (len(missing), shown))
+
+    def _conversion_failed(self, page, failure, raw_on_failure):
+        """
+        Report that 'page' failed to convert and add it to self.failures
+        """
+        print("WARNING: Failed to convert page '%s' (%s)%s" %
+              (page['title'], failure, ", exporting it as plain Mediawiki markup." if raw_on_failure else ", not exporting it."))
+        self.failures.append((page['title'], failure))
+
+    def _convert_revisions(self, page, append=False):
+        """
+        Convert the content of each revision of 'page' in this process, before any of it is written out.
+
+        Returns a list of the converted contents (in the same order as page["revisions"], None for any
+        revisions already exported if append is set) and None, or if a revision fails to convert then
+        the list with that revision and any later ones shown as plain Mediawiki markup, and why it failed.
+        """
+        title = pagenames.add(page['title'])
+        existing = read_change_timestamps(self._changes_path(title)) if append else set()
+        sections = wikicontent.SectionConverter(title) if self.section_reuse else None
+        contents = []
+        failure = None
+        for revision in reversed(page["revisions"]): # oldest first, as they are exported
+            if get_timestamp(revision) in existing:
+                contents.append(None)
+                continue
+            if failure is None:
+                try:
+                    contents.append(self._convert_content(title, revision["*"], sections))
+                    continue
+                except Exception as e:
+                    failure = "%s: %s" % (e.__class__.__name__, e)
+            contents.append(plain_pagecontent(revision["*"]))
+        contents.reverse()
+        return contents, failure
+
+    def _changes_path(self, full_title):
+        """
+        Return the path to the .changes metafile of the page 'full_title'
+        """
+        subdir, pagename = os.path.split(full_title.replace(':','/'))
+        return os.path.join(self.meta, subdir, "%s.changes"%pagename)
+
+    def _conversion_job(self, page, append=False):
+        """
+        Return a tuple of the page, a list of the cached conversion of each revision's content
+        (None if not cached, or if append is set and the revision was already exported), and a
+        list of the distinct revision contents that need converting.
+
+        The conversion cache counts its hits and misses as if the page was converted in this process.
+        """
+        title = pagenames.add(page['title'])
+        existing = read_change_timestamps(self._changes_path(title)) if append else set()
+        contents = []
+        texts = []
+        for revision in page["revisions"]:
+            content = None
+            if get_timestamp(revision) in existing:
+                pass # already exported by an earlier run, not converted again
+            elif revision["*"] in texts:
+                if self.conversion_cache is not None:
+                    self.conversion_cache.count_repeat()
+            else:
+                if self.conversion_cache is not None:
+                    content = self.conversion_cache.get(title, revision["*"])
+                if content is None:
+                    texts.append(revision["*"])
+            contents.append(content)
+        return page, contents, texts
+
+    def _finish_conversion(self, page, contents, texts, converted):
+        """
+        Return the converted content of every revision of 'page', given the result of
+        _conversion_job() and the 'converted' content of each of its texts. If there are
+        fewer converted contents than texts, the rest are shown as plain Mediawiki markup.
+        Revisions which weren't converted because they were already exported are None.
+        """
+        title = pagenames.add(page['title'])
+        converted = dict(zip(texts, converted))
+        if self.conversion_cache is not None:
+            for text, content in converted.items():
+                self.conversion_cache.put(title, text, content)
+        for text in texts[len(converted):]:
+            converted[text] = plain_pagecontent(text)
+        return [ content if content is not None else converted.get(revision["*"])
+                 for revision, content in zip(page["revisions"], contents) ]
+
+    def write_images(self, images, file_namespace, session=None, download_workers=1):
         """
         Given 'images' as a list of mediawiki image metadata API entries,
         download and write out dokuwiki images. Does not bring over revisions.
 
         Images are all written to the file_namespace specified (file: by default), to match mediawiki.
+
+        Images are downloaded with 'session' (see httpsession.make_session()), so they reuse
+        the connections and authentication of the API importer. Up to download_workers images
+        are downloaded at once.
+
+        Images which already exist with the same sha1 as the mediawiki image are not downloaded again.
         """
-        auth=None if http_user is None else HTTPBasicAuth(http_user, http_pass)
+        if session is None:
+            session = httpsession.make_session(pool_size=download_workers)
         file_namespace = file_namespace.lower()
         filedir = os.path.join(self.data, "media", file_namespace)
         ensure_directory_exists(filedir)
         filemeta = os.path.join(self.data, "media_meta", file_namespace)
         ensure_directory_exists(filemeta)
-        for image in images:
-            # download the image from the Mediawiki server
-            print("Downloading %s... (%s)" % (image['name'], image['url']))
-            r = requests.get(image['url'], auth=auth)
-            # write the actual image out to the data/file directory
-            name = make_dokuwiki_pagename(image['name'])
-            imagepath = os.path.join(filedir, name)
-            with open(imagepath, "wb") as f:
-                f.write(r.content)
-            # set modification time appropriately
-            timestamp = get_timestamp(image)
-            os.utime(imagepath, (timestamp,timestamp))
-            # write a .changes file out to the media_meta/file directory
-            changepath = os.path.join(filemeta, "%s.changes" % name)
-            with codecs.open(changepath, "w", "utf-8") as f:
-                fields = (str(timestamp), "::1", "C", u"%s:%s"%(file_namespace,name), "", "created")
-                f.write(u"\t".join(fields) + "\r\n")
+        hashes = MediaHashIndex(os.path.join(self.data, "media_meta", MEDIA_HASH_FILE))
+        write_image = lambda image: self._write_image(image, session, file_namespace, filedir, filemeta, hashes)
+        try:
+            if download_workers > 1:
+                pool = ThreadPool(download_workers)
+                try:
+                    for _ in workers.imap_bounded(pool, write_image, images, 2 * download_workers):
+                        pass
+                finally:
+                    pool.terminate()
+            else:
+                for image in images:
+                    write_image(image)
+        finally:
+            hashes.save()
         # aggregate all the new changes to the media_meta/_media.changes file
         self._aggregate_changes(os.path.join(self.data, "media_meta"), "_media.changes")
 
-    def _convert_page(self, page):
-        """ Convert the supplied mediawiki page to a Dokuwiki page """
+    def _write_image(self, image, session, file_namespace, filedir, filemeta, hashes):
+        """
+        Download a single image to the filedir directory, and write its .changes file to filemeta.
+        The image is skipped if it is already there with the same sha1 (according to the MediaHashIndex 'hashes'.)
+
+        The image is streamed to a temporary file in filedir and only renamed into place once
+        it has all arrived, so large files don't have to fit in memory and a failed download
+        never leaves a partial image behind.
+        """
+        name = make_dokuwiki_pagename(image['name'])
+        imagepath = os.path.join(filedir, name)
+        if 'sha1' in image and hashes.get(imagepath) == image['sha1']:
+            print("Skipping %s, already exported." % image['name'])
+            return
+        # download the image from the Mediawiki server
+        print("Downloading %s... (%s)" % (image['name'], image['url']))
+        r = session.get(image['url'], stream=True)
+        try:
+            if r.status_code != 200:
+                print("WARNING: Failed to download %s (HTTP %d), skipping it." % (image['name'], r.status_code))
+                return
+            # write the actual image out to the data/file directory
+            temppath = "%s.%d.part" % (imagepath, threading.current_thread().ident) # unique even if two images clean to the same name
+            sha1 = hashlib.sha1()
+            try:
+                with open(temppath, "wb") as f:
+                    for chunk in r.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        sha1.update(chunk)
+                        f.write(chunk)
+                rename_over(temppath, imagepath)
+            except:
+                if os.path.exists(temppath):
+                    os.remove(temppath)
+                raise
+        finally:
+            r.close()
+        # set modification time appropriately
+        timestamp = get_timestamp(image)
+        os.utime(imagepath, (timestamp,timestamp))
+        hashes.put(imagepath, sha1.hexdigest())
+        # write a .changes file out to the media_meta/file directory
+        changepath = os.path.join(filemeta, "%s.changes" % name)
+        with codecs.open(changepath, "w", "utf-8") as f:
+            fields = (str(timestamp), "::1", "C", u"%s:%s"%(file_namespace,name), "", "created")
+            f.write(u"\t".join(fields) + "\r\n")
+
+    def _convert_page(self, page, append, contents):
+        """
+        Write out the supplied mediawiki page as a Dokuwiki page
+
+        contents is the converted content of each revision (in the same order as page["revisions"].)
+        """
         print("Converting %d revisions of page '%s'..." %
               (len(page["revisions"]), page['title']))
         # Sanitise the mediawiki pagename to something matching the dokuwiki pagename convention
-        full_title = make_dokuwiki_pagename(page['title'])
+        full_title = pagenames.add(page['title'])
 
         # Mediawiki pagenames can contain namespace :s, convert these to dokuwiki / paths on the filesystem (becoming : namespaces in dokuwiki)
         subdir, pagename = os.path.split(full_title.replace(':','/'))
@@ -87,36 +309,77 @@ class Exporter(object):
         metadir = os.path.join(self.meta, subdir)
         atticdir = os.path.join(self.attic, subdir)
         for d in pagedir, metadir, atticdir:
-            ensure_directory_exists(d)
+            self.writer.ensure_directory(d)
+
+        changespath = self._changes_path(full_title)
 
         # Walk through the list of revisions
         revisions = list(reversed(page["revisions"])) # order as oldest first
-        for revision in revisions:
+        contents = list(reversed(contents))
+        existing = read_change_timestamps(changespath) if append else set()
+        changes = [] # lines to add to the .changes file
+        replace_changes = False
+        for index, revision in enumerate(revisions):
             is_current = (revision == revisions[-1])
-            is_first = (revision == revisions[0])
-            content = wikicontent.convert_pagecontent(full_title, revision["*"])
+            is_first = (revision == revisions[0]) and not existing
             timestamp = get_timestamp(revision)
+            if timestamp in existing:
+                continue # already exported by an earlier run
+            content = contents[index]
             comment = revision.get("comment", "").replace("\t", " ").split("\n")[0]
-            # path to the .changes metafile
-            changespath = os.path.join(metadir, "%s.changes"%pagename)
             # for current revision, create 'pages' .txt
             if is_current:
-                txtpath = os.path.join(pagedir, "%s.txt"%pagename)
-                with codecs.open(txtpath, "w", "utf-8") as f:
-                    f.write(content)
-                os.utime(txtpath, (timestamp,timestamp))
+                self.linked.update(get_linked_pagenames(content))
+                self.writer.write_text(os.path.join(pagedir, "%s.txt"%pagename), content, timestamp)
             # create gzipped attic revision
             atticname = "%s.%s.txt.gz" % (pagename, timestamp)
-            atticpath = os.path.join(atticdir, atticname).encode("utf-8")
-            with gzip.open(atticpath, "wb") as f:
-                f.write(content.encode("utf-8"))
-            os.utime(atticpath, (timestamp,timestamp))
-            # append entry to page's 'changes' metadata index
-            with codecs.open(changespath, "w" if is_first else "a", "utf-8") as f:
-                changes_title = full_title.replace("/", ":")
-                fields = (str(timestamp), "::1", "C" if is_first else "E", changes_title, names.clean_user(revision["user"]), comment)
-                print(u"\t".join(fields), file=f)
+            self.writer.add_attic(os.path.join(atticdir, atticname).encode("utf-8"), content, timestamp)
+            # add entry to page's 'changes' metadata index
+            changes_title = full_title.replace("/", ":")
+            fields = (str(timestamp), "::1", "C" if is_first else "E", changes_title, names.clean_user(revision["user"]), comment)
+            changes.append(u"\t".join(fields) + "\n")
+            replace_changes = replace_changes or is_first
+        if changes:
+            self.writer.add_changes(changespath, changes, replace_changes)
+            if append:
+                self.appended_changes += changes
+
+    def _convert_content(self, title, content, sections=None):
+        """
+        Convert one revision's content, with the SectionConverter 'sections' for its page if there is one
+        """
+        if self.conversion_cache is not None:
+            return self.conversion_cache.convert_pagecontent(title, content, sections)
+        if sections is not None:
+            return sections.convert_pagecontent(content)
+        return wikicontent.convert_pagecontent(title, content)
+
+    def read_sync_timestamp(self):
+        """
+        Return the timestamp recorded by write_sync_timestamp() on the last incremental run, or None
+        """
+        try:
+            with open(os.path.join(self.meta, SYNC_FILE)) as f:
+                return f.read().strip() or None
+        except IOError:
+            return None
 
+    def write_sync_timestamp(self, timestamp):
+        """
+        Record the mediawiki timestamp the next incremental run should fetch changes from
+        """
+        with open(os.path.join(self.meta, SYNC_FILE), "w") as f:
+            f.write(timestamp + "\n")
+
+    def rebuild_changelogs(self):
+        """
+        Rebuild the wiki-wide page & media changelogs from the .changes files of every page & image
+        (ie after adding pages and images from elsewhere, as yamdwe_merge.py does.)
+        """
+        self._aggregate_changes(self.meta, "_dokuwiki.changes")
+        media_meta = os.path.join(self.data, "media_meta")
+        if os.path.isdir(media_meta):
+            self._aggregate_changes(media_meta, "_media.changes")
 
     def _aggregate_changes(self, metadir, aggregate):
         """
@@ -124,17 +387,29 @@ class Exporter(object):
         from media_meta to media_meta/_media.changes
 
         This is a Pythonified version of https://www.dokuwiki.org/tips:Recreate_Wiki_Change_Log
+        (merging the files rather than sorting all their lines in memory, see merge_changes())
         """
-        lines = []
+        paths = []
         for root, dirs, files in os.walk(metadir):
             for changesfile in files:
                 if changesfile == aggregate or not changesfile.endswith(".changes"):
                     continue
-                with codecs.open(os.path.join(root,changesfile), "r", "utf-8") as f:
-                    lines += f.readlines()
-        lines = sorted(lines, key=lambda r: int(r.split("\t")[0]))
-        with codecs.open(os.path.join(metadir, aggregate), "w", "utf-8") as f:
-            f.writelines(lines)
+                paths.append(os.path.join(root,changesfile))
+        merge_changes(paths, os.path.join(metadir, aggregate))
+
+    def _update_aggregate(self, metadir, aggregate, lines):
+        """
+        Add 'lines' (unicode lines just added to .changes files under metadir) to the wiki-wide
+        changelog metadir/aggregate, without reading all the other .changes files again.
+        The changelog is rebuilt from scratch if it doesn't exist yet.
+        """
+        path = os.path.join(metadir, aggregate)
+        if not os.path.exists(path):
+            self._aggregate_changes(metadir, aggregate)
+            return
+        lines = [ line.encode("utf-8") for line in lines ]
+        added = sorted((change_timestamp(line), 1, position, line) for position, line in enumerate(lines))
+        _write_merged(path, [ _read_run(path, 0), added ])
 
     def fixup_permissions(self):
         """ Fix permissions under the data directory
@@ -169,6 +444,178 @@ class Exporter(object):
         except OSError:
             print(CACHE_WARNING_MSG % confpath)
 
+# most missing page ids to list at the end of an export
+MISSING_LINKS_SHOWN = 20
+
+# bytes to read at a time when streaming an image download to disk
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# file under media_meta/ holding the MediaHashIndex
+MEDIA_HASH_FILE = "_yamdwe.sha1"
+
+# file under meta/ holding the timestamp to start the next incremental run from
+SYNC_FILE = "_yamdwe.sync"
+
+# most link targets remembered by the PagenameIndex, as well as the titles of the exported pages
+PAGENAME_CACHE_SIZE = 10000
+
+class PagenameIndex(object):
+    """
+    Converts Mediawiki titles to Dokuwiki page ids (with make_dokuwiki_pagename), remembering
+    the results, as every revision of every page links to the same few thousand titles.
+
+    The ids of the exported pages' titles are kept for the whole export. Other titles are
+    remembered in a cache which is emptied whenever it holds cache_size titles.
+    """
+    def __init__(self, cache_size=PAGENAME_CACHE_SIZE):
+        self.cache_size = cache_size
+        self.pages = {} # title -> id of each exported page
+        self.page_ids = set()
+        self.cache = {} # title -> id of any other title converted
+
+    def add(self, title):
+        """
+        Add the title of an exported page, return its id
+        """
+        pagename = self.get(title)
+        self.pages[title] = pagename
+        self.page_ids.add(pagename)
+        return pagename
+
+    def get(self, title):
+        """
+        Return make_dokuwiki_pagename(title)
+        """
+        pagename = self.pages.get(title)
+        if pagename is None:
+            pagename = self.cache.get(title)
+            if pagename is None:
+                if len(self.cache) >= self.cache_size:
+                    self.cache.clear()
+                pagename = make_dokuwiki_pagename(title)
+                self.cache[title] = pagename
+        return pagename
+
+    def is_page(self, pagename):
+        """
+        Is 'pagename' the id of a page added to the index?
+        """
+        return pagename in self.page_ids
+
+# shared by every Exporter & by wikicontent, so link targets are converted once per process
+pagenames = PagenameIndex()
+
+class DataWriter(object):
+    """
+    Writes the files of exported pages with as few filesystem calls as possible, as there
+    are several files for every revision and on network storage each call is slow.
+
+    Each directory is only checked (and created if need be) the first time it is used. Attic
+    revisions are compressed in memory, and the lines of each page's .changes file are collected,
+    until more than ATTIC_BATCH_BYTES of attic revisions (from any number of pages) are waiting or
+    flush() is called. Then they are all written out, the attic revisions first, so an interrupted
+    export never leaves a page history (which --incremental trusts) listing missing revisions.
+    """
+    def __init__(self):
+        self.directories = set()
+        self._attic = [] # (path, compressed content, timestamp) of each attic revision waiting to be written
+        self._attic_bytes = 0
+        self._changes = [] # (path, lines, replace) of each .changes file update waiting to be written
+
+    def ensure_directory(self, path):
+        if not path in self.directories:
+            ensure_directory_exists(path)
+            self.directories.add(path)
+
+    def write_text(self, path, content, timestamp):
+        """ Write the unicode string 'content' to path (as UTF-8) and set its modification time """
+        with open(path, "wb") as f:
+            f.write(content.encode("utf-8"))
+        os.utime(path, (timestamp, timestamp))
+
+    def add_attic(self, path, content, timestamp):
+        """ Add a gzipped attic revision of 'content' to write to path """
+        data = io.BytesIO()
+        with gzip.GzipFile(path, "wb", fileobj=data) as f:
+            f.write(content.encode("utf-8"))
+        self._attic.append((path, data.getvalue(), timestamp))
+        self._attic_bytes += len(self._attic[-1][1])
+
+    def add_changes(self, path, lines, replace=False):
+        """
+        Add 'lines' to append to the .changes file at path (or to replace its contents, if replace is set.)
+        Call this after adding the attic revisions the lines list.
+        """
+        self._changes.append((path, lines, replace))
+        if self._attic_bytes > ATTIC_BATCH_BYTES:
+            self.flush()
+
+    def flush(self):
+        """ Write out the attic revisions, then the .changes file lines, added since the last flush """
+        for path, data, timestamp in self._attic:
+            with open(path, "wb") as f:
+                f.write(data)
+            os.utime(path, (timestamp, timestamp))
+        self._attic = []
+        self._attic_bytes = 0
+        for path, lines, replace in self._changes:
+            with open(path, "wb" if replace else "ab") as f:
+                f.write("".join(lines).encode("utf-8"))
+        self._changes = []
+
+# most bytes of compressed attic revisions the DataWriter holds before writing them out
+ATTIC_BATCH_BYTES = 8 * 1024 * 1024
+
+class MediaHashIndex(object):
+    """
+    The sha1 of each exported image, saved between runs so unchanged images can be skipped
+    without reading them all again to hash them.
+
+    Each entry also has the size & modification time of the file when it was hashed, so a file
+    changed since then is hashed again.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except (IOError, ValueError):
+            self.entries = {}
+
+    def get(self, filepath):
+        """
+        Return the sha1 (hex) of the file at filepath, or None if there's no such file
+        """
+        key = self._key(filepath)
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self.entries.get(key)
+        if entry is not None and entry[0] == stat.st_size and entry[1] == int(stat.st_mtime):
+            return entry[2]
+        sha1 = hashlib.sha1()
+        with open(filepath, "rb") as f:
+            for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+                sha1.update(chunk)
+        self.put(filepath, sha1.hexdigest())
+        return sha1.hexdigest()
+
+    def put(self, filepath, sha1):
+        stat = os.stat(filepath)
+        with self._lock:
+            self.entries[self._key(filepath)] = [ stat.st_size, int(stat.st_mtime), sha1 ]
+
+    def save(self):
+        with self._lock:
+            with open(self.path, "w") as f:
+                json.dump(self.entries, f)
+
+    def _key(self, filepath):
+        return os.path.relpath(filepath, os.path.dirname(self.path))
+
 CACHE_WARNING_MSG = """WARNING: Failed to invalidate page cache by updating config file timestamp.
 If pre-existing pages exist in Dokuwiki, run the following command (with sufficient privileges):
   touch "%s"
@@ -181,10 +628,150 @@ def get_timestamp(node):
     dt = simplemediawiki.MediaWiki.parse_date(node['timestamp'])
     return int(calendar.timegm(dt.utctimetuple()))
 
+def read_change_timestamps(changespath):
+    """
+    Return the set of revision timestamps listed in a dokuwiki .changes file (empty if there is no file)
+    """
+    if not os.path.exists(changespath):
+        return set()
+    with codecs.open(changespath, "r", "utf-8") as f:
+        return set(int(line.split("\t")[0]) for line in f if line.strip())
+
+def _init_convert_worker(file_namespaces):
+    """
+    Runs in each conversion worker process, sets it up the same way as the main process
+    """
+    wikicontent.set_file_namespaces(*file_namespaces)
+
+def _convert_texts(job):
+    """
+    Runs in a conversion worker process. job is a tuple of page title, a list of revision
+    contents and whether to reuse unchanged sections between them, yields each converted content.
+    """
+    title, texts, section_reuse = job
+    sections = wikicontent.SectionConverter(title) if section_reuse else None
+    for text in texts:
+        if sections is not None:
+            yield sections.convert_pagecontent(text)
+        else:
+            yield wikicontent.convert_pagecontent(title, text)
+
+# most files merge_changes() reads from at once
+MERGE_FANIN = 256
+
+def merge_changes(paths, outpath, fanin=MERGE_FANIN):
+    """
+    Write every line of the .changes files at 'paths' to outpath, in timestamp order. Lines with
+    the same timestamp are kept in the order of 'paths' (and their order in each file.)
+
+    Each .changes file is normally already in timestamp order, so rather than sorting all the
+    lines in memory the files are merged. Files are merged 'fanin' at a time, and if there are
+    more than that then each group is merged to a temporary sorted run (in a directory next to
+    outpath) and the runs are merged in turn, so only about 'fanin' pages worth of lines or
+    'fanin' open runs are needed at any time.
+    """
+    sources = [ (path, False) for path in paths ] # (path, is it a run)
+    tempdir = None
+    runcount = 0
+    try:
+        while len(sources) > fanin:
+            if tempdir is None:
+                tempdir = tempfile.mkdtemp(prefix="_yamdwe_changes", dir=os.path.dirname(outpath))
+            runs = []
+            for start in range(0, len(sources), fanin):
+                runpath = os.path.join(tempdir, "run%d" % runcount)
+                runcount += 1
+                _write_merged(runpath, _read_sources(sources[start:start+fanin]))
+                runs.append((runpath, True))
+            for path, is_run in sources:
+                if is_run:
+                    os.remove(path)
+            sources = runs
+        _write_merged(outpath, _read_sources(sources))
+    finally:
+        if tempdir is not None:
+            shutil.rmtree(tempdir, ignore_errors=True)
+
+def _read_sources(sources):
+    """
+    Return an iterable of (timestamp, index, position, line) in timestamp order for each of the
+    sources (path, is it a run) given to merge_changes()
+    """
+    return [ _read_run(path, index) if is_run else _read_changes(path, index) for index, (path, is_run) in enumerate(sources) ]
+
+def _read_changes(path, index):
+    """
+    Return a list of (timestamp, index, position, line) for each line of the .changes file at path,
+    in timestamp order (it's sorted here, in case it isn't already)
+    """
+    with open(path, "rb") as f:
+        lines = [ line if line.endswith(b"\n") else line + b"\n" for line in f if line.strip() ]
+    return sorted((change_timestamp(line), index, position, line) for position, line in enumerate(lines))
+
+def _read_run(path, index):
+    """
+    Yield (timestamp, index, position, line) for each line of the file at path, which is already in timestamp order
+    """
+    with open(path, "rb") as f:
+        for position, line in enumerate(f):
+            yield (change_timestamp(line), index, position, line)
+
+def _write_merged(path, sources):
+    """
+    Merge the (timestamp, index, position, line) iterables 'sources' and write the lines to path,
+    replacing it only once all the lines have been written
+    """
+    temppath = path + ".part"
+    try:
+        with open(temppath, "wb") as f:
+            for timestamp, index, position, line in heapq.merge(*sources):
+                f.write(line)
+        rename_over(temppath, path)
+    except:
+        if os.path.exists(temppath):
+            os.remove(temppath)
+        raise
+
+def change_timestamp(line):
+    """ Return the timestamp at the start of a line (bytes) of a .changes file """
+    return int(line.split(b"\t", 1)[0])
+
+def plain_pagecontent(content):
+    """
+    Return dokuwiki content showing the Mediawiki 'content' as it is, for revisions which couldn't be converted
+    """
+    return "<code>\n%s\n</code>\n" % content.replace("</code>", "</ code>")
+
+def rename_over(src, dst):
+    """
+    Rename src to dst, replacing dst if it exists (os.rename won't on Windows)
+    """
+    try:
+        os.rename(src, dst)
+    except OSError:
+        if not os.path.exists(dst):
+            raise
+        os.remove(dst)
+        os.rename(src, dst)
+
 def ensure_directory_exists(path):
     if not os.path.isdir(path):
         os.makedirs(path)
 
+def get_linked_pagenames(content):
+    """
+    Return the ids of the pages linked to by dokuwiki page content (not including anchors, external,
+    interwiki or Windows share links, or links shown as they are in code & nowiki blocks)
+    """
+    content = re.sub(r"(?s)<(code|file|nowiki)\b.*?</\1>|%%.*?%%", "", content)
+    result = set()
+    for target in re.findall(r"\[\[([^\]|#]*)", content):
+        target = target.strip()
+        if len(target) and not "://" in target and not "@" in target and not ">" in target \
+           and not target.startswith("\\\\") and not target.startswith("{{"):
+            result.add(target)
+    return result
+
 def make_dokuwiki_pagename(mediawiki_name):
     """
     Convert a canonical mediawiki pagename to a dokuwiki pagename
@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+"""Tests for writing out the Dokuwiki data directory (conversion of the page
+content itself is tested by wikicontent_tests.py.)
+
+Copyright (C) 2014 Angus Gratton
+Licensed under New BSD License as described in the file LICENSE.
+
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+import sys, os, shutil, tempfile, hashlib, gzip, random, codecs, unittest, StringIO
+import dokuwiki, mockwiki, wikicontent, convcache
+from mediawiki_tests import quietly
+
+class ExportTestCase(unittest.TestCase):
+    """ Each test gets an empty Dokuwiki (self.root, with a data directory) to export into """
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.data = os.path.join(self.root, "data")
+        os.mkdir(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def make_exporter(self):
+        return dokuwiki.Exporter(self.root)
+
+class MediaHashIndexTests(ExportTestCase):
+    def setUp(self):
+        ExportTestCase.setUp(self)
+        self.index_path = os.path.join(self.data, "media_meta", dokuwiki.MEDIA_HASH_FILE)
+        os.mkdir(os.path.dirname(self.index_path))
+        self.image = os.path.join(self.data, "media", "file", "picture.png")
+        os.makedirs(os.path.dirname(self.image))
+        self.write_image(b"picture")
+
+    def write_image(self, data, mtime=1400000000):
+        with open(self.image, "wb") as f:
+            f.write(data)
+        os.utime(self.image, (mtime, mtime))
+
+    def test_hashes_file(self):
+        hashes = dokuwiki.MediaHashIndex(self.index_path)
+        self.assertEqual(hashes.get(self.image), hashlib.sha1(b"picture").hexdigest())
+        self.assertEqual(hashes.get(self.image + ".missing"), None)
+
+    def test_unchanged_file_not_hashed(self):
+        hashes = dokuwiki.MediaHashIndex(self.index_path)
+        hashes.put(self.image, "remembered")
+        self.assertEqual(hashes.get(self.image), "remembered")
+
+    def test_changed_file_hashed_again(self):
+        hashes = dokuwiki.MediaHashIndex(self.index_path)
+        hashes.put(self.image, "remembered")
+        self.write_image(b"pictures") # different size
+        self.assertEqual(hashes.get(self.image), hashlib.sha1(b"pictures").hexdigest())
+        hashes.put(self.image, "remembered")
+        self.write_image(b"Pictures", mtime=1400000001) # same size, modified since
+        self.assertEqual(hashes.get(self.image), hashlib.sha1(b"Pictures").hexdigest())
+
+    def test_save_and_load(self):
+        hashes = dokuwiki.MediaHashIndex(self.index_path)
+        hashes.put(self.image, "remembered")
+        hashes.save()
+        self.assertEqual(dokuwiki.MediaHashIndex(self.index_path).get(self.image), "remembered")
+        self.assertEqual(list(dokuwiki.MediaHashIndex(self.index_path).entries), [ os.path.join("..", "media", "file", "picture.png") ])
+
+    def test_missing_or_corrupt_index(self):
+        self.assertEqual(dokuwiki.MediaHashIndex(self.index_path).entries, {})
+        with open(self.index_path, "w") as f:
+            f.write("{ not json")
+        self.assertEqual(dokuwiki.MediaHashIndex(self.index_path).entries, {})
+
+class WriteImagesTests(ExportTestCase):
+    def setUp(self):
+        ExportTestCase.setUp(self)
+        self.wiki = mockwiki.make_wiki(pages=1, revisions=1, kb=1, images=3, image_kb=4)
+        self.server = mockwiki.MockWikiServer(self.wiki)
+        self.server.start()
+        self.images = self.server.api({ "action" : "query", "list" : "allimages", "ailimit" : "max" })["query"]["allimages"]
+        self.filedir = os.path.join(self.data, "media", "file")
+
+    def tearDown(self):
+        self.server.stop()
+        ExportTestCase.tearDown(self)
+
+    def write_images(self, download_workers=1):
+        """ Export all the images, return the number downloaded """
+        requests = self.server.requests
+        quietly(self.make_exporter().write_images, self.images, "File", download_workers=download_workers)
+        return self.server.requests - requests
+
+    def image_path(self, image):
+        return os.path.join(self.filedir, dokuwiki.make_dokuwiki_pagename(image["name"]))
+
+    def test_images_written(self):
+        self.assertEqual(self.write_images(download_workers=2), 3)
+        for name, timestamp, data in self.wiki.images:
+            image = [ image for image in self.images if image["name"] == name ][0]
+            with open(self.image_path(image), "rb") as f:
+                self.assertEqual(f.read(), data)
+            self.assertEqual(int(os.path.getmtime(self.image_path(image))), dokuwiki.get_timestamp(image))
+        self.assertEqual(sorted(os.listdir(self.filedir)), sorted(os.path.basename(self.image_path(image)) for image in self.images))
+        self.assertTrue(os.path.exists(os.path.join(self.data, "media_meta", dokuwiki.MEDIA_HASH_FILE)))
+
+    def test_unchanged_images_skipped(self):
+        self.write_images()
+        self.assertEqual(self.write_images(), 0)
+
+    def test_changed_image_downloaded_again(self):
+        self.write_images()
+        changed = self.image_path(self.images[1])
+        with open(changed, "ab") as f:
+            f.write(b"damaged")
+        self.assertEqual(self.write_images(), 1)
+        with open(changed, "rb") as f:
+            self.assertEqual(hashlib.sha1(f.read()).hexdigest(), self.images[1]["sha1"])
+        self.assertEqual(self.write_images(), 0)
+
+    def test_images_not_hashed_again(self):
+        self.write_images()
+        # if the index wasn't used, every image would be hashed again and found not to match
+        hashes = dokuwiki.MediaHashIndex(os.path.join(self.data, "media_meta", dokuwiki.MEDIA_HASH_FILE))
+        for image in self.images:
+            hashes.put(self.image_path(image), image["sha1"])
+            with open(self.image_path(image), "r+b") as f:
+                f.write(b"x") # same size, and the modification time is put back below
+            timestamp = dokuwiki.get_timestamp(image)
+            os.utime(self.image_path(image), (timestamp, timestamp))
+        hashes.save()
+        self.assertEqual(self.write_images(), 0)
+
+def make_page(pageid, title, text, timestamp="2014-01-01T10:00:00Z"):
+    return { "pageid" : pageid, "ns" : 0, "title" : title,
+             "revisions" : [ { "revid" : pageid, "parentid" : 0, "timestamp" : timestamp,
+                               "user" : "Alice", "comment" : "", "*" : text } ] }
+
+class DataWriterTests(ExportTestCase):
+    def setUp(self):
+        ExportTestCase.setUp(self)
+        self.writer = dokuwiki.DataWriter()
+
+    def add_page(self, name, content="Content"):
+        attic_path = os.path.join(self.data, "%s.1400000000.txt.gz" % name)
+        changes_path = os.path.join(self.data, "%s.changes" % name)
+        self.writer.add_attic(attic_path, content, 1400000000)
+        self.writer.add_changes(changes_path, [ "1400000000\t::1\tC\t%s\tAlice\t\n" % name ], True)
+        return attic_path, changes_path
+
+    def test_written_on_flush(self):
+        attic_path, changes_path = self.add_page("page", "Hello \xfc")
+        self.assertEqual(os.listdir(self.data), [])
+        self.writer.flush()
+        with gzip.open(attic_path) as f:
+            self.assertEqual(f.read().decode("utf-8"), "Hello \xfc")
+        self.assertEqual(int(os.path.getmtime(attic_path)), 1400000000)
+        with open(changes_path) as f:
+            self.assertEqual(f.read(), "1400000000\t::1\tC\tpage\tAlice\t\n")
+
+    def test_changes_appended(self):
+        attic_path, changes_path = self.add_page("page")
+        self.writer.add_changes(changes_path, [ "1400000001\t::1\tE\tpage\tBob\t\n" ])
+        self.writer.flush()
+        self.writer.add_changes(changes_path, [ "1400000002\t::1\tE\tpage\tBob\t\n" ])
+        self.writer.flush()
+        with open(changes_path) as f:
+            self.assertEqual([ line.split("\t")[0] for line in f ], [ "1400000000", "1400000001", "1400000002" ])
+
+    def test_batches_many_pages(self):
+        batch_bytes = dokuwiki.ATTIC_BATCH_BYTES
+        dokuwiki.ATTIC_BATCH_BYTES = 1000
+        try:
+            written = []
+            for i in range(100):
+                written.append(self.add_page("page%d" % i, os.urandom(100).encode("hex")))
+                if os.listdir(self.data):
+                    break
+        finally:
+            dokuwiki.ATTIC_BATCH_BYTES = batch_bytes
+        self.assertTrue(1 < len(written) < 100) # written out once over the limit, not after each page
+        for attic_path, changes_path in written: # every page's attic revision & .changes file together
+            self.assertTrue(os.path.exists(attic_path) and os.path.exists(changes_path))
+
+    def test_interrupted_export(self):
+        exporter = self.make_exporter()
+        def pages():
+            yield make_page(1, "First Page", "Hello")
+            raise KeyboardInterrupt()
+        self.assertRaises(KeyboardInterrupt, quietly, exporter.write_pages, pages())
+        # the pages converted before the interruption are written out whole
+        self.assertEqual(os.listdir(os.path.join(self.data, "attic")), [ "first_page.1388570400.txt.gz" ])
+        with open(os.path.join(self.data, "meta", "first_page.changes")) as f:
+            self.assertEqual(f.read().split("\t")[:4], [ "1388570400", "::1", "C", "first_page" ])
+
+class ConversionFailureTests(ExportTestCase):
+    """ A page which fails to convert in this process (ie without --convert-workers) """
+    def setUp(self):
+        ExportTestCase.setUp(self)
+        # without the recursion limit raised, this page is nested too deeply for mwlib to parse
+        self.parse_recursion_limit = wikicontent.PARSE_RECURSION_LIMIT
+        wikicontent.PARSE_RECURSION_LIMIT = 0
+        self.pages = [ make_page(1, "Deep Page", "{|\n|\n" * 400 + "|}\n" * 400), make_page(2, "Other Page", "Hello") ]
+
+    def tearDown(self):
+        wikicontent.PARSE_RECURSION_LIMIT = self.parse_recursion_limit
+        ExportTestCase.tearDown(self)
+
+    def page_files(self):
+        return sorted(os.listdir(os.path.join(self.data, "pages")))
+
+    def test_page_left_out(self):
+        exporter = self.make_exporter()
+        quietly(exporter.write_pages, self.pages)
+        self.assertEqual(self.page_files(), [ "other_page.txt" ]) # the rest of the export carries on
+        self.assertEqual(os.listdir(os.path.join(self.data, "attic")), [ "other_page.1388570400.txt.gz" ])
+        self.assertEqual([ title for title, failure in exporter.failures ], [ "Deep Page" ])
+        self.assertTrue("maximum recursion depth" in exporter.failures[0][1])
+
+    def test_raw_on_failure(self):
+        exporter = self.make_exporter()
+        quietly(exporter.write_pages, self.pages, raw_on_failure=True)
+        self.assertEqual(self.page_files(), [ "deep_page.txt", "other_page.txt" ])
+        with codecs.open(os.path.join(self.data, "pages", "deep_page.txt"), "r", "utf-8") as f:
+            self.assertEqual(f.read(), dokuwiki.plain_pagecontent(self.pages[0]["revisions"][0]["*"]))
+        self.assertEqual(len(exporter.failures), 1)
+
+class ConvertWorkersTests(ExportTestCase):
+    """ Converting in a pool of worker processes (--convert-workers) must export the same as converting in this process """
+    def make_page(self, texts):
+        """ A page with a revision for each of 'texts' (oldest first), on consecutive days """
+        revisions = [ { "revid" : day, "parentid" : day - 1, "timestamp" : "2014-01-%02dT10:00:00Z" % day,
+                        "user" : "Alice", "comment" : "", "*" : text } for day, text in enumerate(texts, 1) ]
+        return { "pageid" : 1, "ns" : 0, "title" : "Page", "revisions" : list(reversed(revisions)) }
+
+    def export(self, texts, convert_workers, append=False):
+        """ Export a page with revisions 'texts', return (hits, misses) of a new conversion cache """
+        cache = convcache.ConversionCache()
+        quietly(dokuwiki.Exporter(self.root, cache).write_pages, [ self.make_page(texts) ],
+                append=append, convert_workers=convert_workers)
+        return cache.hits, cache.misses
+
+    def attic(self):
+        return sorted(os.listdir(os.path.join(self.data, "attic")))
+
+    def test_cache_counts(self):
+        texts = [ "One", "Two", "One", "Three" ]
+        for convert_workers in 1, 2:
+            shutil.rmtree(self.data)
+            os.mkdir(self.data)
+            self.assertEqual(self.export(texts, convert_workers), (1, 3), convert_workers)
+            # only the new revision is converted (or looked up in the cache) when appending
+            self.assertEqual(self.export(texts + [ "Two" ], convert_workers, append=True), (0, 1), convert_workers)
+            self.assertEqual(len(self.attic()), 5)
+
+class ChangelogTests(ExportTestCase):
+    """ Merging the pages' .changes files into the wiki-wide changelog, compared against sorting all the lines """
+    def write_changes(self, name, timestamps):
+        path = os.path.join(self.data, "%s.changes" % name)
+        with codecs.open(path, "w", "utf-8") as f:
+            for position, timestamp in enumerate(timestamps):
+                f.write("%d\t::1\tE\t%s\tus\xe9r\tchange %d\n" % (timestamp, name, position))
+        return path
+
+    def merge(self, paths, fanin=dokuwiki.MERGE_FANIN):
+        """ Return the merged lines, after checking they are the same as sorting all the lines would give """
+        outpath = os.path.join(self.data, "_dokuwiki.changes")
+        dokuwiki.merge_changes(paths, outpath, fanin)
+        lines = []
+        for path in paths:
+            with open(path, "rb") as f:
+                lines += f.readlines()
+        with open(outpath, "rb") as f:
+            merged = f.readlines()
+        self.assertEqual(merged, sorted(lines, key=dokuwiki.change_timestamp)) # sorted() is stable
+        self.assertEqual(sorted(os.listdir(self.data)), sorted([ os.path.basename(path) for path in paths ] + [ "_dokuwiki.changes" ]))
+        return merged
+
+    def random_changes(self, files, seed=1):
+        rng = random.Random(seed)
+        return [ self.write_changes("page%d" % i, sorted(rng.randint(1, 50) for _ in range(rng.randint(0, 8))))
+                 for i in range(files) ]
+
+    def test_merge(self):
+        self.merge(self.random_changes(10))
+
+    def test_merge_in_runs(self):
+        paths = self.random_changes(30)
+        for fanin in 2, 3, 29:
+            self.merge(paths, fanin)
+
+    def test_unsorted_file(self):
+        paths = self.random_changes(5)
+        paths.append(self.write_changes("unsorted", [ 30, 10, 40, 10, 20 ]))
+        for fanin in 2, dokuwiki.MERGE_FANIN:
+            self.merge(paths, fanin)
+
+    def test_equal_timestamps(self):
+        paths = [ self.write_changes("page%d" % i, [ 5, 5, 10 ]) for i in range(5) ]
+        merged = self.merge(paths, fanin=2)
+        self.assertEqual([ line.split(b"\t")[3] for line in merged[:10] ], [ b"page%d" % (i // 2) for i in range(10) ])
+
+    def test_no_changes(self):
+        self.assertEqual(self.merge([]), [])
+        self.assertEqual(self.merge([ self.write_changes("empty", []) ]), [])
+
+    def test_incremental_update(self):
+        exporter = self.make_exporter()
+        first = make_page(1, "First Page", "Hello")
+        quietly(exporter.write_pages, [ first, make_page(2, "Second Page", "Hello", "2014-01-01T11:00:00Z") ])
+        # an edit to the first page (newer than the second page), and a new page
+        first["revisions"].insert(0, dict(first["revisions"][0], revid=3, parentid=1, timestamp="2014-01-02T10:00:00Z", **{ "*" : "Edited" }))
+        third = make_page(4, "Third Page", "Hello", "2014-01-02T11:00:00Z")
+        quietly(self.make_exporter().write_pages, [ first, third ], append=True)
+        changelog = os.path.join(self.data, "meta", "_dokuwiki.changes")
+        with open(changelog, "rb") as f:
+            updated = f.read()
+        self.assertEqual([ line.split(b"\t")[3] for line in updated.splitlines() ], [ b"first_page", b"second_page", b"first_page", b"third_page" ])
+        quietly(exporter.rebuild_changelogs)
+        with open(changelog, "rb") as f:
+            self.assertEqual(f.read(), updated)
+
+    def test_incremental_update_without_changelog(self):
+        exporter = self.make_exporter()
+        quietly(exporter.write_pages, [ make_page(1, "First Page", "Hello") ])
+        os.remove(os.path.join(self.data, "meta", "_dokuwiki.changes"))
+        quietly(self.make_exporter().write_pages, [ make_page(2, "Second Page", "Hello", "2014-01-01T11:00:00Z") ], append=True)
+        with open(os.path.join(self.data, "meta", "_dokuwiki.changes"), "rb") as f:
+            self.assertEqual([ line.split(b"\t")[3] for line in f ], [ b"first_page", b"second_page" ])
+
+class MissingLinksTests(ExportTestCase):
+    def test_only_missing_pages_reported(self):
+        exporter = self.make_exporter()
+        quietly(exporter.write_pages, [
+            make_page(1, "Linking Page", "[[Linked Page]] [[Missing Page|text]] [[wikipedia:Foo]] [[de:Seite]] "
+                      "[[File:Pic.png]] [[Image:Pic.png|thumb|Caption]] [[Media:Doc.pdf]] [[:File:Doc.pdf]] "
+                      "[[#Anchor]] [[http://example.org Example]]"),
+            make_page(2, "Linked Page", "Hello") ])
+        self.assertEqual(exporter.missing_links(), [ "missing_page" ])
+
+    def test_linked_pagenames(self):
+        content = ("[[page]] [[ns:other page#section|text]] [[wp>Interwiki]] [[doku>wiki:syntax|Dokuwiki]] [[\\\\server\\share]] "
+                   "[[{{file:pic.png}}]] [[linked|{{file:pic.png}}]] {{file:doc.pdf|Document}} [[http://example.org|Example]] "
+                   "[[someone@example.org]] [[#anchor]] <code>\n[[File:Pic.png]]\n</code> <nowiki>[[not a link]]</nowiki> %%[[nor this]]%%")
+        self.assertEqual(dokuwiki.get_linked_pagenames(content), set([ "page", "ns:other page", "linked" ]))
+
+    def test_report_is_capped(self):
+        exporter = self.make_exporter()
+        exporter.linked = set("missing_%02d" % i for i in range(dokuwiki.MISSING_LINKS_SHOWN + 5))
+        stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            exporter._report_missing_links()
+            report = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(len(report.splitlines()), 1)
+        self.assertTrue(report.startswith("%d pages are linked to" % (dokuwiki.MISSING_LINKS_SHOWN + 5)))
+        self.assertTrue("missing_00, missing_01" in report)
+        self.assertFalse("missing_%02d" % dokuwiki.MISSING_LINKS_SHOWN in report)
+        self.assertTrue(report.rstrip().endswith(" and 5 more"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+"""
+The HTTP session shared by the Mediawiki API importer and the image
+downloads in the Dokuwiki exporter, so all requests to the wiki server
+reuse a pool of keep-alive connections (with gzip compressed responses)
+rather than connecting again for every request.
+
+Copyright (C) 2014 Angus Gratton
+Licensed under New BSD License as described in the file LICENSE.
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+
+USER_AGENT = "yamdwe (+https://github.com/projectgus/yamdwe) %s" % requests.utils.default_user_agent()
+
+def make_session(http_user=None, http_pass=None, pool_size=10):
+    """
+    Return a requests Session which keeps up to pool_size connections open to each host,
+    and sends HTTP basic auth if http_user is set.
+
+    The session's cookies are a cookielib.CookieJar, so the same jar can be given to
+    simplemediawiki to log in with.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({ "User-Agent" : USER_AGENT,
+                             "Accept-Encoding" : "gzip, deflate",
+                             "Connection" : "keep-alive" })
+    if http_user is not None:
+        session.auth = HTTPBasicAuth(http_user, http_pass)
+    return session
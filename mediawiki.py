@@ -7,16 +7,40 @@ Licensed under New BSD License as described in the file LICENSE.
 """
 from __future__ import print_function, unicode_literals, absolute_import, division
 import simplemediawiki, simplejson
-import re
+import re, threading, time, collections
+from multiprocessing.pool import ThreadPool
 from pprint import pprint
+import workers, httpsession
 
 class Importer(object):
-    def __init__(self, api_url, http_user=None, http_pass="", wiki_user=None, wiki_pass="", wiki_domain=None, verbose=False):
+    def __init__(self, api_url, http_user=None, http_pass="", wiki_user=None, wiki_pass="", wiki_domain=None, verbose=False, fetch_workers=1,
+                 target_bytes=1024*1024, target_seconds=2.0, session=None,
+                 maxlag=5, max_rate=0):
+        """
+        session is the requests Session to make all API calls with (see httpsession.make_session()),
+        if not supplied then one is made with a connection for each fetch worker.
+
+        maxlag is sent with every API call, so the server refuses our requests while its database
+        replicas are more than this many seconds behind (None to not send it.) max_rate is the most
+        API calls per second to ever make (0 for no limit), see RequestScheduler.
+        """
         self.verbose = verbose
+        self.target_bytes = target_bytes
+        self.target_seconds = target_seconds
+        self._limits = {} # AdaptiveLimit for each batch size we choose, see _adaptive_limit()
+        self.api_url = api_url
+        self.fetch_workers = fetch_workers
+        self.maxlag = maxlag
+        self.scheduler = RequestScheduler(max_rate)
+        if session is None:
+            session = httpsession.make_session(http_user, http_pass, fetch_workers)
+        self.session = session
+        # simplemediawiki is only used to log in (and check our rights), sharing the session's cookies means every request after that is logged in
+        self.cookiejar = session.cookies
         if wiki_domain:
-            self.mw = simplemediawiki.MediaWiki(api_url, http_user=http_user, http_password=http_pass, domain=wiki_domain)
+            self.mw = simplemediawiki.MediaWiki(api_url, cookiejar=self.cookiejar, http_user=http_user, http_password=http_pass, domain=wiki_domain)
         else:
-            self.mw = simplemediawiki.MediaWiki(api_url, http_user=http_user, http_password=http_pass)
+            self.mw = simplemediawiki.MediaWiki(api_url, cookiejar=self.cookiejar, http_user=http_user, http_password=http_pass)
         # login if necessary
         if wiki_user is not None:
             print("Logging in as %s..." % wiki_user)
@@ -41,62 +65,260 @@ class Importer(object):
         if self.verbose:
             print(msg)
 
-    def get_all_pages(self):
+    def get_all_pages(self, namespace=0, title_from=None, title_to=None):
         """
         Slurp all pages down from the mediawiki instance, together with all revisions including content.
+
+        Only pages in 'namespace' are fetched. To split the wiki between several runs, title_from
+        and title_to limit the pages to titles from title_from (inclusive) up to title_to (exclusive.)
+        They are normalised as Mediawiki titles are, so "help_page" is the same as "Help page".
+
+        This is a generator, pages are yielded (in allpages order) as soon as each batch of
+        them has been fetched, so only a few batches of pages are held in memory at once.
+
         WARNING: Hits API hard, don't do this without knowledge/permission of wiki operator!!
         """
-        query = {'list' : 'allpages'}
+        query = {'list' : 'allpages', 'apnamespace' : namespace}
+        if title_from is not None:
+            query['apfrom'] = _normalise_title(title_from)
+        if title_to is not None:
+            title_to = _normalise_title(title_to)
+            query['apto'] = title_to
         print("Getting list of pages...")
-        pages = self._query(query, [ 'allpages' ])
-        self.verbose_print("Got %d pages." % len(pages))
+        pages = self._query(query, [ 'allpages' ], self._adaptive_limit('aplimit'))
+        if title_to is not None: # apto is inclusive (and, like apfrom, has no namespace prefix)
+            pages = [ page for page in pages if _unprefixed_title(page) != title_to ]
+        print("Found %d pages to export..." % len(pages))
         print("Query page revisions (this may take a while)...")
-        for page in pages:
-            self.verbose_print("Querying revisions for pageid %s (%s)..." % (page['pageid'], page['title']))
-            page["revisions"] = self._get_revisions(page)
-            self.verbose_print("Got %d revisions." % len(page["revisions"]))
-        return pages
+        for page in self._fetch_batches(_chunks(pages, self._batch_size()), self._get_revisions):
+            yield page
+
+    def get_sync_timestamp(self):
+        """
+        Return the timestamp of the most recent change on the wiki, to pass to
+        get_changed_pages() next time. Call this before fetching, so nothing changed
+        during the fetch is missed.
+        """
+        query = { 'action' : 'query', 'list' : 'recentchanges', 'rcprop' : 'timestamp', 'rclimit' : 1 }
+        changes = self._call(query)[0]['query']['recentchanges']
+        if changes:
+            return changes[0]['timestamp']
+        return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+    def get_changed_pages(self, since):
+        """
+        Yield each page with revisions made at or after the timestamp 'since', with just those
+        revisions (newest first) in the same format as get_all_pages().
+
+        Changes are found with list=recentchanges, so 'since' has to be within the time the wiki
+        keeps recent changes for ($wgRCMaxAge, 90 days by default.) Deletions, moves and uploads
+        aren't included.
+        """
+        query = { 'list' : 'recentchanges',
+                  'rcstart' : since,
+                  'rcdir' : 'newer',
+                  'rcnamespace' : '0',
+                  'rctype' : 'edit|new',
+                  'rcprop' : 'ids|title|timestamp',
+                  }
+        print("Getting list of changes since %s..." % since)
+        changes = self._query(query, [ 'recentchanges' ], self._adaptive_limit('rclimit'))
+        pages = collections.OrderedDict()
+        for change in changes:
+            page = pages.setdefault(change['pageid'], { 'pageid' : change['pageid'], 'ns' : change['ns'],
+                                                        'title' : change['title'], 'revids' : [] })
+            page['title'] = change['title'] # most recent title
+            page['revids'].append(change['revid'])
+        print("Found %d changes to %d pages to export..." % (len(changes), len(pages)))
+        for page in self._fetch_batches(_chunks(list(pages.values()), self._batch_size()), self._get_changed_revisions):
+            yield page
+
+    def _fetch_batches(self, batches, fetch):
+        """
+        Yield each page from the result of calling fetch(batch) for each batch of pages in 'batches',
+        using fetch_workers threads if there is more than one.
+        """
+        if self.fetch_workers > 1:
+            # each worker fetches one batch at a time, so no more than fetch_workers requests are ever in flight
+            pool = ThreadPool(self.fetch_workers)
+            try:
+                for batch in workers.imap_bounded(pool, fetch, batches, 2 * self.fetch_workers):
+                    self._print_batch(batch)
+                    for page in batch:
+                        yield page
+            finally:
+                pool.terminate()
+        else:
+            for batch in batches:
+                batch = fetch(batch)
+                self._print_batch(batch)
+                for page in batch:
+                    yield page
+
+    def _print_batch(self, batch):
+        if not batch:
+            return
+        self.verbose_print("Got %d revisions for %d pages (%s ... %s)." % (sum(len(page["revisions"]) for page in batch),
+                                                                           len(batch), batch[0]['title'], batch[-1]['title']))
 
-    def _get_revisions(self, page):
-        pageid = page['pageid']
+    def _batch_size(self):
+        """
+        Return the number of pageids or revids the API will accept in a single query
+        (higher if we're logged in with the apihighlimits right.)
+        """
+        return self.mw.limits(50, 500)
+
+    def _adaptive_limit(self, param, with_content=False):
+        """
+        Return the AdaptiveLimit used to size batches for the query parameter 'param'
+        (created on first use, then shared by all queries using that parameter.)
+
+        The maximum is what the server allows: 500 results for list queries, or 50 when
+        results include page content (10 times these if we have the apihighlimits right.)
+        """
+        if not param in self._limits:
+            if with_content:
+                maximum = self._batch_size()
+                initial = max(1, maximum // 5)
+            else:
+                maximum = self.mw.limits(500, 5000)
+                initial = maximum
+            self._limits[param] = AdaptiveLimit(param, maximum, initial, self.target_bytes, self.target_seconds)
+        return self._limits[param]
+
+    def _get_revisions(self, pages):
+        """
+        Return a copy of each page in 'pages' with its 'revisions' list (newest first) filled in,
+        using as few requests as possible.
+
+        First asks for the latest revision id of every page in one query, then lists
+        the revision ids of any page which has older revisions, then fetches the content of all
+        the revisions in batches of revids.
+        """
         query = { 'prop' : 'revisions',
-                  'pageids' : pageid,
-                  'rvprop' : 'timestamp|user|comment|content',
-                  'rvlimit' : '5',
+                  'pageids' : "|".join(str(page['pageid']) for page in pages),
+                  'rvprop' : 'ids',
                   }
-        revisions = self._query(query, [ 'pages', str(pageid), 'revisions' ])
-        return revisions
+        latest = {}
+        for inner in self._query_iter(query, [ 'pages' ], 'revisions'):
+            latest.update(inner)
+
+        revids = {}
+        for page in pages:
+            pageid = page['pageid']
+            try:
+                revision = latest[str(pageid)]['revisions'][0]
+            except (KeyError, IndexError):
+                revids[pageid] = []
+                continue
+            if revision.get('parentid', None) == 0: # only one revision, don't need to ask for the history
+                revids[pageid] = [ revision['revid'] ]
+            else:
+                query = { 'prop' : 'revisions',
+                          'pageids' : pageid,
+                          'rvprop' : 'ids',
+                          }
+                history = self._query(query, [ 'pages', str(pageid), 'revisions' ], self._adaptive_limit('rvlimit'))
+                revids[pageid] = [ r['revid'] for r in history ]
+
+        contents = self._get_contents([ revid for page in pages for revid in revids[page['pageid']] ])
+        result = []
+        for page in pages:
+            page = dict(page)
+            page["revisions"] = [ contents[revid] for revid in revids[page['pageid']] if revid in contents ]
+            result.append(page)
+        return result
+
+    def _get_changed_revisions(self, pages):
+        """
+        Return a copy of each page in 'pages' (as built by get_changed_pages) with the content of
+        the revisions listed in its 'revids' filled in as its 'revisions' list (newest first.)
+
+        Pages whose changed revisions can no longer be fetched (ie deleted since) are left out.
+        """
+        contents = self._get_contents([ revid for page in pages for revid in page['revids'] ])
+        result = []
+        for page in pages:
+            page = dict(page)
+            revisions = [ contents[revid] for revid in page.pop('revids') if revid in contents ]
+            if revisions:
+                page["revisions"] = sorted(revisions, key=lambda r: (r['timestamp'], r['revid']), reverse=True)
+                result.append(page)
+        return result
+
+    def _get_contents(self, revids):
+        """
+        Return a dict of revision (including content) for each revid in the list 'revids',
+        fetched in batches of revids.
+        """
+        contents = {}
+        remaining = list(revids)
+        limit = self._adaptive_limit('revids', with_content=True)
+        while remaining:
+            batch, remaining = remaining[:limit.value], remaining[limit.value:]
+            query = { 'prop' : 'revisions',
+                      'revids' : "|".join(str(revid) for revid in batch),
+                      'rvprop' : 'ids|timestamp|user|comment|content',
+                      }
+            for inner in self._query_iter(query, [ 'pages' ], 'revisions', limit):
+                for result_page in inner.values():
+                    for revision in result_page.get('revisions', []):
+                        contents[revision['revid']] = revision
+        return contents
 
     def get_all_images(self):
         """
         Slurp all images down from the mediawiki instance, latest revision of each image, only.
 
+        Each image includes its size and sha1, so the exporter can skip images it already has.
+
         WARNING: Hits API hard, don't do this without knowledge/permission of wiki operator!!
         """
-        query = {'list' : 'allimages'}
-        return self._query(query, [ 'allimages' ])
+        query = {'list' : 'allimages', 'aiprop' : 'timestamp|url|size|sha1'}
+        return self._query(query, [ 'allimages' ], self._adaptive_limit('ailimit'))
 
     def get_all_users(self):
         """
         Slurp down all usernames from the mediawiki instance.
         """
         query = {'list' : 'allusers'}
-        return self._query(query, [ 'allusers' ])
+        return self._query(query, [ 'allusers' ], self._adaptive_limit('aulimit'))
 
-    def _query(self, args, path_to_result):
+    def _query(self, args, path_to_result, limit=None):
         """
         Make a Mediawiki API query that results a list of results,
         handle the possibility of making a paginated query using query-continue
+
+        If limit is an AdaptiveLimit, it sets the size of each page of results.
         """
+        result = []
+        for inner in self._query_iter(args, path_to_result, limit=limit):
+            result += inner
+        return result
+
+    def _query_iter(self, args, path_to_result, continue_key=None, limit=None):
+        """
+        Make a (possibly paginated) Mediawiki API query, yielding the result found at
+        path_to_result in each response.
+
+        continue_key is the query-continue module to follow, default is the last element of path_to_result.
+
+        If limit is an AdaptiveLimit, it is updated with the size & latency of each response,
+        and sets its query parameter before each request (unless args already has a value for
+        that parameter, ie the caller sized a list of revids from it.)
+        """
+        if continue_key is None:
+            continue_key = path_to_result[-1]
         query = { 'action' : 'query' }
         if self.need_rawcontinue:
             query["rawcontinue"] = ""
         query.update(args)
-        result = []
         continuations = 0
         while True:
+            if limit is not None and not limit.param in args:
+                query[limit.param] = limit.value
             try:
-                response = self.mw.call(query)
+                response, nbytes, seconds = self._call(query)
             except simplejson.scanner.JSONDecodeError as e:
                 if e.pos == 0:
                     if not self.verbose:
@@ -112,7 +334,13 @@ class Importer(object):
                     inner = inner[key]
             except KeyError:
                 raise RuntimeError("Mediawiki query '%s' returned unexpected response '%s' after %d continuations" % (args, response, continuations))
-            result += inner
+            if limit is not None:
+                count = _count_results(inner)
+                used = limit.value
+                limit.update(used, count, nbytes, seconds)
+                self.verbose_print("%s %s=%d: %d results, %d bytes in %.2fs after %d continuations (next %s=%d)" %
+                                   (path_to_result[0], limit.param, used, count, nbytes, seconds, continuations, limit.param, limit.value))
+            yield inner
 
             # if there's a warning print it out (shouldn't need a debug flag since this is of interest to any user)
             if 'warnings' in response:
@@ -121,10 +349,40 @@ class Importer(object):
 
             # if there's a continuation, find the new arguments and follow them
             try:
-                query.update(response['query-continue'][path_to_result[-1]])
+                query.update(response['query-continue'][continue_key])
                 continuations += 1
             except KeyError:
-                return result
+                return
+
+    def _call(self, query):
+        """
+        Make a single API call with the shared session (safe to call from any fetch worker.) Returns a tuple of
+        the decoded response, the size of the (uncompressed) response in bytes and the time taken in seconds.
+
+        Calls are paced by the RequestScheduler. If the server says it is lagged or overloaded,
+        the call is retried after the delay it asks for (up to MAX_RETRIES times.)
+        """
+        params = dict(query, format='json')
+        if self.maxlag is not None:
+            params['maxlag'] = self.maxlag
+        for attempt in range(MAX_RETRIES + 1):
+            self.scheduler.wait()
+            start = time.time()
+            response = self.session.post(self.api_url, data=params)
+            seconds = time.time() - start
+            delay = _retry_delay(response)
+            if delay is None:
+                break
+            self.verbose_print("Mediawiki server is busy (HTTP %d%s), retrying in %d seconds..." %
+                               (response.status_code, ", %s seconds lag" % response.headers["X-Database-Lag"]
+                                if "X-Database-Lag" in response.headers else "", delay))
+            self.scheduler.backoff(delay)
+        else:
+            raise RuntimeError("Mediawiki server is still lagged or overloaded after %d retries. Try again later, or with a higher --maxlag." % MAX_RETRIES)
+        response.raise_for_status()
+        self.scheduler.success()
+        data = response.content
+        return simplejson.loads(data), len(data), seconds
 
     def get_file_namespaces(self):
         """
@@ -132,7 +390,7 @@ class Importer(object):
         Second entry is a list of all aliases used for that namespace, and aliases used for the 'media' namespace.
         """
         query = { 'action' : 'query', 'meta' : 'siteinfo', 'siprop' : 'namespaces|namespacealiases' }
-        result = self.mw.call(query)['query']
+        result = self._call(query)[0]['query']
         namespaces = result['namespaces'].values()
         aliases = result.get('namespacealiases', {})
         file_namespace = {'*' : 'Files', 'canonical' : 'File'}
@@ -157,5 +415,128 @@ class Importer(object):
         Return the title of the main Mediawiki page
         """
         query = { 'action' : 'query', 'meta' : 'siteinfo', 'siprop' : 'general' }
-        result = self.mw.call(query)['query']
+        result = self._call(query)[0]['query']
         return result['general'].get("mainpage", "Main")
+
+
+class AdaptiveLimit(object):
+    """
+    Chooses how many results to ask for in each API request, between 1 and 'maximum'
+    (the most the server allows.)
+
+    After each response the size is adjusted towards whatever would have given a response
+    of about target_bytes taking about target_seconds, so batches shrink when responses get
+    huge or slow and grow when they are small and quick. Size changes at most 2x per response.
+    """
+    def __init__(self, param, maximum, initial, target_bytes, target_seconds):
+        self.param = param
+        self.maximum = maximum
+        self.value = min(initial, maximum)
+        self.target_bytes = target_bytes
+        self.target_seconds = target_seconds
+        self._lock = threading.Lock()
+
+    def update(self, used, count, nbytes, seconds):
+        """
+        Update the limit after asking for 'used' results and getting a response with 'count' results,
+        'nbytes' long, which took 'seconds'
+        """
+        if count == 0:
+            return
+        with self._lock:
+            ideal = min(self.target_bytes * count / max(nbytes, 1),
+                        self.target_seconds * count / max(seconds, 0.001))
+            if nbytes > self.target_bytes or seconds > self.target_seconds:
+                ideal = max(ideal, used / 2) # back off
+            elif count >= used:
+                ideal = min(ideal, used * 2) # grow
+            else:
+                return # a short final batch says nothing about how big the next one should be
+            self.value = int(max(1, min(self.maximum, ideal)))
+
+class RequestScheduler(object):
+    """
+    Spaces out API calls (from all fetch workers together) so they start at least 'interval'
+    seconds apart.
+
+    The interval starts at four times the smallest allowed (1/max_rate) and shrinks by 10% after
+    every successful call, so the request rate creeps up to max_rate. Each time the server says
+    it is lagged or overloaded the interval doubles (up to MAX_INTERVAL) and no calls start until
+    the server's requested delay has passed.
+    """
+    def __init__(self, max_rate):
+        self.min_interval = 1 / max_rate if max_rate else 0
+        self.interval = min(MAX_INTERVAL, self.min_interval * 4)
+        self._next = 0 # time the next call can start
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """
+        Sleep until it's this call's turn to start
+        """
+        with self._lock:
+            now = time.time()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+    def success(self):
+        with self._lock:
+            self.interval = max(self.min_interval, self.interval * 0.9)
+
+    def backoff(self, delay):
+        """
+        Slow down after the server asked us to wait 'delay' seconds
+        """
+        with self._lock:
+            self.interval = min(MAX_INTERVAL, max(self.interval * 2, self.min_interval, 0.1))
+            self._next = max(self._next, time.time() + delay)
+
+# most times to retry an API call the server refuses because it is lagged or overloaded
+MAX_RETRIES = 10
+# longest interval between API calls the RequestScheduler slows down to
+MAX_INTERVAL = 10.0
+# delay before retrying if the server doesn't send Retry-After
+DEFAULT_RETRY_AFTER = 5
+
+def _retry_delay(response):
+    """
+    Return the number of seconds to wait before retrying the API call which got 'response',
+    or None if it doesn't need retrying.
+
+    Mediawiki answers maxlag errors with an X-Database-Lag header (HTTP 200 with a 'maxlag' error on
+    newer versions, 503 on older ones), and overloaded servers or proxies answer 429 or 503.
+    Any of these usually come with a Retry-After header.
+    """
+    if response.status_code not in (429, 503) and not "X-Database-Lag" in response.headers:
+        return None
+    try:
+        return max(1, int(response.headers.get("Retry-After", DEFAULT_RETRY_AFTER)))
+    except ValueError: # Retry-After can also be a date, but Mediawiki only sends seconds
+        return DEFAULT_RETRY_AFTER
+
+def _count_results(inner):
+    """
+    Number of results in a query response. Where the results are a dict of pages (prop=revisions)
+    this is the number of revisions.
+    """
+    if isinstance(inner, dict):
+        return sum(len(page.get('revisions', [])) for page in inner.values())
+    return len(inner)
+
+def _normalise_title(title):
+    """ 'title' the way Mediawiki stores it, with spaces for underscores and the first letter upper case """
+    title = title.replace("_", " ").strip()
+    return title[:1].upper() + title[1:]
+
+def _unprefixed_title(page):
+    """ The title of 'page' without its namespace prefix (titles in the main namespace can contain : too) """
+    if page['ns'] == 0:
+        return page['title']
+    return page['title'].split(':', 1)[-1]
+
+def _chunks(items, size):
+    """ Yield successive lists of up to 'size' items from the list 'items' """
+    for i in range(0, len(items), size):
+        yield items[i:i+size]
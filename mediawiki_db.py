@@ -0,0 +1,278 @@
+"""
+Methods for importing mediawiki pages straight from the Mediawiki
+database, as an alternative to the API importer in mediawiki.py.
+
+All revisions are read with a single query, streamed from the server
+(MySQLdb's SSCursor), so only one page (with all its revisions) is held in
+memory at a time.
+
+Assumes MySQL (like yamdwe_users.py), but the importer only needs a DB-API
+connection so an SQLite copy with the same tables works too.
+
+Copyright (C) 2014 Angus Gratton
+Licensed under New BSD License as described in the file LICENSE.
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+import itertools, zlib
+
+# Mediawiki's built in namespace names, to give titles outside the main namespace their prefix
+CANONICAL_NAMESPACES = {
+    -2 : "Media", -1 : "Special", 1 : "Talk", 2 : "User", 3 : "User talk",
+    4 : "Project", 5 : "Project talk", 6 : "File", 7 : "File talk", 8 : "MediaWiki",
+    9 : "MediaWiki talk", 10 : "Template", 11 : "Template talk", 12 : "Help",
+    13 : "Help talk", 14 : "Category", 15 : "Category talk",
+    }
+MEDIAWIKI_NAMESPACE = 8
+
+# rev_deleted bits
+DELETED_TEXT = 1
+DELETED_COMMENT = 2
+DELETED_USER = 4
+
+def connect_mysql(host, user, password, dbname):
+    """
+    Return a connection to the Mediawiki MySQL database which streams query results
+    from the server instead of fetching them all at once.
+    """
+    import MySQLdb, MySQLdb.cursors # only needed if reading from the database
+    kwargs = { "passwd" : password } if password else {}
+    return MySQLdb.connect(user=user, host=host, db=dbname, use_unicode=True, charset="utf8",
+                           cursorclass=MySQLdb.cursors.SSCursor, **kwargs)
+
+class DatabaseImporter(object):
+    def __init__(self, db, prefix="", verbose=False, namespaces=(0,)):
+        """
+        db is a DB-API connection to the Mediawiki database (see connect_mysql()), prefix is the
+        table prefix ($wgDBprefix in LocalSettings.php.)
+
+        namespaces is a list of namespace ids to import pages from. Default is only the
+        main namespace, which matches what the API importer gets from list=allpages.
+        """
+        self.db = db
+        self.prefix = prefix
+        self.verbose = verbose
+        self.namespaces = [ int(ns) for ns in namespaces ]
+        self.revision_columns = self._columns("revision")
+        # Mediawiki 1.31 moved revision content to the slots & content tables (multi-content revisions)
+        self.has_slots = not "rev_text_id" in self.revision_columns
+        print("Reading pages from Mediawiki database (%s schema)..." % ("slots" if self.has_slots else "revision text"))
+
+    def verbose_print(self, msg):
+        if self.verbose:
+            print(msg)
+
+    def get_all_pages(self):
+        """
+        Yield each page in the database, with all revisions including content, in the same
+        format as mediawiki.Importer.get_all_pages()
+        """
+        count = 0
+        cursor = self.db.cursor()
+        try:
+            cursor.execute(self._revisions_query())
+            for pageid, rows in itertools.groupby(_iter_rows(cursor), lambda row: row[0]):
+                page = None
+                for row in rows:
+                    if page is None:
+                        page = { "pageid" : pageid, "ns" : row[1], "title" : _title(row[1], row[2]), "revisions" : [] }
+                    page["revisions"].append(self._read_revision(page, row))
+                self.verbose_print("Read %d revisions of page '%s'." % (len(page["revisions"]), page["title"]))
+                count += 1
+                yield page
+        finally:
+            cursor.close()
+        print("Read %d pages from database." % count)
+
+    def get_all_images(self):
+        """
+        Image files aren't kept in the database, so there is nothing to import.
+        """
+        print("Images aren't stored in the Mediawiki database, so no images will be exported. Copy them across separately, or run yamdwe against the Mediawiki API.")
+        return []
+
+    def get_file_namespaces(self):
+        """
+        Return a tuple. First entry is the name used by default for the file namespace (which dokuwiki will also use.)
+        Second entry is a list of all aliases used for that namespace, and aliases used for the 'media' namespace.
+
+        Namespace names are set in LocalSettings.php rather than the database, so the canonical names
+        (including the old 'Image' name) are used.
+        """
+        return "File", [ "File", "Media", "Image" ]
+
+    def get_main_pagetitle(self):
+        """
+        Return the title of the main Mediawiki page, from the MediaWiki:Mainpage message if it has been edited
+        """
+        query = ("SELECT %s FROM %spage JOIN %srevision ON rev_id = page_latest %s "
+                 "WHERE page_namespace = %d AND page_title = 'Mainpage'" %
+                 (self._text_columns(), self.prefix, self.prefix, self._text_joins(), MEDIAWIKI_NAMESPACE))
+        rows = self._fetchall(query)
+        if rows and rows[0][0] is not None:
+            text, flags, address = rows[0]
+            title = _decode_text(text, flags).strip()
+            if title:
+                return title
+        return "Main Page"
+
+    def _revisions_query(self):
+        """
+        Return the query for every revision of every page in self.namespaces, ordered by page id
+        then newest revision first (the order of the revision table's rev_page/rev_timestamp index,
+        so the server doesn't have to sort all the revisions first.)
+
+        Each row is page_id, page_namespace, page_title, rev_id, rev_parent_id, rev_timestamp,
+        rev_deleted, rev_minor_edit, user name, comment, then the columns from _text_columns().
+        """
+        p = self.prefix
+        joins = []
+        # Mediawiki 1.31+ keeps user names in the actor table, 1.30+ keeps comments in the comment table.
+        # Older schemas have them in the revision table, versions in between may use a *_temp table as well.
+        if "rev_actor" in self.revision_columns:
+            actor = "rev_actor"
+            if self._has_table("revision_actor_temp"):
+                joins.append("LEFT JOIN %srevision_actor_temp ON revactor_rev = rev_id" % p)
+                actor = "COALESCE(NULLIF(rev_actor, 0), revactor_actor)"
+            joins.append("LEFT JOIN %sactor ON actor_id = %s" % (p, actor))
+            user = "COALESCE(actor_name, rev_user_text)" if "rev_user_text" in self.revision_columns else "actor_name"
+        else:
+            user = "rev_user_text"
+        if "rev_comment_id" in self.revision_columns or self._has_table("revision_comment_temp"):
+            comment_id = "rev_comment_id" if "rev_comment_id" in self.revision_columns else "revcomment_comment_id"
+            if self._has_table("revision_comment_temp"):
+                joins.append("LEFT JOIN %srevision_comment_temp ON revcomment_rev = rev_id" % p)
+                if "rev_comment_id" in self.revision_columns:
+                    comment_id = "COALESCE(NULLIF(rev_comment_id, 0), revcomment_comment_id)"
+            joins.append("LEFT JOIN %scomment ON comment_id = %s" % (p, comment_id))
+            comment = "COALESCE(comment_text, rev_comment)" if "rev_comment" in self.revision_columns else "comment_text"
+        else:
+            comment = "rev_comment"
+        return ("SELECT page_id, page_namespace, page_title, rev_id, rev_parent_id, rev_timestamp, rev_deleted, rev_minor_edit, "
+                "%s, %s, %s FROM %spage JOIN %srevision ON rev_page = page_id %s %s "
+                "WHERE page_namespace IN (%s) ORDER BY rev_page, rev_timestamp DESC, rev_id DESC" %
+                (user, comment, self._text_columns(), p, p, " ".join(joins), self._text_joins(),
+                 ", ".join(str(ns) for ns in self.namespaces)))
+
+    def _text_columns(self):
+        """ Columns selected by _text_joins(): the text, its flags, and where it is stored """
+        if self.has_slots:
+            return "old_text, old_flags, content_address"
+        return "old_text, old_flags, rev_text_id"
+
+    def _text_joins(self):
+        """ Joins from the revision table to the text table holding each revision's (main slot) content """
+        p = self.prefix
+        if self.has_slots:
+            return ("JOIN %sslots ON slot_revision_id = rev_id AND slot_role_id = %d "
+                    "JOIN %scontent ON content_id = slot_content_id "
+                    "LEFT JOIN %stext ON content_address LIKE 'tt:%%' AND old_id = CAST(SUBSTR(content_address, 4) AS UNSIGNED)" %
+                    (p, self._main_role_id(), p, p))
+        return "LEFT JOIN %stext ON old_id = rev_text_id" % p
+
+    def _main_role_id(self):
+        if not hasattr(self, "_main_role"):
+            rows = self._fetchall("SELECT role_id FROM %sslot_roles WHERE role_name = 'main'" % self.prefix)
+            self._main_role = rows[0][0] if rows else 1
+        return self._main_role
+
+    def _read_revision(self, page, row):
+        """
+        Convert a row from _revisions_query() into a revision dict with the same keys as the API returns
+        """
+        (revid, parentid, timestamp, deleted, minor, user, comment, text, flags, address) = row[3:]
+        revision = { "revid" : revid,
+                     "parentid" : parentid or 0,
+                     "timestamp" : _timestamp(timestamp),
+                     "user" : _decode(user),
+                     "comment" : _decode(comment),
+                     }
+        if minor:
+            revision["minor"] = ""
+        # suppressed users/comments/content are flagged the same way the API flags them
+        if deleted & DELETED_USER:
+            revision["user"] = ""
+            revision["userhidden"] = ""
+        if deleted & DELETED_COMMENT:
+            revision["comment"] = ""
+            revision["commenthidden"] = ""
+        if deleted & DELETED_TEXT:
+            revision["*"] = ""
+            revision["texthidden"] = ""
+        elif text is None:
+            raise RuntimeError("Revision %d of page '%s' is stored at '%s', which isn't in the text table. Yamdwe can't read external storage, "
+                               "use the Mediawiki API or an XML dump instead." % (revid, page["title"], _decode(address)))
+        else:
+            try:
+                revision["*"] = _decode_text(text, flags)
+            except ValueError as e:
+                raise RuntimeError("Can't read revision %d of page '%s': %s" % (revid, page["title"], e))
+        return revision
+
+    def _columns(self, table):
+        cursor = self.db.cursor()
+        try:
+            cursor.execute("SELECT * FROM %s%s LIMIT 0" % (self.prefix, table))
+            cursor.fetchall()
+            return set(column[0] for column in cursor.description)
+        finally:
+            cursor.close()
+
+    def _has_table(self, table):
+        try:
+            self._columns(table)
+            return True
+        except Exception: # each DB-API module has its own exception classes
+            return False
+
+    def _fetchall(self, query):
+        cursor = self.db.cursor()
+        try:
+            cursor.execute(query)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+def _decode(value):
+    """ Binary columns come back as byte strings, return unicode """
+    if value is None:
+        return ""
+    if isinstance(value, (bytes, bytearray, buffer)):
+        return bytes(value).decode("utf-8", "replace")
+    return unicode(value)
+
+def _iter_rows(cursor, size=1000):
+    """ Yield each row of a query result, fetching them from the server 'size' rows at a time """
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        for row in rows:
+            yield row
+
+def _decode_text(text, flags):
+    """
+    Return the content of a text table row as unicode, given its old_text and old_flags
+    """
+    flags = _decode(flags).split(",")
+    if "object" in flags or "external" in flags:
+        raise ValueError("text is stored as a serialized object or in external storage (flags '%s'), which yamdwe can't read" % ",".join(flags))
+    text = text.encode("utf-8") if isinstance(text, unicode) else bytes(text)
+    if "gzip" in flags:
+        text = zlib.decompress(text, -zlib.MAX_WBITS) # raw deflate, as PHP's gzdeflate()
+    try:
+        return text.decode("utf-8")
+    except UnicodeDecodeError:
+        if "utf-8" in flags or "utf8" in flags:
+            raise ValueError("text is flagged as utf-8 but isn't valid utf-8")
+        return text.decode("latin-1") # saved before the wiki was converted to UTF-8 ($wgLegacyEncoding)
+
+def _title(namespace, title):
+    title = _decode(title).replace("_", " ")
+    if namespace == 0:
+        return title
+    return "%s:%s" % (CANONICAL_NAMESPACES.get(namespace, "Namespace %d" % namespace), title)
+
+def _timestamp(timestamp):
+    """ Convert a Mediawiki database timestamp (20140123123456) to an API timestamp (2014-01-23T12:34:56Z) """
+    t = _decode(timestamp)
+    return "%s-%s-%sT%s:%s:%sZ" % (t[0:4], t[4:6], t[6:8], t[8:10], t[10:12], t[12:14])
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""Tests for reading pages straight from the Mediawiki database, using SQLite
+copies of the pre-1.31 (revision text) and 1.31+ (slots, actor & comment tables) schemas.
+
+Copyright (C) 2014 Angus Gratton
+Licensed under New BSD License as described in the file LICENSE.
+
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+import sqlite3, zlib, unittest
+import mediawiki_db
+from mediawiki_tests import assertPageShape, quietly
+
+# (page_id, page_namespace, page_title, page_latest)
+PAGES = [ (1, 0, "Front_Page", 12),
+          (2, 1, "Front_Page", 13),
+          (3, 0, "Sm\xf8rrebr\xf8d", 14),
+          (4, 8, "Mainpage", 15) ]
+
+# (rev_id, rev_page, rev_parent_id, rev_timestamp, rev_deleted, rev_minor_edit, user, comment, text, old_flags)
+REVISIONS = [ (10, 1, 0, "20140101100000", 0, 0, "Alice", "First", "Hello '''wiki'''", "gzip,utf-8"),
+              (11, 1, 10, "20140102100000", mediawiki_db.DELETED_USER, 1, "Mallory", "Hidden user", "Hello", "utf-8"),
+              (12, 1, 11, "20140103100000", mediawiki_db.DELETED_TEXT | mediawiki_db.DELETED_COMMENT, 0, "192.168.0.1", "Spam", "Spam", "utf-8"),
+              (13, 2, 0, "20140104100000", 0, 0, "Bob", "", "Talk", "utf-8"),
+              (14, 3, 0, "20140105100000", 0, 0, "Bob", "[[File:Br\xf8d.png]]", "[[File:Br\xf8d.png]] & <b>", "utf-8"),
+              (15, 4, 0, "20140106100000", 0, 0, "Alice", "", "Front Page\n", "utf-8") ]
+
+def _text_row(rev_id, text, flags):
+    """ (old_id, old_text, old_flags) as Mediawiki stores them """
+    text = text.encode("utf-8")
+    if "gzip" in flags:
+        compress = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS) # raw deflate, as PHP's gzdeflate()
+        text = compress.compress(text) + compress.flush()
+    return (rev_id + 100, buffer(text), flags)
+
+def make_old_schema(db):
+    """ Mediawiki 1.30 and older: user names & comments in the revision table, content in the text table """
+    db.executescript("""
+        CREATE TABLE page (page_id INTEGER, page_namespace INTEGER, page_title BLOB, page_latest INTEGER);
+        CREATE TABLE revision (rev_id INTEGER, rev_page INTEGER, rev_text_id INTEGER, rev_comment BLOB, rev_user INTEGER,
+            rev_user_text TEXT, rev_timestamp TEXT, rev_minor_edit INTEGER, rev_deleted INTEGER, rev_parent_id INTEGER);
+        CREATE TABLE text (old_id INTEGER, old_text BLOB, old_flags BLOB);
+        """)
+    db.executemany("INSERT INTO page VALUES (?, ?, ?, ?)", PAGES)
+    for (rev_id, page, parent, timestamp, deleted, minor, user, comment, text, flags) in REVISIONS:
+        text_row = _text_row(rev_id, text, flags)
+        db.execute("INSERT INTO revision VALUES (?, ?, ?, ?, 0, ?, ?, ?, ?, ?)",
+                   (rev_id, page, text_row[0], comment, user, timestamp, minor, deleted, parent))
+        db.execute("INSERT INTO text VALUES (?, ?, ?)", text_row)
+
+def make_slots_schema(db):
+    """
+    Mediawiki 1.31+: content in the slots & content tables, user names in the actor table and
+    comments in the comment table. Revisions with rev_actor/rev_comment_id 0 haven't been
+    migrated out of the revision_actor_temp & revision_comment_temp tables yet.
+    """
+    db.executescript("""
+        CREATE TABLE page (page_id INTEGER, page_namespace INTEGER, page_title BLOB, page_latest INTEGER);
+        CREATE TABLE revision (rev_id INTEGER, rev_page INTEGER, rev_comment_id INTEGER, rev_actor INTEGER,
+            rev_timestamp TEXT, rev_minor_edit INTEGER, rev_deleted INTEGER, rev_parent_id INTEGER);
+        CREATE TABLE revision_actor_temp (revactor_rev INTEGER, revactor_actor INTEGER);
+        CREATE TABLE revision_comment_temp (revcomment_rev INTEGER, revcomment_comment_id INTEGER);
+        CREATE TABLE actor (actor_id INTEGER, actor_name BLOB);
+        CREATE TABLE comment (comment_id INTEGER, comment_text BLOB);
+        CREATE TABLE slot_roles (role_id INTEGER, role_name TEXT);
+        CREATE TABLE slots (slot_revision_id INTEGER, slot_role_id INTEGER, slot_content_id INTEGER);
+        CREATE TABLE content (content_id INTEGER, content_address BLOB);
+        CREATE TABLE text (old_id INTEGER, old_text BLOB, old_flags BLOB);
+        INSERT INTO slot_roles VALUES (1, 'main'), (2, 'mediainfo');
+        """)
+    db.executemany("INSERT INTO page VALUES (?, ?, ?, ?)", PAGES)
+    actors = {}
+    for (rev_id, page, parent, timestamp, deleted, minor, user, comment, text, flags) in REVISIONS:
+        if not user in actors:
+            actors[user] = len(actors) + 1
+            db.execute("INSERT INTO actor VALUES (?, ?)", (actors[user], user))
+        db.execute("INSERT INTO comment VALUES (?, ?)", (rev_id, comment))
+        migrated = rev_id % 2 == 0
+        db.execute("INSERT INTO revision VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                   (rev_id, page, rev_id if migrated else 0, actors[user] if migrated else 0, timestamp, minor, deleted, parent))
+        if not migrated:
+            db.execute("INSERT INTO revision_actor_temp VALUES (?, ?)", (rev_id, actors[user]))
+            db.execute("INSERT INTO revision_comment_temp VALUES (?, ?)", (rev_id, rev_id))
+        text_row = _text_row(rev_id, text, flags)
+        db.execute("INSERT INTO text VALUES (?, ?, ?)", text_row)
+        db.execute("INSERT INTO content VALUES (?, ?)", (rev_id, "tt:%d" % text_row[0]))
+        db.execute("INSERT INTO slots VALUES (?, 1, ?)", (rev_id, rev_id))
+        # another slot's content mustn't be mistaken for the page text
+        db.execute("INSERT INTO content VALUES (?, ?)", (rev_id + 1000, "tt:999"))
+        db.execute("INSERT INTO slots VALUES (?, 2, ?)", (rev_id, rev_id + 1000))
+
+class DatabaseImporterTests(unittest.TestCase):
+    def read_pages(self, make_schema):
+        db = sqlite3.connect(":memory:")
+        make_schema(db)
+        importer = quietly(mediawiki_db.DatabaseImporter, db)
+        return importer, quietly(importer.get_all_pages)
+
+    def check_pages(self, importer, pages):
+        self.assertEqual([ page["title"] for page in pages ], [ "Front Page", "Sm\xf8rrebr\xf8d" ]) # not the Talk: page
+        for page in pages:
+            assertPageShape(self, page)
+        front = pages[0]
+        self.assertEqual((front["pageid"], front["ns"]), (1, 0))
+        self.assertEqual([ revision["revid"] for revision in front["revisions"] ], [ 12, 11, 10 ])
+        self.assertEqual([ revision["parentid"] for revision in front["revisions"] ], [ 11, 10, 0 ])
+        latest, hidden_user, first = front["revisions"]
+        self.assertEqual(first, { "revid" : 10, "parentid" : 0, "timestamp" : "2014-01-01T10:00:00Z",
+                                  "user" : "Alice", "comment" : "First", "*" : "Hello '''wiki'''" })
+        self.assertEqual((hidden_user["user"], hidden_user["userhidden"], hidden_user["comment"], hidden_user["*"], hidden_user["minor"]),
+                         ("", "", "Hidden user", "Hello", ""))
+        self.assertEqual((latest["user"], latest["comment"], latest["commenthidden"], latest["*"], latest["texthidden"]),
+                         ("192.168.0.1", "", "", "", ""))
+        self.assertEqual(pages[1]["revisions"][0]["comment"], "[[File:Br\xf8d.png]]")
+        self.assertEqual(pages[1]["revisions"][0]["*"], "[[File:Br\xf8d.png]] & <b>")
+        self.assertEqual(importer.get_main_pagetitle(), "Front Page")
+        self.assertEqual(importer.get_file_namespaces(), ("File", [ "File", "Media", "Image" ]))
+
+    def test_old_schema(self):
+        importer, pages = self.read_pages(make_old_schema)
+        self.assertFalse(importer.has_slots)
+        self.check_pages(importer, pages)
+
+    def test_slots_schema(self):
+        importer, pages = self.read_pages(make_slots_schema)
+        self.assertTrue(importer.has_slots)
+        self.check_pages(importer, pages)
+        self.assertEqual(pages, self.read_pages(make_old_schema)[1])
+
+    def test_namespaces(self):
+        db = sqlite3.connect(":memory:")
+        make_old_schema(db)
+        importer = quietly(mediawiki_db.DatabaseImporter, db, namespaces=(0, 1))
+        pages = quietly(importer.get_all_pages)
+        self.assertEqual([ (page["ns"], page["title"]) for page in pages ],
+                         [ (0, "Front Page"), (1, "Talk:Front Page"), (0, "Sm\xf8rrebr\xf8d") ])
+
+    def test_default_main_page(self):
+        db = sqlite3.connect(":memory:")
+        make_old_schema(db)
+        db.execute("DELETE FROM page WHERE page_namespace = 8")
+        importer = quietly(mediawiki_db.DatabaseImporter, db)
+        self.assertEqual(importer.get_main_pagetitle(), "Main Page")
+
+    def test_external_storage(self):
+        db = sqlite3.connect(":memory:")
+        make_slots_schema(db)
+        db.execute("UPDATE content SET content_address = 'es:DB://cluster1/10' WHERE content_id = 10")
+        importer = quietly(mediawiki_db.DatabaseImporter, db)
+        self.assertRaises(RuntimeError, quietly, importer.get_all_pages)
+
+if __name__ == "__main__":
+    unittest.main()
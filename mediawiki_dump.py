@@ -0,0 +1,194 @@
+"""
+Methods for importing mediawiki pages from an XML dump file (as made
+by maintenance/dumpBackup.php or Special:Export), as an alternative to
+the API importer in mediawiki.py.
+
+The dump is parsed incrementally, so only one page (with all its revisions)
+is held in memory at a time. Dumps may be plain XML or compressed with gzip
+or bzip2.
+
+Copyright (C) 2014 Angus Gratton
+Licensed under New BSD License as described in the file LICENSE.
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+import gzip, bz2, urllib, urlparse
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
+FILE_NAMESPACE = "6"
+MEDIA_NAMESPACE = "-2"
+
+class DumpImporter(object):
+    def __init__(self, dump_path, verbose=False, namespaces=(0,)):
+        """
+        dump_path is the path to the XML dump file.
+
+        namespaces is a list of namespace ids to import pages from. Default is only the
+        main namespace, which matches what the API importer gets from list=allpages.
+        """
+        self.path = dump_path
+        self.verbose = verbose
+        self.namespaces = set(int(ns) for ns in namespaces)
+        self.siteinfo = self._read_siteinfo()
+        print("Reading pages from %s dump %s..." % (self.siteinfo.get("generator", "Mediawiki"), dump_path))
+
+    def verbose_print(self, msg):
+        if self.verbose:
+            print(msg)
+
+    def get_all_pages(self):
+        """
+        Yield each page in the dump, with all revisions including content, in the same
+        format as mediawiki.Importer.get_all_pages()
+        """
+        count = 0
+        for elem, root in self._iter_elements("page"):
+            page = self._read_page(elem)
+            elem.clear()
+            root.clear() # drop the references the root holds to finished pages
+            if page["ns"] not in self.namespaces:
+                continue
+            self.verbose_print("Read %d revisions of page '%s'." % (len(page["revisions"]), page["title"]))
+            count += 1
+            yield page
+        print("Read %d pages from dump." % count)
+
+    def get_all_images(self):
+        """
+        XML dumps don't contain any images, so there is nothing to import.
+        """
+        print("XML dumps don't include images, so no images will be exported. Copy them across separately, or run yamdwe against the Mediawiki API.")
+        return []
+
+    def get_file_namespaces(self):
+        """
+        Return a tuple. First entry is the name used by default for the file namespace (which dokuwiki will also use.)
+        Second entry is a list of all aliases used for that namespace, and aliases used for the 'media' namespace.
+
+        Dumps don't list namespace aliases, so the canonical names (including the old 'Image' name) are used.
+        """
+        namespaces = self.siteinfo["namespaces"]
+        file_namespace = namespaces.get(FILE_NAMESPACE, "File")
+        aliases = [ "File", "Media", namespaces.get(MEDIA_NAMESPACE, "Media"), "Image", file_namespace ]
+        return file_namespace, sorted(set(aliases), key=aliases.index)
+
+    def get_main_pagetitle(self):
+        """
+        Return the title of the main Mediawiki page, found from the URL in <base>
+        """
+        url = urlparse.urlparse(self.siteinfo.get("base", ""))
+        title = urlparse.parse_qs(url.query).get("title", [ url.path.rsplit("/", 1)[-1] ])[0]
+        title = urllib.unquote(title.encode("utf-8")).decode("utf-8").replace("_", " ")
+        return title or "Main"
+
+    def _read_siteinfo(self):
+        """
+        Read the <siteinfo> header from the start of the dump, return a dict with
+        the generator, base URL & a dict of namespace names keyed by namespace id.
+        """
+        siteinfo = { "namespaces" : {} }
+        for elem, root in self._iter_elements("siteinfo"):
+            for child in elem:
+                tag = _localname(child.tag)
+                if tag in ("sitename", "base", "generator", "case"):
+                    siteinfo[tag] = _text(child)
+                elif tag == "namespaces":
+                    for namespace in child:
+                        siteinfo["namespaces"][namespace.get("key")] = _text(namespace)
+            break # no need to read the rest of the file
+        return siteinfo
+
+    def _iter_elements(self, name):
+        """
+        Incrementally parse the dump, yielding (element, root element) for each completed
+        element with local tag 'name'.
+        """
+        f = _open_dump(self.path)
+        try:
+            root = None
+            # (cElementTree wants byte strings for the event names, not unicode literals)
+            for event, elem in ElementTree.iterparse(f, events=(str("start"), str("end"))):
+                if root is None:
+                    root = elem
+                if event == "end" and _localname(elem.tag) == name:
+                    yield elem, root
+        finally:
+            f.close()
+
+    def _read_page(self, elem):
+        """
+        Convert a <page> element into a page dict, revisions sorted newest first
+        (as the API returns them.)
+        """
+        page = { "revisions" : [] }
+        for child in elem:
+            tag = _localname(child.tag)
+            if tag == "title":
+                page["title"] = _text(child)
+            elif tag == "ns":
+                page["ns"] = int(child.text)
+            elif tag == "id":
+                page["pageid"] = int(child.text)
+            elif tag == "revision":
+                page["revisions"].append(_read_revision(child))
+        if not "ns" in page: # dump format 0.4 and older have no <ns> element
+            page["ns"] = self._namespace_from_title(page["title"])
+        page["revisions"].reverse() # dump is oldest first
+        return page
+
+    def _namespace_from_title(self, title):
+        if ":" in title:
+            prefix = title.split(":", 1)[0]
+            for key, name in self.siteinfo["namespaces"].items():
+                if name and name.lower() == prefix.lower():
+                    return int(key)
+        return 0
+
+def _read_revision(elem):
+    """
+    Convert a <revision> element into a revision dict with the same keys as the API returns
+    """
+    revision = { "comment" : "", "parentid" : 0 } # the first revision has no <parentid>, the API gives 0
+    for child in elem:
+        tag = _localname(child.tag)
+        if tag == "id":
+            revision["revid"] = int(child.text)
+        elif tag == "parentid":
+            revision["parentid"] = int(child.text)
+        elif tag == "timestamp":
+            revision["timestamp"] = _text(child)
+        elif tag == "comment":
+            revision["comment"] = _text(child)
+        elif tag == "minor":
+            revision["minor"] = ""
+        elif tag == "contributor":
+            for field in child:
+                if _localname(field.tag) in ("username", "ip"):
+                    revision["user"] = _text(field)
+        elif tag == "text":
+            if child.get("deleted") is None:
+                revision["*"] = _text(child)
+    # suppressed users/content are flagged the same way the API flags them
+    if not "user" in revision:
+        revision["user"] = ""
+        revision["userhidden"] = ""
+    if not "*" in revision:
+        revision["*"] = ""
+        revision["texthidden"] = ""
+    return revision
+
+def _open_dump(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    elif path.endswith(".bz2"):
+        return bz2.BZ2File(path, "rb")
+    return open(path, "rb")
+
+def _localname(tag):
+    """ Strip the {namespace} from an ElementTree tag (dumps are namespaced by export format version) """
+    return tag.rsplit("}", 1)[-1]
+
+def _text(elem):
+    return unicode(elem.text or "")
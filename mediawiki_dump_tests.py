@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""Tests for reading pages from Mediawiki XML dumps.
+
+Copyright (C) 2014 Angus Gratton
+Licensed under New BSD License as described in the file LICENSE.
+
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+import os, gzip, shutil, tempfile, unittest
+import mediawiki_dump
+from mediawiki_tests import assertPageShape, quietly
+
+DUMP = """<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" version="0.10" xml:lang="en">
+  <siteinfo>
+    <sitename>Test Wiki</sitename>
+    <dbname>testwiki</dbname>
+    <base>http://wiki.example.org/index.php/Front_Page</base>
+    <generator>MediaWiki 1.27.1</generator>
+    <case>first-letter</case>
+    <namespaces>
+      <namespace key="-2" case="first-letter">Medium</namespace>
+      <namespace key="0" case="first-letter" />
+      <namespace key="1" case="first-letter">Talk</namespace>
+      <namespace key="6" case="first-letter">Datei</namespace>
+    </namespaces>
+  </siteinfo>
+  <page>
+    <title>Front Page</title>
+    <ns>0</ns>
+    <id>1</id>
+    <revision>
+      <id>10</id>
+      <timestamp>2014-01-01T10:00:00Z</timestamp>
+      <contributor><username>Alice</username><id>1</id></contributor>
+      <comment>First</comment>
+      <model>wikitext</model>
+      <format>text/x-wiki</format>
+      <text xml:space="preserve" bytes="13">Hello '''wiki'''</text>
+    </revision>
+    <revision>
+      <id>11</id>
+      <parentid>10</parentid>
+      <timestamp>2014-01-02T10:00:00Z</timestamp>
+      <contributor deleted="deleted" />
+      <minor />
+      <comment>Hidden user</comment>
+      <text xml:space="preserve" bytes="5">Hello</text>
+    </revision>
+    <revision>
+      <id>12</id>
+      <parentid>11</parentid>
+      <timestamp>2014-01-03T10:00:00Z</timestamp>
+      <contributor><ip>192.168.0.1</ip></contributor>
+      <text deleted="deleted" />
+    </revision>
+  </page>
+  <page>
+    <title>Talk:Front Page</title>
+    <ns>1</ns>
+    <id>2</id>
+    <revision>
+      <id>13</id>
+      <timestamp>2014-01-04T10:00:00Z</timestamp>
+      <contributor><username>Bob</username><id>2</id></contributor>
+      <text xml:space="preserve">Talk</text>
+    </revision>
+  </page>
+  <page>
+    <title>Sm\xf8rrebr\xf8d</title>
+    <ns>0</ns>
+    <id>3</id>
+    <revision>
+      <id>14</id>
+      <timestamp>2014-01-05T10:00:00Z</timestamp>
+      <contributor><username>Bob</username><id>2</id></contributor>
+      <comment>[[Datei:Br\xf8d.png]]</comment>
+      <text xml:space="preserve">[[Datei:Br\xf8d.png]] &amp; &lt;b&gt;</text>
+    </revision>
+  </page>
+</mediawiki>
+"""
+
+class DumpImporterTests(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "dump.xml")
+        with open(self.path, "wb") as f:
+            f.write(DUMP.encode("utf-8"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def read_pages(self, path):
+        importer = quietly(mediawiki_dump.DumpImporter, path)
+        return importer, quietly(importer.get_all_pages)
+
+    def test_pages(self):
+        importer, pages = self.read_pages(self.path)
+        self.assertEqual([ page["title"] for page in pages ], [ "Front Page", "Sm\xf8rrebr\xf8d" ]) # not the Talk: page
+        for page in pages:
+            assertPageShape(self, page)
+        front = pages[0]
+        self.assertEqual((front["pageid"], front["ns"]), (1, 0))
+        self.assertEqual([ revision["revid"] for revision in front["revisions"] ], [ 12, 11, 10 ])
+        self.assertEqual([ revision["parentid"] for revision in front["revisions"] ], [ 11, 10, 0 ])
+        oldest = front["revisions"][-1]
+        self.assertEqual((oldest["user"], oldest["comment"], oldest["*"]), ("Alice", "First", "Hello '''wiki'''"))
+        self.assertEqual(pages[1]["revisions"][0]["*"], "[[Datei:Br\xf8d.png]] & <b>")
+
+    def test_deleted_fields(self):
+        importer, pages = self.read_pages(self.path)
+        latest, hidden_user, first = pages[0]["revisions"]
+        self.assertEqual((hidden_user["user"], hidden_user["userhidden"], hidden_user["*"]), ("", "", "Hello"))
+        self.assertTrue("minor" in hidden_user)
+        self.assertEqual((latest["user"], latest["comment"], latest["*"], latest["texthidden"]), ("192.168.0.1", "", "", ""))
+        self.assertFalse("texthidden" in first or "userhidden" in first)
+
+    def test_siteinfo(self):
+        importer, pages = self.read_pages(self.path)
+        self.assertEqual(importer.get_main_pagetitle(), "Front Page")
+        self.assertEqual(importer.get_file_namespaces(), ("Datei", [ "File", "Media", "Medium", "Image", "Datei" ]))
+        self.assertEqual(quietly(importer.get_all_images), [])
+
+    def test_compressed(self):
+        gzpath = self.path + ".gz"
+        with open(self.path, "rb") as src:
+            with gzip.open(gzpath, "wb") as dst:
+                dst.write(src.read())
+        self.assertEqual(self.read_pages(gzpath)[1], self.read_pages(self.path)[1])
+
+    def test_namespace_from_title(self):
+        # export format 0.4 and older have no <ns> element
+        with open(self.path, "wb") as f:
+            f.write(DUMP.replace("<ns>1</ns>", "").replace("<ns>0</ns>", "").encode("utf-8"))
+        importer, pages = self.read_pages(self.path)
+        self.assertEqual([ page["title"] for page in pages ], [ "Front Page", "Sm\xf8rrebr\xf8d" ])
+
+if __name__ == "__main__":
+    unittest.main()
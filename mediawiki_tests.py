@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""Tests for the Mediawiki API importer, run against the stand-in API in mockwiki.py.
+
+Also has the checks that pages from the other importers (dumps, the database,
+stores) are in the same form as the ones the API importer returns.
+
+Copyright (C) 2014 Angus Gratton
+Licensed under New BSD License as described in the file LICENSE.
+
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+import sys, os, unittest
+import mediawiki, mockwiki
+
+# keys of every revision, whichever importer it comes from (the API adds contentformat & contentmodel.)
+# Strings may be str or unicode, as simplejson decodes ASCII-only strings to str
+REVISION_KEYS = set([ "revid", "parentid", "timestamp", "user", "comment", "*" ])
+PAGE_KEYS = set([ "pageid", "ns", "title", "revisions" ])
+
+def make_importer(server):
+    """ A mediawiki.Importer for the MockWikiServer 'server', without rate limiting or output """
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        return mediawiki.Importer(server.api_url, max_rate=0)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+def quietly(func, *args, **kwargs):
+    """ Call func, hiding what it prints, and return its result (as a list, if it's a generator) """
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        result = func(*args, **kwargs)
+        if hasattr(result, "next"):
+            result = list(result)
+        return result
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+def api_pages(wiki, **kwargs):
+    """ Fetch all the pages of the mockwiki.SyntheticWiki 'wiki' with the API importer """
+    server = mockwiki.MockWikiServer(wiki)
+    server.start()
+    try:
+        return quietly(make_importer(server).get_all_pages, **kwargs)
+    finally:
+        server.stop()
+
+def assertPageShape(testcase, page):
+    """ Check 'page' has the keys & types of a page from mediawiki.Importer.get_all_pages() """
+    testcase.assertEqual(set(page), PAGE_KEYS)
+    testcase.assertTrue(isinstance(page["pageid"], int))
+    testcase.assertTrue(isinstance(page["ns"], int))
+    testcase.assertTrue(isinstance(page["title"], basestring))
+    for revision in page["revisions"]:
+        testcase.assertTrue(REVISION_KEYS <= set(revision), "revision %s is missing %s" % (revision.get("revid"), REVISION_KEYS - set(revision)))
+        for key in "revid", "parentid":
+            testcase.assertTrue(isinstance(revision[key], int))
+        for key in "timestamp", "user", "comment", "*":
+            testcase.assertTrue(isinstance(revision[key], basestring))
+    timestamps = [ revision["timestamp"] for revision in page["revisions"] ]
+    testcase.assertEqual(timestamps, sorted(timestamps, reverse=True), "revisions are newest first")
+
+class ImporterTests(unittest.TestCase):
+    def test_all_pages(self):
+        wiki = mockwiki.make_wiki(pages=5, revisions=3, kb=1, images=0)
+        pages = api_pages(wiki)
+        self.assertEqual(sorted(page["title"] for page in pages), sorted(page["title"] for page in wiki.pages))
+        for page in pages:
+            assertPageShape(self, page)
+            original = wiki.pages_by_id[page["pageid"]]
+            self.assertEqual([ revision["*"] for revision in page["revisions"] ],
+                             [ revision["*"] for revision in reversed(original["revisions"]) ])
+
+    def test_title_range(self):
+        wiki = mockwiki.make_wiki(pages=8, revisions=1, kb=1, images=0)
+        titles = sorted(page["title"] for page in wiki.pages)
+        pages = api_pages(wiki, title_from=titles[2], title_to=titles[5])
+        self.assertEqual(sorted(page["title"] for page in pages), titles[2:5])
+
+    def test_title_range_normalised(self):
+        wiki = mockwiki.make_wiki(pages=8, revisions=1, kb=1, images=0)
+        titles = sorted(page["title"] for page in wiki.pages)
+        as_typed = lambda title: title[0].lower() + title[1:].replace(" ", "_") # ie "apple_5" for "Apple 5"
+        pages = api_pages(wiki, title_from=as_typed(titles[2]), title_to=as_typed(titles[5]))
+        self.assertEqual(sorted(page["title"] for page in pages), titles[2:5])
+
+    def test_title_range_in_namespace(self):
+        wiki = mockwiki.make_wiki(pages=8, revisions=1, kb=1, images=0)
+        for page in wiki.pages[:6]:
+            page["ns"] = 12
+            page["title"] = "Help:" + page["title"]
+        titles = sorted(page["title"][len("Help:"):] for page in wiki.pages[:6])
+        # apfrom & apto are titles without the namespace prefix
+        pages = api_pages(wiki, namespace=12, title_from=titles[1], title_to=titles[4])
+        self.assertEqual(sorted(page["title"] for page in pages), [ "Help:" + title for title in titles[1:4] ])
+        pages = api_pages(wiki, namespace=12, title_to=titles[0])
+        self.assertEqual(pages, [])
+        self.assertEqual(sorted(page["title"] for page in api_pages(wiki)), sorted(page["title"] for page in wiki.pages[6:]))
+
+class AdaptiveLimitTests(unittest.TestCase):
+    """ Batch sizes, aiming for responses of 1 MB taking 1 second """
+    def make_limit(self, initial=100, maximum=500):
+        return mediawiki.AdaptiveLimit("rvlimit", maximum, initial, 1000000, 1.0)
+
+    def test_backs_off_when_oversized(self):
+        limit = self.make_limit()
+        limit.update(100, 100, 4000000, 0.1)
+        self.assertEqual(limit.value, 50) # at most halved, although 25 would hit the target
+        limit.update(50, 50, 1500000, 0.1)
+        self.assertEqual(limit.value, 33)
+
+    def test_backs_off_when_slow(self):
+        limit = self.make_limit()
+        limit.update(100, 100, 1000, 4.0)
+        self.assertEqual(limit.value, 50)
+        limit.update(50, 50, 1000, 1.25)
+        self.assertEqual(limit.value, 40)
+
+    def test_grows_to_maximum(self):
+        limit = self.make_limit()
+        values = []
+        for _ in range(4):
+            limit.update(limit.value, limit.value, 1000, 0.01)
+            values.append(limit.value)
+        self.assertEqual(values, [ 200, 400, 500, 500 ]) # at most doubled each time
+
+    def test_settles_on_target(self):
+        limit = self.make_limit()
+        limit.update(100, 100, 500000, 0.1)
+        self.assertEqual(limit.value, 200)
+        limit.update(200, 200, 1000000, 0.2)
+        self.assertEqual(limit.value, 200)
+
+    def test_short_final_batch(self):
+        limit = self.make_limit()
+        limit.update(100, 10, 1000, 0.01) # fewer results than asked for, ie the last of them
+        self.assertEqual(limit.value, 100)
+        limit.update(100, 0, 0, 0.01)
+        self.assertEqual(limit.value, 100)
+
+    def test_bounds(self):
+        self.assertEqual(self.make_limit(initial=1000).value, 500)
+        limit = self.make_limit(initial=1)
+        limit.update(1, 1, 100000000, 100.0)
+        self.assertEqual(limit.value, 1)
+
+if __name__ == "__main__":
+    unittest.main()
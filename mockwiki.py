@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+"""
+A synthetic Mediawiki, served over HTTP by a local stand-in for the
+Mediawiki API, so the whole fetch->convert->write path of yamdwe can be
+run (and timed) without a real wiki.
+
+make_wiki() generates the pages, revisions and images. MockWikiServer
+answers the api.php queries mediawiki.Importer makes (siteinfo,
+userinfo, allpages, revisions, recentchanges and allimages, with
+query-continue paging) and serves the images from /images/.
+
+Run on its own to serve a synthetic wiki until interrupted:
+
+mockwiki.py [--pages N] [--revisions N] [--kb N] [--images N] [--port PORT]
+
+Copyright (C) 2014 Angus Gratton
+Licensed under New BSD License as described in the file LICENSE.
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+import argparse, random, threading, time, json, hashlib, urlparse, urllib, calendar
+import BaseHTTPServer, SocketServer
+
+GENERATOR = "MediaWiki 1.27.1"
+MAIN_PAGE = "Main Page"
+USERS = [ "Admin", "Alice Example", "Bob", "192.168.0.12", "Carol_Editor" ]
+WORDS = ("the of and to in is was for on that with as by at from wiki page history revision section editor "
+         "server config install backup release module format table image archive export").split()
+START_TIMESTAMP = calendar.timegm((2014, 1, 1, 0, 0, 0))
+
+class SyntheticWiki(object):
+    """
+    The content of a generated wiki. pages is a list of dicts (pageid, ns, title, revisions) with
+    the revisions oldest first, each a dict in the form the API returns them. images is a list of
+    (name, timestamp, data) of each image.
+    """
+    def __init__(self, pages, images):
+        self.pages = pages
+        self.images = images
+        self.pages_by_id = dict((page["pageid"], page) for page in pages)
+        self.revisions = dict((revision["revid"], (page, revision)) for page in pages for revision in page["revisions"])
+        self.image_data = dict((name, data) for name, timestamp, data in images)
+
+def make_wiki(pages=100, revisions=10, kb=4, images=10, image_kb=32, seed=1):
+    """
+    Generate a SyntheticWiki of 'pages' pages (the first titled MAIN_PAGE), each with 'revisions'
+    revisions of about 'kb' kilobytes of markup, plus 'images' images of 'image_kb' kilobytes.
+
+    Page content is a mix of headings, paragraphs with styles and links to other pages, lists,
+    tables and images. Each revision after the first edits one section, or adds one.
+    The same arguments always give the same wiki.
+    """
+    rng = random.Random(seed)
+    titles = [ MAIN_PAGE ] + [ "%s %d" % (rng.choice(WORDS).capitalize(), i) for i in range(1, pages) ]
+    image_names = [ "Picture %d.%s" % (i, rng.choice(["png", "jpg"])) for i in range(images) ]
+    timestamp = START_TIMESTAMP
+    revid = 0
+    result = []
+    for pageid, title in enumerate(titles, 1):
+        sections = [ _make_section(rng, titles, image_names) for _ in range(max(1, kb)) ]
+        page = { "pageid" : pageid, "ns" : 0, "title" : title, "revisions" : [] }
+        parentid = 0
+        for number in range(revisions):
+            if number > 0:
+                if rng.random() < 0.2:
+                    sections.append(_make_section(rng, titles, image_names))
+                else:
+                    sections[rng.randrange(len(sections))] = _make_section(rng, titles, image_names)
+            revid += 1
+            timestamp += rng.randint(60, 3600)
+            page["revisions"].append({ "revid" : revid,
+                                       "parentid" : parentid,
+                                       "timestamp" : _format_timestamp(timestamp),
+                                       "user" : rng.choice(USERS),
+                                       "comment" : "Edit %d of %s" % (number + 1, title),
+                                       "contentformat" : "text/x-wiki",
+                                       "contentmodel" : "wikitext",
+                                       "*" : "\n".join(sections) })
+            parentid = revid
+        result.append(page)
+    image_list = []
+    for name in image_names:
+        timestamp += rng.randint(60, 3600)
+        data = bytes(bytearray(rng.getrandbits(8) for _ in range(image_kb * 1024)))
+        image_list.append((name, _format_timestamp(timestamp), data))
+    return SyntheticWiki(result, image_list)
+
+def _make_section(rng, titles, image_names):
+    """ About a kilobyte of markup: a heading followed by a random mix of paragraphs, lists, tables and images """
+    parts = [ "== %s ==" % _words(rng, 3).capitalize() ]
+    while sum(len(part) for part in parts) < 1000:
+        kind = rng.random()
+        if kind < 0.5:
+            parts.append(_paragraph(rng, titles))
+        elif kind < 0.7:
+            parts.append("".join("%s %s\n" % (rng.choice(["*", "*", "**", "#"]), _paragraph(rng, titles, 6)) for _ in range(rng.randint(2, 6))))
+        elif kind < 0.85:
+            rows = "".join("|-\n| %s || %s || [[%s]]\n" % (_words(rng, 2), _words(rng, 2), rng.choice(titles)) for _ in range(rng.randint(2, 5)))
+            parts.append("{| class=\"wikitable\"\n! %s !! %s !! Link\n%s|}" % (_words(rng, 1), _words(rng, 1), rows))
+        elif image_names:
+            parts.append("[[File:%s|thumb|%s]]" % (rng.choice(image_names), _words(rng, 4)))
+    return "\n\n".join(parts) + "\n"
+
+def _paragraph(rng, titles, length=40):
+    words = []
+    for _ in range(length):
+        kind = rng.random()
+        if kind < 0.05:
+            words.append("[[%s]]" % rng.choice(titles))
+        elif kind < 0.08:
+            words.append("[[%s|%s]]" % (rng.choice(titles), rng.choice(WORDS)))
+        elif kind < 0.1:
+            words.append("''%s''" % rng.choice(WORDS))
+        elif kind < 0.12:
+            words.append("'''%s'''" % rng.choice(WORDS))
+        else:
+            words.append(rng.choice(WORDS))
+    return " ".join(words)
+
+def _words(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+def _format_timestamp(seconds):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(seconds))
+
+class MockWikiServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Serves 'wiki' (a SyntheticWiki) at http://127.0.0.1:port/api.php, with its images under
+    http://127.0.0.1:port/images/. Port 0 picks a free port, see api_url.
+
+    Counts the requests it answers and the bytes it sends. If latency is set, every response
+    is delayed by that many seconds (like a server on the other side of a network.)
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, wiki, port=0, latency=0):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", port), _MockWikiHandler)
+        self.wiki = wiki
+        self.latency = latency
+        self.requests = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return "http://%s:%d" % self.server_address
+
+    @property
+    def api_url(self):
+        return self.url + "/api.php"
+
+    def start(self):
+        """ Serve requests in a background thread """
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def count(self, nbytes):
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += nbytes
+
+    def api(self, params):
+        """ Return the response (as a dict) to the API call with query parameters 'params' """
+        if params.get("action") != "query":
+            return _api_error("unknown_action", "Unrecognized value for parameter 'action': %s" % params.get("action"))
+        if "meta" in params:
+            return self._meta(params)
+        if params.get("list") == "allpages":
+            return self._allpages(params)
+        if params.get("list") == "recentchanges":
+            return self._recentchanges(params)
+        if params.get("list") == "allimages":
+            return self._allimages(params)
+        if params.get("prop") == "revisions":
+            return self._revisions(params)
+        return _api_error("unsupported", "The mock wiki doesn't support this query")
+
+    def _meta(self, params):
+        if params["meta"] == "userinfo":
+            return { "query" : { "userinfo" : { "id" : 0, "name" : "127.0.0.1", "anon" : "", "rights" : [ "read" ] } } }
+        query = { "general" : { "mainpage" : MAIN_PAGE, "sitename" : "Mock Wiki", "generator" : GENERATOR,
+                                "base" : "%s/index.php/%s" % (self.url, MAIN_PAGE.replace(" ", "_")) } }
+        if "namespaces" in params.get("siprop", ""):
+            query["namespaces"] = { "0" : { "id" : 0, "case" : "first-letter", "*" : "" },
+                                    "6" : { "id" : 6, "case" : "first-letter", "canonical" : "File", "*" : "File" },
+                                    "-2" : { "id" : -2, "case" : "first-letter", "canonical" : "Media", "*" : "Media" } }
+            query["namespacealiases"] = [ { "id" : 6, "*" : "Image" } ]
+        return { "query" : query }
+
+    def _allpages(self, params):
+        # apfrom, apto & apcontinue are titles without the namespace prefix
+        namespace = int(params.get("apnamespace", "0"))
+        pages = sorted((page for page in self.wiki.pages if page["ns"] == namespace), key=_unprefixed_title)
+        start = params.get("apcontinue", params.get("apfrom"))
+        if start is not None:
+            pages = [ page for page in pages if _unprefixed_title(page) >= start ]
+        if "apto" in params:
+            pages = [ page for page in pages if _unprefixed_title(page) <= params["apto"] ]
+        limit = _limit(params, "aplimit", 500)
+        response = { "query" : { "allpages" : [ { "pageid" : page["pageid"], "ns" : page["ns"], "title" : page["title"] }
+                                                for page in pages[:limit] ] } }
+        if len(pages) > limit:
+            response["query-continue"] = { "allpages" : { "apcontinue" : _unprefixed_title(pages[limit]) } }
+        return response
+
+    def _revisions(self, params):
+        props = params.get("rvprop", "ids|timestamp|flags|comment|user").split("|")
+        results = {}
+        if "revids" in params:
+            for revid in params["revids"].split("|"):
+                try:
+                    page, revision = self.wiki.revisions[int(revid)]
+                except (KeyError, ValueError):
+                    continue
+                result = results.setdefault(str(page["pageid"]), _page_summary(page, []))
+                result["revisions"].append(_revision(revision, props))
+            return { "query" : { "pages" : results } }
+        pageids = params.get("pageids", "").split("|")
+        if len(pageids) == 1 and "rvlimit" in params: # the whole history of one page, newest first
+            page = self.wiki.pages_by_id.get(int(pageids[0]))
+            if page is None:
+                return { "query" : { "pages" : { pageids[0] : { "pageid" : int(pageids[0]), "missing" : "" } } } }
+            revisions = list(reversed(page["revisions"]))
+            if "rvstartid" in params:
+                revisions = [ revision for revision in revisions if revision["revid"] <= int(params["rvstartid"]) ]
+            limit = _limit(params, "rvlimit", 500)
+            response = { "query" : { "pages" : { str(page["pageid"]) : _page_summary(page, [ _revision(revision, props) for revision in revisions[:limit] ]) } } }
+            if len(revisions) > limit:
+                response["query-continue"] = { "revisions" : { "rvstartid" : revisions[limit]["revid"] } }
+            return response
+        for pageid in pageids: # the latest revision of each page
+            page = self.wiki.pages_by_id.get(int(pageid))
+            if page is not None:
+                results[str(page["pageid"])] = _page_summary(page, [ _revision(page["revisions"][-1], props) ])
+        return { "query" : { "pages" : results } }
+
+    def _recentchanges(self, params):
+        changes = sorted(((revision["timestamp"], revision["revid"], page) for page, revision in self.wiki.revisions.values()),
+                         reverse=params.get("rcdir", "older") == "older")
+        if "rcnamespace" in params:
+            namespaces = [ int(ns) for ns in params["rcnamespace"].split("|") ]
+            changes = [ change for change in changes if change[2]["ns"] in namespaces ]
+        start = params.get("rccontinue", params.get("rcstart"))
+        if start is not None:
+            if params.get("rcdir") == "newer":
+                changes = [ change for change in changes if change[0] >= start ]
+            else:
+                changes = [ change for change in changes if change[0] <= start ]
+        limit = _limit(params, "rclimit", 500)
+        response = { "query" : { "recentchanges" : [ { "type" : "new" if self.wiki.revisions[revid][1]["parentid"] == 0 else "edit",
+                                                       "ns" : page["ns"], "title" : page["title"], "pageid" : page["pageid"],
+                                                       "revid" : revid, "timestamp" : timestamp }
+                                                     for timestamp, revid, page in changes[:limit] ] } }
+        if len(changes) > limit:
+            response["query-continue"] = { "recentchanges" : { "rccontinue" : changes[limit][0] } }
+        return response
+
+    def _allimages(self, params):
+        images = self.wiki.images
+        start = params.get("aicontinue", params.get("aifrom"))
+        if start is not None:
+            images = [ image for image in images if image[0] >= start ]
+        limit = _limit(params, "ailimit", 500)
+        response = { "query" : { "allimages" : [ { "name" : name, "timestamp" : timestamp, "size" : len(data),
+                                                   "sha1" : hashlib.sha1(data).hexdigest(),
+                                                   "url" : "%s/images/%s" % (self.url, urllib.quote(name.encode("utf-8"))) }
+                                                 for name, timestamp, data in images[:limit] ] } }
+        if len(images) > limit:
+            response["query-continue"] = { "allimages" : { "aicontinue" : images[limit][0] } }
+        return response
+
+def _unprefixed_title(page):
+    return page["title"] if page["ns"] == 0 else page["title"].split(":", 1)[1]
+
+def _api_error(code, info):
+    return { "error" : { "code" : code, "info" : info } }
+
+def _limit(params, param, maximum):
+    value = params.get(param, "10")
+    if value == "max":
+        return maximum
+    return max(1, min(maximum, int(value)))
+
+def _page_summary(page, revisions):
+    return { "pageid" : page["pageid"], "ns" : page["ns"], "title" : page["title"], "revisions" : revisions }
+
+def _revision(revision, props):
+    """ Only the fields of 'revision' asked for by the rvprop values 'props' """
+    result = {}
+    if "ids" in props:
+        result["revid"] = revision["revid"]
+        result["parentid"] = revision["parentid"]
+    for prop in "timestamp", "user", "comment":
+        if prop in props:
+            result[prop] = revision[prop]
+    if "content" in props:
+        for key in "contentformat", "contentmodel", "*":
+            result[key] = revision[key]
+    return result
+
+class _MockWikiHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive, like a real server
+    disable_nagle_algorithm = True # otherwise each response's headers & body can wait out a delayed ACK
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        if url.path.endswith("/api.php"):
+            self._api(url.query)
+        elif url.path.startswith("/images/"):
+            name = urllib.unquote(url.path[len("/images/"):]).decode("utf-8")
+            data = self.server.wiki.image_data.get(name)
+            if data is None:
+                self._send(404, b"Not found", "text/plain")
+            else:
+                self._send(200, data, "application/octet-stream")
+        else:
+            self._send(404, b"Not found", "text/plain")
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if urlparse.urlparse(self.path).path.endswith("/api.php"):
+            self._api(body)
+        else:
+            self._send(404, b"Not found", "text/plain")
+
+    def _api(self, query):
+        params = dict((key.decode("utf-8"), values[-1].decode("utf-8")) for key, values in urlparse.parse_qs(query, keep_blank_values=True).items())
+        self._send(200, json.dumps(self.server.api(params)).encode("utf-8"), "application/json; charset=utf-8")
+
+    def _send(self, status, data, content_type):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        self.server.count(len(data))
+
+    def log_message(self, format, *args):
+        pass
+
+# Parser for command line arguments
+arguments = argparse.ArgumentParser(description='Serve a synthetic Mediawiki through a local stand-in for its API.')
+arguments.add_argument('--pages', metavar='N', type=int, default=100, help="Number of pages (default 100.)")
+arguments.add_argument('--revisions', metavar='N', type=int, default=10, help="Revisions of each page (default 10.)")
+arguments.add_argument('--kb', metavar='KB', type=int, default=4, help="Approximate size of the first revision of each page, in kilobytes (default 4.)")
+arguments.add_argument('--images', metavar='N', type=int, default=10, help="Number of images (default 10.)")
+arguments.add_argument('--image-kb', metavar='KB', type=int, default=32, help="Size of each image, in kilobytes (default 32.)")
+arguments.add_argument('--seed', metavar='N', type=int, default=1, help="Random seed, the same seed always generates the same wiki (default 1.)")
+arguments.add_argument('--latency', metavar='MS', type=float, default=0, help="Delay every response by MS milliseconds (default 0.)")
+arguments.add_argument('--port', metavar='PORT', type=int, default=8080, help="Port to listen on (default 8080.)")
+
+if __name__ == "__main__":
+    args = arguments.parse_args()
+    wiki = make_wiki(args.pages, args.revisions, args.kb, args.images, args.image_kb, args.seed)
+    server = MockWikiServer(wiki, args.port, args.latency / 1000)
+    print("Serving %d pages and %d images at %s" % (len(wiki.pages), len(wiki.images), server.api_url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,172 @@
+"""
+Methods for keeping a local copy of the raw mediawiki pages and revisions
+that yamdwe has fetched, in a SQLite file, so later runs can convert and
+export from that copy instead of fetching everything again.
+
+Pages are recorded as they pass through on their way to the exporter,
+and replayed one page at a time, so neither needs the whole wiki in memory.
+
+Copyright (C) 2014 Angus Gratton
+Licensed under New BSD License as described in the file LICENSE.
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+import sqlite3, json
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS site (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS pages (pageid INTEGER PRIMARY KEY, title TEXT NOT NULL, page TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS revisions (pageid INTEGER NOT NULL, revid INTEGER NOT NULL, timestamp TEXT NOT NULL,
+                                      revision TEXT NOT NULL, content TEXT NOT NULL, PRIMARY KEY (pageid, revid));
+CREATE INDEX IF NOT EXISTS pages_title ON pages (title);
+"""
+
+# commit after recording this many pages, so an interrupted run keeps most of what it fetched
+COMMIT_EVERY = 100
+
+class RevisionStore(object):
+    """
+    A SQLite file holding pages (keyed by page id) and their revisions (keyed by page id
+    and revision id), plus the few bits of site information the exporter needs.
+
+    Revision content is kept in its own column, all the other fields of each page and
+    revision are kept as JSON so they come back exactly as the importer returned them.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def get_site(self, key):
+        row = self.db.execute("SELECT value FROM site WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            raise RuntimeError("Store %s has no '%s' recorded. Was it made with --store?" % (self.path, key))
+        return json.loads(row[0])
+
+    def put_site(self, key, value):
+        self.db.execute("INSERT OR REPLACE INTO site (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+        self.db.commit()
+
+    def put_page(self, page, replace=True):
+        """
+        Record 'page' with all its revisions, replacing anything already recorded for that page id.
+
+        If replace is not set, the revisions are added to those already recorded for the page.
+        """
+        pageid = page["pageid"]
+        fields = dict((k, v) for (k, v) in page.items() if k != "revisions")
+        self.db.execute("INSERT OR REPLACE INTO pages (pageid, title, page) VALUES (?, ?, ?)",
+                        (pageid, page["title"], json.dumps(fields)))
+        if replace:
+            self.db.execute("DELETE FROM revisions WHERE pageid = ?", (pageid,))
+        self.db.executemany("INSERT OR REPLACE INTO revisions (pageid, revid, timestamp, revision, content) VALUES (?, ?, ?, ?, ?)",
+                            ((pageid, revision["revid"], revision["timestamp"],
+                              json.dumps(dict((k, v) for (k, v) in revision.items() if k != "*")), revision["*"])
+                             for revision in page["revisions"]))
+
+    def commit(self):
+        self.db.commit()
+
+    def count_pages(self):
+        return self.db.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def iter_pages(self):
+        """
+        Yield each recorded page (in title order) with its revisions newest first,
+        in the same format as mediawiki.Importer.get_all_pages()
+        """
+        for pageid, fields in self.db.execute("SELECT pageid, page FROM pages ORDER BY title"):
+            page = json.loads(fields)
+            page["revisions"] = []
+            for revision, content in self.db.execute("SELECT revision, content FROM revisions WHERE pageid = ? "
+                                                     "ORDER BY timestamp DESC, revid DESC", (pageid,)):
+                revision = json.loads(revision)
+                revision["*"] = content
+                page["revisions"].append(revision)
+            yield page
+
+
+class Recorder(object):
+    """
+    Wraps another importer, recording every page it returns (plus the file namespaces
+    and main page title) to a RevisionStore as they pass through.
+    """
+    def __init__(self, importer, store_path):
+        self.importer = importer
+        self.store = RevisionStore(store_path)
+        print("Recording pages to store %s..." % store_path)
+
+    def get_all_pages(self, **kwargs):
+        return self._record_pages(self.importer.get_all_pages(**kwargs), True)
+
+    def get_changed_pages(self, since):
+        return self._record_pages(self.importer.get_changed_pages(since), False)
+
+    def get_sync_timestamp(self):
+        return self.importer.get_sync_timestamp()
+
+    def _record_pages(self, pages, replace):
+        count = 0
+        try:
+            for page in pages:
+                self.store.put_page(page, replace)
+                count += 1
+                if count % COMMIT_EVERY == 0:
+                    self.store.commit()
+                yield page
+        finally:
+            self.store.commit()
+        print("Recorded %d pages to store %s." % (count, self.store.path))
+
+    def get_all_images(self):
+        return self.importer.get_all_images()
+
+    def get_file_namespaces(self):
+        result = self.importer.get_file_namespaces()
+        self.store.put_site("file_namespaces", result)
+        return result
+
+    def get_main_pagetitle(self):
+        result = self.importer.get_main_pagetitle()
+        self.store.put_site("main_pagetitle", result)
+        return result
+
+
+class StoreImporter(object):
+    """
+    Importer that reads pages back from a RevisionStore recorded by an earlier run, with no network access.
+    """
+    def __init__(self, store_path, verbose=False):
+        self.verbose = verbose
+        self.store = RevisionStore(store_path)
+        print("Replaying %d pages from store %s..." % (self.store.count_pages(), store_path))
+
+    def verbose_print(self, msg):
+        if self.verbose:
+            print(msg)
+
+    def get_all_pages(self):
+        """
+        Yield each page in the store, with all revisions including content, in the same
+        format as mediawiki.Importer.get_all_pages()
+        """
+        for page in self.store.iter_pages():
+            self.verbose_print("Read %d revisions of page '%s'." % (len(page["revisions"]), page["title"]))
+            yield page
+
+    def get_all_images(self):
+        """
+        Images aren't recorded in the store, so there is nothing to import.
+        """
+        print("Images aren't recorded in the store, so no images will be exported. Run yamdwe against the Mediawiki API to export them.")
+        return []
+
+    def get_file_namespaces(self):
+        file_namespace, aliases = self.store.get_site("file_namespaces")
+        return file_namespace, aliases
+
+    def get_main_pagetitle(self):
+        return self.store.get_site("main_pagetitle")
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""Tests that pages recorded to a store (--store) replay (--replay) as they were fetched.
+
+Copyright (C) 2014 Angus Gratton
+Licensed under New BSD License as described in the file LICENSE.
+
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+import os, copy, shutil, tempfile, unittest
+import revstore, mockwiki
+from mediawiki_tests import assertPageShape, quietly
+
+class FakeImporter(object):
+    """ Stands in for mediawiki.Importer, returning the pages of a mockwiki.SyntheticWiki """
+    def __init__(self, wiki):
+        self.pages = []
+        for page in wiki.pages:
+            page = copy.deepcopy(page)
+            page["revisions"].reverse() # newest first, like the API
+            self.pages.append(page)
+
+    def get_all_pages(self, **kwargs):
+        for page in self.pages:
+            yield copy.deepcopy(page)
+
+    def get_changed_pages(self, since):
+        for page in self.pages:
+            revisions = [ revision for revision in page["revisions"] if revision["timestamp"] >= since ]
+            if revisions:
+                yield dict(page, revisions=copy.deepcopy(revisions))
+
+    def get_file_namespaces(self):
+        return "Datei", [ "File", "Media", "Image", "Datei" ]
+
+    def get_main_pagetitle(self):
+        return "Hauptseite"
+
+class RevisionStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "wiki.db")
+        wiki = mockwiki.make_wiki(pages=6, revisions=4, kb=1, images=0)
+        wiki.pages[2]["ns"] = 4
+        wiki.pages[2]["title"] = "Project:" + wiki.pages[2]["title"]
+        wiki.pages[3]["revisions"][1]["*"] = "" # ie deleted text
+        wiki.pages[3]["revisions"][1]["texthidden"] = ""
+        self.importer = FakeImporter(wiki)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def record(self, method, *args):
+        recorder = quietly(revstore.Recorder, self.importer, self.path)
+        recorder.get_file_namespaces()
+        recorder.get_main_pagetitle()
+        pages = quietly(getattr(recorder, method), *args)
+        recorder.store.close()
+        return pages
+
+    def replay(self):
+        importer = quietly(revstore.StoreImporter, self.path)
+        return importer, quietly(importer.get_all_pages)
+
+    def test_replay(self):
+        recorded = self.record("get_all_pages")
+        self.assertEqual(recorded, self.importer.pages) # passed through unchanged
+        importer, replayed = self.replay()
+        self.assertEqual(replayed, sorted(self.importer.pages, key=lambda page: page["title"]))
+        for page in replayed:
+            assertPageShape(self, page)
+        self.assertEqual(importer.get_file_namespaces(), self.importer.get_file_namespaces())
+        self.assertEqual(importer.get_main_pagetitle(), "Hauptseite")
+        self.assertEqual(quietly(importer.get_all_images), [])
+
+    def test_changed_pages_are_added(self):
+        self.record("get_all_pages")
+        since = sorted(revision["timestamp"] for page in self.importer.pages for revision in page["revisions"])[-5]
+        changed = self.importer.pages[-1]
+        changed["revisions"].insert(0, dict(changed["revisions"][0], revid=1000, timestamp="2099-01-01T00:00:00Z", **{ "*" : "New" }))
+        self.record("get_changed_pages", since)
+        importer, replayed = self.replay()
+        self.assertEqual(replayed, sorted(self.importer.pages, key=lambda page: page["title"]))
+
+    def test_rerecording_replaces_pages(self):
+        self.record("get_all_pages")
+        del self.importer.pages[0]["revisions"][1:]
+        self.record("get_all_pages")
+        importer, replayed = self.replay()
+        self.assertEqual(replayed, sorted(self.importer.pages, key=lambda page: page["title"]))
+
+    def test_missing_site_information(self):
+        store = revstore.RevisionStore(self.path)
+        self.assertRaises(RuntimeError, store.get_site, "main_pagetitle")
+        store.close()
+
+if __name__ == "__main__":
+    unittest.main()
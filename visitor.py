@@ -120,10 +120,13 @@ class method_overload(object):
         self.func_name = func_name
         self.registry = {}
         self.allow_cascade = {}
+        # argument type -> list of functions to call for it, filled in as types are seen
+        self.dispatch = {}
 
     def register(self, argtype, func, allow_cascade):
         self.registry[argtype] = func
         self.allow_cascade[argtype] = allow_cascade
+        self.dispatch = {} # a new overload may change what any type resolves to
 
     def __get__(self, obj, type=None):
         """ This __get__ is called when the method is bound on a
@@ -139,7 +142,15 @@ class method_overload(object):
     def __call__(self, *args, **kw):
         """ This __call__ is only reached when the method is not bound to a class 
         """
-        return self.call_internal(lambda f:f, args, kw)
+        argtype = type(args[0])
+        try:
+            funcs = self.dispatch[argtype]
+        except KeyError:
+            funcs = self.resolve(argtype, args[0])
+        result = None
+        for func in funcs:
+            result = func(*args, **kw)
+        return result
 
     def call_internal(self, func_modifier, args, kw):
         """ Common utility class for calling an overloaded method,
@@ -148,23 +159,38 @@ class method_overload(object):
         instance
         """
         argtype = type(args[0])
-        class Old:
-            pass
-        if argtype is types.InstanceType: # old-style class
-            argtype = args[0].__class__        
+        try:
+            funcs = self.dispatch[argtype]
+        except KeyError:
+            funcs = self.resolve(argtype, args[0])
+        result = None
+        for func in funcs:
+            result = func_modifier(func)(*args, **kw)
+        return result
+
+    def resolve(self, argtype, arg):
+        """ Return the list of registered functions to call (in order) for
+        an argument 'arg' of type 'argtype', and remember it for next time.
+        """
+        if argtype is types.InstanceType: # old-style class, every instance has this same type
+            return self.find_overloads(arg.__class__)
+        funcs = self.find_overloads(argtype)
+        self.dispatch[argtype] = funcs
+        return funcs
+
+    def find_overloads(self, argtype):
+        """ Search the class hierarchy of 'argtype' for the registered
+        functions to call, superclass first.
+        """
         hier = list(inspect.getmro(argtype)) # class hierarchy
         hier.reverse() # order w/ superclass first
         hier = [ t for t in hier if t in self.registry ]
         if len(hier) == 0:
             raise TypeError("Function %s has no compatible overloads registered for argument type %s" % 
-                            (self.func_name, argtype))            
-        result = None
-        for t in hier:
-            if not self.allow_cascade[t] and t != hier[-1]:
-                continue # don't "cascade" down from superclass on this method
-            result = func_modifier(self.registry[t])(*args, **kw)
-        return result
-        
+                            (self.func_name, argtype))
+        # only "cascade" down from a superclass if its overload allows it
+        return [ self.registry[t] for t in hier if self.allow_cascade[t] or t == hier[-1] ]
+
 
 class bound_caller(object):
     """ Temporary class instantiated once per method call(!!) for
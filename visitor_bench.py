@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""Micro-benchmark for the dispatch overhead of visitor.method_overload.
+
+Registers empty overloads for the same mwlib node classes as
+wikicontent.py and times calling them with the nodes of a sample page,
+both the way method_overload dispatches now (resolved once per type,
+then looked up) and the way it used to (searching the class hierarchy
+and making a lambda on every call.)
+
+Usage: visitor_bench.py [CALLS]
+
+Copyright (C) 2014 Angus Gratton
+Licensed under New BSD License as described in the file LICENSE.
+
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+import sys, time
+from mwlib.parser import *
+from mwlib import uparser
+import visitor
+
+DEFAULT_CALLS = 200000
+
+SAMPLE_PAGE = """
+== Heading ==
+Some text with a [[Link]], ''italics'', '''bold''' and a [http://example.com URL].
+* list item
+* another [[Link|item]]
+{|
+! A !! B
+|-
+| cell || ''cell''
+|}
+ preformatted
+"""
+
+@visitor.when(Node)
+def bench_dispatch(node):
+    return node
+
+for nodetype in [ Article, Paragraph, Text, Section, Style, NamedURL, URL, ImageLink, ArticleLink,
+                  CategoryLink, NamespaceLink, ItemList, Item, Table, Cell, Row, PreFormatted, TagNode, Math, Caption ]:
+    bench_dispatch.register(nodetype, lambda node: node, False)
+
+def sample_nodes():
+    """ Every node in the parse tree of SAMPLE_PAGE """
+    nodes = []
+    stack = [ uparser.parseString("Bench", SAMPLE_PAGE) ]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack.extend(node.children)
+    return nodes
+
+def call_uncached(overload, arg):
+    """ What method_overload did per call before dispatch was cached """
+    result = None
+    for func in overload.find_overloads(type(arg)):
+        result = (lambda f:f)(func)(arg)
+    return result
+
+def time_calls(call, nodes, calls):
+    """ Return seconds per call of call(node), over about 'calls' calls """
+    nodes = nodes * max(1, calls // len(nodes))
+    start = time.time()
+    for node in nodes:
+        call(node)
+    return (time.time() - start) / len(nodes)
+
+if __name__ == "__main__":
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_CALLS
+    nodes = sample_nodes()
+    uncached = time_calls(lambda node: call_uncached(bench_dispatch, node), nodes, calls)
+    cached = time_calls(lambda node: bench_dispatch(node), nodes, calls)
+    print("Per call, searching the class hierarchy every time: %.2f us" % (uncached * 1e6))
+    print("Per call, with dispatch cached per type:            %.2f us" % (cached * 1e6))
+    print("%.1fx faster" % (uncached / cached))
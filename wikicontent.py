@@ -7,13 +7,15 @@ Copyright (C) 2014 Angus Gratton
 Licensed under New BSD License as described in the file LICENSE.
 """
 from __future__ import print_function, unicode_literals, absolute_import, division
-import re, string, dokuwiki, visitor
+import sys, re, string, types, collections, dokuwiki, visitor
 from mwlib.parser import *
 from mwlib import uparser
 
 # Regex to match any known File: namespace (can be updated based on the mediawiki installation language)
 mw_file_namespace_aliases = re.compile("^(Image|File):", re.IGNORECASE)
 dw_file_namespace = "File:"
+# arguments of the last set_file_namespaces() call, so conversion worker processes can be set up the same way
+file_namespaces = ("File", [ "Image", "File" ])
 
 def set_file_namespaces(canonical_alias, aliases):
     """
@@ -25,9 +27,26 @@ def set_file_namespaces(canonical_alias, aliases):
     """
     global mw_file_namespace_aliases
     global dw_file_namespace
+    global file_namespaces
+    file_namespaces = (canonical_alias, list(aliases))
     dw_file_namespace = canonical_alias + ":"
     mw_file_namespace_aliases = re.compile("^(%s):" % "|".join(aliases), re.IGNORECASE)
 
+# recursion limit while mwlib parses a page, its parser recurses at least once for each level of nesting
+PARSE_RECURSION_LIMIT = 20000
+
+def parse(title, content):
+    """
+    Return the mwlib parse tree of 'content', with the recursion limit raised so deeply nested
+    pages can be parsed (converting the tree doesn't recurse, see convert().)
+    """
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, PARSE_RECURSION_LIMIT))
+    try:
+        return uparser.parseString(title, content)
+    finally:
+        sys.setrecursionlimit(limit)
+
 def is_file_namespace(target):
     """
     Is this target URL part of a known File or Image path?
@@ -47,11 +66,20 @@ def convert_pagecontent(title, content):
     Convert a string in Mediawiki content format to a string in
     Dokuwiki content format.
     """
+    nowiki_plaintext = []
+    content = save_nowiki_blocks(content, nowiki_plaintext)
+    root = parse(title, content) # create parse tree
+    result = convert(root, make_context(nowiki_plaintext), False)
+    return add_notoc(content, result)
 
+def save_nowiki_blocks(content, nowiki_plaintext):
+    """
+    Return content with each <nowiki> block replaced by a placeholder, appending the blocks to
+    the list nowiki_plaintext.
+    """
     # this is a hack for mwlib discarding the content of <nowiki> tags
     # and replacing them with plaintext parsed HTML versions of the
     # content (pragmatic, but not what we want)
-    nowiki_plaintext = []
 
     # Instead we save the content here, replace it with the "magic" placeholder
     # tag <__yamdwe_nowiki> and the index where the content was saved, then pass
@@ -59,68 +87,223 @@ def convert_pagecontent(title, content):
     def add_nowiki_block(match):
         nowiki_plaintext.append(match.group(0))
         return "<__yamdwe_nowiki>%d</__yamdwe_nowiki>" % (len(nowiki_plaintext)-1,)
-    content = re.sub(r"<nowiki>.+?</nowiki>", add_nowiki_block, content)
+    return re.sub(r"<nowiki>.+?</nowiki>", add_nowiki_block, content)
 
-    root = uparser.parseString(title, content) # create parse tree
+def make_context(nowiki_plaintext):
     context = {}
     context["list_stack"] = []
     context["nowiki_plaintext"] = nowiki_plaintext # hacky way of attaching to child nodes
-    result = convert(root, context, False)
+    return context
 
+def add_notoc(content, result):
     # mwlib doesn't parse NOTOC, so check for it manually
     if re.match(r"^\s*__NOTOC__\s*$", content, re.MULTILINE):
         result = "~~NOTOC~~"+("\n" if not result.startswith("\n") else "")+result
     return result
 
+# Heading lines which sections are split at
+section_heading = re.compile(r"^(={1,6})(?!=)[^\n]*[^=\n]\1[ \t]*$", re.MULTILINE)
+# Heading added after a section when converting it by itself, so it ends the same way as in the full page
+lookahead_title = "__yamdwe_lookahead"
+lookahead_heading = "=%s=\n" % lookahead_title
+# Markup which has to open and close in the same section, or a heading inside it might not really be a heading
+balanced_markup = [ (re.compile(r"^\{\|", re.MULTILINE), re.compile(r"^\s*\|\}", re.MULTILINE)),
+                    (re.compile(r"<!--"), re.compile(r"-->")),
+                    (re.compile(r"\{\{"), re.compile(r"\}\}")),
+                    (re.compile(r"\[\["), re.compile(r"\]\]")) ]
+opening_tag = re.compile(r"<([a-zA-Z]+)(?:\s[^>]*)?(?<!/)>")
+closing_tag = re.compile(r"</([a-zA-Z]+)\s*>")
+void_tags = [ "br", "hr", "wbr", "img" ] # never closed
+
+def split_sections(content):
+    """
+    Split content at its heading lines, returns the list of sections (the first one may not start
+    with a heading.) Returns the whole content as one section if it can't be split safely.
+    """
+    starts = [ m.start() for m in section_heading.finditer(content) if m.start() > 0 ]
+    sections = [ content[start:end] for (start, end) in zip([0] + starts, starts + [len(content)]) ]
+    if not all(is_self_contained(section) for section in sections):
+        return [ content ]
+    return sections
+
+def is_self_contained(section):
+    """
+    Does every table, comment, template, link and tag opened in 'section' close there too?
+    """
+    for opening, closing in balanced_markup:
+        if len(opening.findall(section)) != len(closing.findall(section)):
+            return False
+    opened = collections.Counter(tag.lower() for tag in opening_tag.findall(section) if not tag.lower() in void_tags)
+    closed = collections.Counter(tag.lower() for tag in closing_tag.findall(section))
+    return opened == closed
+
+class SectionConverter(object):
+    """
+    Converts the revisions of one page in turn, only parsing and converting the sections
+    (split at heading lines) which changed since the revision before. The result is
+    the same as convert_pagecontent().
+
+    A section converted by itself ends with a heading after it, so mwlib ends its last
+    paragraph the same way as in the full page. If a section still doesn't parse like
+    part of the page (ie it doesn't start with a heading), the whole revision is
+    converted instead.
+    """
+    def __init__(self, title):
+        self.title = title
+        # (section, index of its first nowiki block, is first section, is last section) -> converted section, for the last revision
+        self.previous = {}
+        self.reused = 0
+        self.converted = 0
+
+    def convert_pagecontent(self, content):
+        """
+        Return convert_pagecontent(title, content), for the next revision of the page
+        """
+        nowiki_plaintext = []
+        sections = []
+        for index, section in enumerate(split_sections(content)):
+            key = (section, len(nowiki_plaintext), index == 0, False)
+            sections.append((key, save_nowiki_blocks(section, nowiki_plaintext)))
+        key, text = sections[-1]
+        sections[-1] = (key[:3] + (True,), text)
+        content = "".join(text for (key, text) in sections)
+
+        converted = {}
+        for key, text in sections:
+            result = self.previous.get(key)
+            if result is not None:
+                self.reused += 1
+            else:
+                result = self._convert_section(text, key[2], key[3], nowiki_plaintext)
+                if result is None: # can't be converted by itself
+                    converted = None
+                    break
+            converted[key] = result
+
+        if converted is None:
+            self.previous = {}
+            root = parse(self.title, content)
+            result = convert(root, make_context(nowiki_plaintext), False)
+        else:
+            self.previous = converted
+            result = "".join(converted[key] for (key, text) in sections)
+        return add_notoc(content, result)
+
+    def _convert_section(self, text, is_first, is_last, nowiki_plaintext):
+        """
+        Return the converted section 'text', or None if it doesn't parse the same way by itself as in the page.
+        """
+        self.converted += 1
+        if is_first and is_last:
+            return convert(parse(self.title, text), make_context(nowiki_plaintext), False)
+        if not is_last:
+            text += lookahead_heading
+        root = parse(self.title, text)
+        if not is_first and not (len(root.children) and isinstance(root.children[0], Section)):
+            return None
+        if not is_last:
+            if not (len(root.children) and is_lookahead(root.children[-1])):
+                return None
+            root.children.pop()
+        return convert(root, make_context(nowiki_plaintext), False)
+
+def is_lookahead(node):
+    """
+    Is this parse node the section for lookahead_heading?
+    """
+    try:
+        return (isinstance(node, Section) and node.level == 1
+                and node.children[0].children[0].caption.strip() == lookahead_title)
+    except (IndexError, AttributeError):
+        return False
+
+def convert(node, context, trailing_newline):
+    """Convert the parse tree rooted at 'node' to a string in Dokuwiki content format.
+
+    Each convert_node() overload is a generator. It yields the generator
+    for anything it needs converted first (another node, or its own
+    children) and is sent back the result, then yields its own result as
+    a string (or just finishes, if its result is the last thing it had
+    converted.) The tree is walked with an explicit stack of these
+    generators, so pages can be nested to any depth without recursing.
+    """
+    stack = [ convert_node(node, context, trailing_newline) ]
+    result = None
+    while True:
+        try:
+            step = stack[-1].send(result)
+        except StopIteration:
+            step = result
+        if type(step) is types.GeneratorType: # convert this first
+            stack.append(step)
+            result = None
+        else: # finished converting
+            stack.pop()
+            if not stack:
+                return step
+            result = step
+
 def convert_children(node, context):
-    """Walk the children of this parse node and call convert() on each.
+    """Convert the children of this parse node, yields the generator to
+    convert each one then yields the combined result.
+
+    The converted pieces are collected in a list and joined once at the end
+    (repeatedly appending to one string is quadratic for nodes with many
+    children), so whether the output so far ends in a newline is tracked
+    separately as each piece is added.
     """
-    result = ""
+    parts = []
+    trailing_newline = False
     for child in node.children:
-        res = convert(child, context, result.endswith("\n"))
+        res = yield convert_node(child, context, trailing_newline)
         if type(res) is str:
             res = unicode(res)
         if type(res) is not unicode:
             print("Got invalid response '%s' when processing '%s'" % (res,child))
-        result += res
-    return result
+        if res:
+            parts.append(res)
+            trailing_newline = res.endswith("\n")
+    yield "".join(parts)
 
 @visitor.when(Article)
-def convert(node, context, trailing_newline):
-    return convert_children(node, context)
+def convert_node(node, context, trailing_newline):
+    yield convert_children(node, context)
 
 @visitor.when(Paragraph)
-def convert(node, context, trailing_newline):
-    return convert_children(node, context) + "\n"
+def convert_node(node, context, trailing_newline):
+    children = yield convert_children(node, context)
+    yield children + "\n"
 
 @visitor.when(Text)
-def convert(text, context, trailing_newline):
+def convert_node(text, context, trailing_newline):
     if text._text is None:
-        return ""
+        yield ""
+        return
     m = re.match(r"<__yamdwe_nowiki>([0-9]+)</__yamdwe_nowiki>", text._text)
     if m is not None: # nowiki content!
         index = int(m.group(1))
-        return context["nowiki_plaintext"][index] # nowiki_plaintext entry includes <nowiki> tags
+        yield context["nowiki_plaintext"][index] # nowiki_plaintext entry includes <nowiki> tags
     else:
-        return text.caption
+        yield text.caption
 
 @visitor.when(Section)
-def convert(section, context, trailing_newline):
+def convert_node(section, context, trailing_newline):
     result = ""
     if section.tagname == "p":
         pass
     elif section.tagname == "@section":
         level = section.level
-        heading = convert(section.children.pop(0), context, trailing_newline).strip()
+        heading = (yield convert_node(section.children.pop(0), context, trailing_newline)).strip()
         heading_boundary = "="*(8-level)
         result = "\n%s %s %s\n" % (heading_boundary, heading, heading_boundary)
     else:
         print("Unknown tagname %s" % section.tagname)
 
-    return result + convert_children(section, context)
+    children = yield convert_children(section, context)
+    yield result + children
 
 @visitor.when(Style)
-def convert(style, context, trailing_newline):
+def convert_node(style, context, trailing_newline):
     formatter = {
         ";" :  ("**", r"**\\"),     # definition (essentially boldface)
         "''" : ("//", "//"),        # italics
@@ -136,23 +319,24 @@ def convert(style, context, trailing_newline):
     if formatter is None:
         print("WARNING: Ignoring unknown formatter %s" % style.caption)
         formatter = ("","")
-    return formatter[0] + convert_children(style, context) + formatter[1]
+    children = yield convert_children(style, context)
+    yield formatter[0] + children + formatter[1]
 
 @visitor.when(NamedURL)
-def convert(url, context, trailing_newline):
-    text = convert_children(url, context).strip(" ")
+def convert_node(url, context, trailing_newline):
+    text = (yield convert_children(url, context)).strip(" ")
     url = url.caption
     if len(text):
-        return u"[[%s|%s]]" % (url, text)
+        yield u"[[%s|%s]]" % (url, text)
     else:
-        return u"%s" % (url)
+        yield u"%s" % (url)
 
 @visitor.when(URL)
-def convert(url, context, trailing_newline):
-    return url.caption
+def convert_node(url, context, trailing_newline):
+    yield url.caption
 
 @visitor.when(ImageLink)
-def convert(link, context, trailing_newline):
+def convert_node(link, context, trailing_newline):
     suffix = ""
     if link.width is not None:
         if link.height is None:
@@ -169,74 +353,77 @@ def convert(link, context, trailing_newline):
     postalign = " " if link.align in [ "center", "left" ] else ""
     target = canonicalise_file_namespace(link.target)
     target = convert_internal_link(target)
-    return "{{%s%s%s%s}}" % (prealign, target, suffix, postalign)
+    yield "{{%s%s%s%s}}" % (prealign, target, suffix, postalign)
 
 @visitor.when(ArticleLink)
-def convert(link, context, trailing_newline):
-    text = convert_children(link, context).strip(" ")
+def convert_node(link, context, trailing_newline):
+    text = (yield convert_children(link, context)).strip(" ")
     pagename = convert_internal_link(link.target)
     if len(text):
-        return u"[[%s|%s]]" % (pagename, text)
+        yield u"[[%s|%s]]" % (pagename, text)
     else:
-        return u"[[%s]]" % pagename
+        yield u"[[%s]]" % pagename
 
 @visitor.when(CategoryLink)
-def convert(link, context, trailing_newline):
+def convert_node(link, context, trailing_newline):
     # Category functionality can be implemented with plugin:tag, but not used here
-    return ""
+    yield ""
 
 @visitor.when(NamespaceLink)
-def convert(link, context, trailing_newline):
+def convert_node(link, context, trailing_newline):
     if is_file_namespace(link.target): # is a link to a file or image
-        filename = dokuwiki.make_dokuwiki_pagename(canonicalise_file_namespace(link.target))
-        caption = convert_children(link, context).strip()
+        filename = dokuwiki.pagenames.get(canonicalise_file_namespace(link.target))
+        caption = (yield convert_children(link, context)).strip()
         if len(caption) > 0:
-            return u"{{%s%s}}" % (filename, caption)
+            yield u"{{%s%s}}" % (filename, caption)
         else:
-            return u"{{%s}}" % filename
+            yield u"{{%s}}" % filename
+        return
 
     print("WARNING: Ignoring namespace link to " + link.target)
-    return convert_children(link, context)
+    yield convert_children(link, context)
 
 
 @visitor.when(ItemList)
-def convert(itemlist, context, trailing_newline):
+def convert_node(itemlist, context, trailing_newline):
     context["list_stack"].append("* " if itemlist.tagname == "ul" else "- ")
-    converted_list = convert_children(itemlist, context)
+    converted_list = yield convert_children(itemlist, context)
     context["list_stack"].pop()
-    return converted_list
+    yield converted_list
 
 @visitor.when(Item)
-def convert(item, context, trailing_newline):
-    item_content = convert_children(item, context)
+def convert_node(item, context, trailing_newline):
+    item_content = yield convert_children(item, context)
     list_stack = context["list_stack"]
-    return "  "*len(list_stack) + list_stack[-1] + item_content
+    yield "  "*len(list_stack) + list_stack[-1] + item_content
 
 @visitor.when(Table)
-def convert(table, context, trailing_newline):
+def convert_node(table, context, trailing_newline):
     # we ignore the actual Table tags, instead convert each Row & Cell individually
-    return convert_children(table, context)
+    yield convert_children(table, context)
 
 @visitor.when(Cell)
-def convert(cell, context, trailing_newline):
+def convert_node(cell, context, trailing_newline):
     marker = "^" if cell.tagname == "th" else "|"
-    result = u"%s %s" % (marker, convert_children(cell, context).replace('\n','').strip())
-    return result
+    children = yield convert_children(cell, context)
+    yield u"%s %s" % (marker, children.replace('\n','').strip())
 
 @visitor.when(Row)
-def convert(row, context, trailing_newline):
-    return convert_children(row, context) + " |\n"
+def convert_node(row, context, trailing_newline):
+    children = yield convert_children(row, context)
+    yield children + " |\n"
 
 @visitor.when(PreFormatted)
-def convert(pre, context, trailing_newline):
+def convert_node(pre, context, trailing_newline):
     in_list = len(context["list_stack"]) > 0
+    children = yield convert_children(pre, context)
     if trailing_newline and not in_list: # in its own paragraph, use a two space indent
-        return "  " + convert_children(pre, context).replace("\n","\n  ").strip(" ")
+        yield "  " + children.replace("\n","\n  ").strip(" ")
     else: # inline in a list or a paragraph body, use <code> tags
-        return "<code>" + convert_children(pre, context) + "</code>"
+        yield "<code>" + children + "</code>"
 
 @visitor.when(TagNode)
-def convert(tag, context, trailing_newline):
+def convert_node(tag, context, trailing_newline):
     # dict maps mediawiki tag name to tuple of starting, ending dokuwiki tag
     simple_tagitems = {
         "tt" : ("''", "''"),
@@ -246,11 +433,15 @@ def convert(tag, context, trailing_newline):
     }
     if tag.tagname in simple_tagitems:
         pre,post = simple_tagitems[tag.tagname]
-        return pre + convert_children(tag, context) + post
+        children = yield convert_children(tag, context)
+        yield pre + children + post
+        return
     elif tag._text is not None:
         if tag._text.replace(" ","").replace("/","") == "<br>":
-            return "\n" # this is a oneoff hack for one wiki page covered in <br/>
-        return tag._text # may not work for non-selfclosing tags
+            yield "\n" # this is a oneoff hack for one wiki page covered in <br/>
+        else:
+            yield tag._text # may not work for non-selfclosing tags
+        return
     elif tag.tagname == "gallery":
         # with a lot of cleverness we could use the gallery plugin for this,
         # but this should do. We flag each child image as in the gallery, then
@@ -260,10 +451,10 @@ def convert(tag, context, trailing_newline):
     elif tag.tagname == "references":
         print("WARNING: <references> tag has no equivalent in Dokuwiki, ignoring...")
 
-    return convert_children(tag, context)
+    yield convert_children(tag, context)
 
 @visitor.when(Math)
-def convert(node, context, trailing_newline):
+def convert_node(node, context, trailing_newline):
     """
     Convert <math></math> tags for rendering of math terms
     there are a couple of extension to support this in dokuwiki
@@ -271,13 +462,13 @@ def convert(node, context, trailing_newline):
     """
     if "\n" in node.math:
         # multiple lines are a formula block
-        return "$$" + node.math + "$$"
-    # anything else is inline term
-    return "$" + node.math + "$"
+        yield "$$" + node.math + "$$"
+    else: # anything else is inline term
+        yield "$" + node.math + "$"
 
 
 @visitor.when(Caption)
-def convert(node, context, trailing_newline):
+def convert_node(node, context, trailing_newline):
 	"""
 	Convert table captions to bold paragraph preceeding the table.
 	
@@ -286,14 +477,15 @@ def convert(node, context, trailing_newline):
 	worrying about it being inside <table> (which <caption> should be)
 	in the rendered HTML.
 	"""
-	return "** %s **\n" % convert_children(node, context)
+	children = yield convert_children(node, context)
+	yield "** %s **\n" % children
 
 # catchall for Node, which is the parent class of everything above
 @visitor.when(Node)
-def convert(node, context, trailing_newline):
+def convert_node(node, context, trailing_newline):
     if node.__class__ != Node:
         print("WARNING: Unsupported node type: %s" % (node.__class__))
-    return convert_children(node, context)
+    yield convert_children(node, context)
 
 def convert_internal_link(mw_target):
     """
@@ -307,7 +499,7 @@ def convert_internal_link(mw_target):
         page = mw_target
         anchor = None
     if len(page):
-        page = dokuwiki.make_dokuwiki_pagename(page)
+        page = dokuwiki.pagenames.get(page)
     if anchor is not None:
         page = page + "#" + dokuwiki.make_dokuwiki_heading_id(anchor)
     return page
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+"""Benchmarks for mediawiki->dokuwiki conversion.
+
+Times wikicontent.convert_pagecontent() on the test fixtures (every
+tests/*/mediawiki.txt) and on generated big pages: deeply nested lists,
+a 5,000 row table, long paragraphs and pages full of links. For each
+case prints pages converted per second, time per KB of markup and the
+peak memory used, then the time spent converting each type of parse node.
+
+Each case runs in its own process (so its peak memory can be measured),
+and the fastest of --repeat runs is used.
+
+Results can be saved as a baseline with --save, and later runs checked
+against it with --baseline: any case which is more than --threshold
+percent slower than the baseline is reported and the exit status is 1.
+
+Run with --scaling to instead time the parse and conversion of pages of
+increasing size, conversion time per KB of markup should stay roughly
+constant as pages grow. If it climbs then something in the converter is
+scaling worse than linearly with page size.
+
+Copyright (C) 2014 Angus Gratton
+Licensed under New BSD License as described in the file LICENSE.
+
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+import argparse, sys, os, time, json, codecs, collections, multiprocessing, resource
+from mwlib import uparser
+import wikicontent, wikicontent_tests
+
+DEFAULT_SIZES = [ 1000, 2000, 4000, 8000, 16000 ]
+
+def make_paragraph(n):
+    """ One paragraph with n links and styled words (a node with very many children) """
+    return "".join("word %d [[Some Page %d|link]] ''italic'' '''bold''' " % (i, i) for i in range(n)) + "\n"
+
+def make_list(n):
+    """ A bulleted list of n items, with some nesting """
+    return "".join("%s item %d with [[Page %d]]\n" % ("**" if i % 3 else "*", i, i) for i in range(n))
+
+def make_table(n):
+    """ A table with n rows of three cells """
+    rows = "".join("|-\n| cell %d || ''cell'' || [[Row %d]]\n" % (i, i) for i in range(n))
+    return "{|\n! A !! B !! C\n%s|}\n" % rows
+
+def make_nested_list(n, depth=30):
+    """ A list of n items, nesting in and out to 'depth' levels with a mix of bullets & numbers """
+    items = []
+    for i in range(n):
+        level = depth - abs(i % (2 * depth) - depth) + 1
+        items.append("%s item %d ''at'' level %d\n" % ("*#" * (level // 2) + "*" * (level % 2), i, level))
+    return "".join(items)
+
+def make_links(n):
+    """ A page of n links, to a few hundred different pages (some with anchors, some to files) """
+    links = []
+    for i in range(n):
+        target = "Linked Page %d" % (i % 300)
+        if i % 7 == 0:
+            links.append("[[File:Picture %d.png|thumb|caption %d]]" % (i % 50, i))
+        elif i % 5 == 0:
+            links.append("[[%s#Section %d|%s]]" % (target, i % 10, target))
+        else:
+            links.append("[[%s]]" % target)
+        links.append("\n" if i % 10 == 9 else " ")
+    return "".join(links)
+
+GENERATORS = [ ("paragraph", make_paragraph), ("list", make_list), ("table", make_table) ]
+
+def fixture_pages():
+    """ (title, content) of each test fixture """
+    pages = []
+    testsdir = wikicontent_tests.tests_dirpath()
+    for test in sorted(os.listdir(testsdir)):
+        path = os.path.join(testsdir, test, "mediawiki.txt")
+        if os.path.exists(path):
+            with codecs.open(path, "r", "utf-8") as f:
+                pages.append((test, f.read()))
+    return pages
+
+# name -> function returning the list of (title, content) pages for each benchmark case
+CASES = collections.OrderedDict([
+    ("fixtures", fixture_pages),
+    ("nested_lists", lambda: [ ("Nested Lists", make_nested_list(2000)) ]),
+    ("table_5000_rows", lambda: [ ("Table", make_table(5000)) ]),
+    ("long_paragraphs", lambda: [ ("Paragraphs", "\n".join(make_paragraph(500) for _ in range(10))) ]),
+    ("many_links", lambda: [ ("Links", make_links(5000)) ]),
+])
+
+def run_case(job):
+    """
+    Runs in a separate process. job is a tuple of case name & number of repeats,
+    returns a dict of results for the case.
+    """
+    name, repeat = job
+    pages = CASES[name]()
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        for title, content in pages:
+            wikicontent.convert_pagecontent(title, content)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak //= 1024 # bytes, not KB
+    kb = sum(len(content.encode("utf-8")) for title, content in pages) / 1024
+    return { "pages" : len(pages), "kb" : kb, "seconds" : best,
+             "pages_per_sec" : len(pages) / best, "peak_rss_kb" : peak }
+
+def run_suite(repeat):
+    """ Run every case, in its own process. Returns a dict of case name -> results """
+    results = collections.OrderedDict()
+    print("%-16s %6s %8s %10s %10s %10s" % ("case", "pages", "size", "pages/s", "ms/KB", "peak MB"))
+    for name in CASES:
+        pool = multiprocessing.Pool(1)
+        try:
+            result = pool.apply(run_case, ((name, repeat),))
+        finally:
+            pool.terminate()
+        results[name] = result
+        print("%-16s %6d %7dK %10.2f %10.3f %10.1f" % (name, result["pages"], result["kb"], result["pages_per_sec"],
+                                                       result["seconds"] * 1000 / result["kb"], result["peak_rss_kb"] / 1024))
+    return results
+
+def time_node_types():
+    """
+    Convert every case once with each convert_node() overload timed, returns a dict of
+    node class name -> [ number of nodes, seconds spent converting them ]
+
+    Time spent converting a node's children is counted against the children, not the node.
+    """
+    stats = collections.defaultdict(lambda: [ 0, 0.0 ])
+    overload = wikicontent.convert_node
+    original = dict(overload.registry)
+
+    def timed(func):
+        def timed_convert(node, context, trailing_newline):
+            stat = stats[node.__class__.__name__]
+            stat[0] += 1
+            steps = func(node, context, trailing_newline)
+            result = None
+            while True:
+                start = time.time()
+                try:
+                    step = steps.send(result)
+                except StopIteration:
+                    stat[1] += time.time() - start
+                    return
+                stat[1] += time.time() - start
+                result = yield step
+        return timed_convert
+
+    try:
+        for nodetype, func in original.items():
+            overload.register(nodetype, timed(func), overload.allow_cascade[nodetype])
+        for name, pages in CASES.items():
+            for title, content in pages():
+                wikicontent.convert_pagecontent(title, content)
+    finally:
+        for nodetype, func in original.items():
+            overload.register(nodetype, func, overload.allow_cascade[nodetype])
+    return stats
+
+def print_node_types(stats):
+    print("Conversion time by node type (not including parsing):")
+    print("%-16s %10s %12s %12s" % ("node type", "nodes", "total ms", "us/node"))
+    for name, (count, seconds) in sorted(stats.items(), key=lambda item: -item[1][1]):
+        print("%-16s %10d %12.1f %12.2f" % (name, count, seconds * 1000, seconds * 1e6 / count))
+
+def check_baseline(results, baseline, threshold):
+    """
+    Print any case more than threshold percent slower than in baseline, return True if there are none
+    """
+    ok = True
+    for name, result in results.items():
+        if not name in baseline:
+            continue
+        before = baseline[name]["pages_per_sec"]
+        change = (result["pages_per_sec"] - before) * 100 / before
+        if change < -threshold:
+            print("REGRESSION: %s converts %.2f pages/s, %.0f%% slower than the baseline (%.2f pages/s)" %
+                  (name, result["pages_per_sec"], -change, before))
+            ok = False
+    return ok
+
+def time_page(title, content):
+    """
+    Return (parse seconds, conversion seconds) for one page of content.
+
+    Mirrors wikicontent.convert_pagecontent() but times the two stages separately.
+    """
+    start = time.time()
+    root = uparser.parseString(title, content)
+    parsed = time.time()
+    context = { "list_stack" : [], "nowiki_plaintext" : [] }
+    wikicontent.convert(root, context, False)
+    return (parsed - start, time.time() - parsed)
+
+def run_scaling(sizes):
+    print("%-10s %8s %10s %10s %12s" % ("page", "size", "parse (s)", "convert (s)", "convert ms/KB"))
+    for name, generator in GENERATORS:
+        for size in sizes:
+            content = generator(size)
+            kb = len(content.encode("utf-8")) / 1024
+            parse, conversion = time_page("Bench", content)
+            print("%-10s %7dK %10.3f %10.3f %12.3f" % (name, kb, parse, conversion, conversion * 1000 / kb))
+
+def main():
+    args = arguments.parse_args()
+    if args.scaling:
+        run_scaling(args.sizes or DEFAULT_SIZES)
+        return True
+    results = run_suite(args.repeat)
+    print()
+    print_node_types(time_node_types())
+    if args.save is not None:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print("Saved results to %s" % args.save)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not check_baseline(results, baseline, args.threshold):
+            return False
+        print("No case is more than %g%% slower than %s" % (args.threshold, args.baseline))
+    return True
+
+# Parser for command line arguments
+arguments = argparse.ArgumentParser(description='Benchmark converting Mediawiki markup to Dokuwiki markup.')
+arguments.add_argument('--repeat', metavar='N', type=int, default=3, help="Run each case N times and use the fastest (default 3.)")
+arguments.add_argument('--save', metavar='BASELINE', help="Save the results to the JSON file BASELINE.")
+arguments.add_argument('--baseline', metavar='BASELINE', help="Compare the results to the JSON file BASELINE saved by an earlier run, exit with status 1 if any case is slower by more than --threshold.")
+arguments.add_argument('--threshold', metavar='PERCENT', type=float, default=20.0, help="How much slower than the baseline a case can be before it counts as a regression (default 20%%.)")
+arguments.add_argument('--scaling', help="Time the parsing and conversion of generated pages of increasing sizes instead.", action="store_true")
+arguments.add_argument('sizes', metavar='SIZE', type=int, nargs='*', help="With --scaling, the numbers of repetitions of each generated element (default %s.)" % " ".join(str(size) for size in DEFAULT_SIZES))
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
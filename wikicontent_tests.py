@@ -10,6 +10,9 @@ Goes through every subdirectory of the tests/ directory. Each subdirectory conta
 Converts mediawiki.txt and compares output to dokuwiki.txt, prints an
 error (and contents of notes.txt) if the output does not match.
 
+Also converts some generated pages nested too deeply for Python's default
+recursion limit, which must convert without an error.
+
 Copyright (C) 2014 Angus Gratton
 Licensed under New BSD License as described in the file LICENSE.
 
@@ -21,6 +24,10 @@ import wikicontent, yamdwe
 
 DELIMITER="@"*40
 
+# (name, Mediawiki content) of pages which mwlib can only parse with the recursion limit raised
+DEEP_NESTING_TESTS = [ ("nested tables", "{|\n|\n" * 400 + "innermost\n" + "|}\n" * 400),
+                       ("nested lists", "".join("*" * depth + " item %d\n" % depth for depth in range(1, 801))) ]
+
 def prep_difflines(content):
     """ difflib takes input in this "readlines" compatible format """
     return [ x+"\n" for x in content.split("\n") ]
@@ -45,7 +52,15 @@ def run_test(testdir):
     try:
         converted = wikicontent.convert_pagecontent(pagename, mw).strip()
         if converted == dw:
-            return True
+            # converting section by section must give the same result, both the first time and reusing the sections
+            sections = wikicontent.SectionConverter(pagename)
+            for revision in range(2):
+                converted = sections.convert_pagecontent(mw).strip()
+                if converted != dw:
+                    print("SECTION CONVERSION MISMATCH")
+                    break
+            else:
+                return True
     except:
         print("CONVERSION ERROR")
         traceback.print_exc()
@@ -70,6 +85,24 @@ def run_test(testdir):
     print(DELIMITER)
     return False
 
+def run_deep_nesting_test(name, mw):
+    """
+    Convert the deeply nested page 'mw', return True if it converts without an error
+    """
+    print("Running %s..." % name)
+    try:
+        converted = wikicontent.convert_pagecontent(name, mw)
+    except:
+        print("CONVERSION ERROR")
+        traceback.print_exc()
+        print(DELIMITER)
+        return False
+    if not ("innermost" in converted or "item 800" in converted):
+        print("OUTPUT MISSING THE INNERMOST CONTENT")
+        print(DELIMITER)
+        return False
+    return True
+
 def tests_dirpath():
     """ Return path to the test directory """
     execdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
@@ -88,6 +121,10 @@ def run_all_tests():
             testsrun += 1
             if run_test(path):
                 successes += 1
+    for name, mw in DEEP_NESTING_TESTS:
+        testsrun += 1
+        if run_deep_nesting_test(name, mw):
+            successes += 1
     print("--- %d/%d TESTS PASSED ---" % (successes, testsrun))
     return successes == testsrun
 
@@ -0,0 +1,211 @@
+"""
+Helpers for farming work out to a pool of workers (threads or processes)
+while keeping the results in their original order.
+
+Copyright (C) 2014 Angus Gratton
+Licensed under New BSD License as described in the file LICENSE.
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+import collections, multiprocessing, select, time, sys, os
+
+def imap_bounded(pool, func, iterable, window):
+    """
+    Like pool.imap(func, iterable), but yields results in the order of 'iterable' while
+    never having more than 'window' items submitted and not yet consumed.
+
+    (pool.imap consumes the whole input iterable up front and buffers results without limit,
+    which isn't what we want when each item is a page full of revisions.)
+    """
+    pending = collections.deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+# how often (in seconds) SupervisedPool checks its workers are within their time & memory budgets
+CHECK_INTERVAL = 0.5
+
+class SupervisedPool(object):
+    """
+    A pool of worker processes running func(item) for items, like multiprocessing.Pool, except
+    that a worker which goes over its time or memory budget is killed (and replaced), and the
+    item it was working on fails instead of holding up everything else.
+
+    func(item) returns an iterable, each value is sent back as soon as it is produced and
+    time_limit (seconds) is the longest a worker may take to produce each value. memory_limit
+    is the most resident memory (bytes) a worker may use, this is only checked on Linux.
+    A worker which raises an exception or dies also fails its item.
+    """
+    def __init__(self, processes, func, initializer=None, initargs=(), time_limit=None, memory_limit=None):
+        self.func = func
+        self.initializer = initializer
+        self.initargs = initargs
+        self.time_limit = time_limit
+        self.memory_limit = memory_limit
+        self.workers = [ self._start_worker() for _ in range(processes) ]
+        self.last_check = time.time()
+
+    def imap(self, iterable, window):
+        """
+        Yields (values, failure) for each item of 'iterable', in order. values is the list of values
+        func(item) produced, failure is None or a description of why it failed (and then values are
+        just the ones produced before it failed.) Never has more than 'window' items submitted and
+        not yet consumed.
+        """
+        items = iter(iterable)
+        queue = collections.deque() # (index, item) of each item waiting for a worker
+        results = {} # index -> [ values, failure, finished ]
+        next_index = next_result = 0
+        exhausted = False
+        while True:
+            while not exhausted and next_index - next_result < window:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                queue.append((next_index, item))
+                results[next_index] = [ [], None, False ]
+                next_index += 1
+            if next_result in results and results[next_result][2]:
+                values, failure, finished = results.pop(next_result)
+                next_result += 1
+                yield values, failure
+                continue
+            if exhausted and next_result == next_index:
+                return
+            for worker in self.workers:
+                if worker.index is None and queue:
+                    if not worker.process.is_alive(): # died while idle (ie killed from outside), so no item fails
+                        worker = self._restart_worker(worker)
+                    worker.index, item = queue.popleft()
+                    worker.last_value = time.time()
+                    worker.conn.send(item)
+            self._wait_for_workers(results)
+
+    def terminate(self):
+        for worker in self.workers:
+            worker.process.terminate()
+            worker.conn.close()
+        for worker in self.workers:
+            worker.process.join()
+        self.workers = []
+
+    def _start_worker(self):
+        conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=_run_supervised_worker,
+                                          args=(child_conn, self.func, self.initializer, self.initargs))
+        process.daemon = True
+        process.start()
+        child_conn.close()
+        return _SupervisedWorker(process, conn)
+
+    def _wait_for_workers(self, results):
+        """
+        Wait for messages from the busy workers (adding them to 'results'), and every CHECK_INTERVAL
+        replace any worker that is over its budget
+        """
+        busy = [ worker for worker in self.workers if worker.index is not None ]
+        for worker in _wait_readable(busy, CHECK_INTERVAL):
+            result = results[worker.index]
+            try:
+                message, value = worker.conn.recv()
+            except EOFError:
+                worker.process.join()
+                self._replace_worker(worker, results, "the worker process died (exit code %s)" % worker.process.exitcode)
+                continue
+            if message == "value":
+                result[0].append(value)
+                worker.last_value = time.time()
+            else: # "done" or "error"
+                result[1] = value
+                result[2] = True
+                worker.index = None
+
+        now = time.time()
+        if now - self.last_check < CHECK_INTERVAL:
+            return
+        self.last_check = now
+        for worker in busy:
+            if worker.index is None:
+                continue
+            if self.time_limit and now - worker.last_value > self.time_limit:
+                self._replace_worker(worker, results, "took more than %g seconds" % self.time_limit)
+            elif self.memory_limit and (get_rss(worker.process.pid) or 0) > self.memory_limit:
+                self._replace_worker(worker, results, "used more than %d MB of memory" % (self.memory_limit // (1024 * 1024)))
+
+    def _replace_worker(self, worker, results, failure):
+        """
+        Kill 'worker', fail the item it was working on and start a new worker in its place
+        """
+        worker.process.terminate()
+        result = results[worker.index]
+        result[1] = failure
+        result[2] = True
+        worker.index = None # so it isn't checked (and replaced) again
+        self._restart_worker(worker)
+
+    def _restart_worker(self, worker):
+        """
+        Start a new worker in place of the stopped 'worker', and return it
+        """
+        worker.process.join()
+        worker.conn.close()
+        new_worker = self._start_worker()
+        self.workers[self.workers.index(worker)] = new_worker
+        return new_worker
+
+class _SupervisedWorker(object):
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.index = None # index of the item it is working on
+        self.last_value = None # time it last sent a value (or started the item)
+
+def _run_supervised_worker(conn, func, initializer, initargs):
+    """
+    Main loop of a SupervisedPool worker process
+    """
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        try:
+            item = conn.recv()
+        except EOFError:
+            return
+        try:
+            for value in func(item):
+                conn.send(("value", value))
+        except Exception as e:
+            conn.send(("error", "%s: %s" % (e.__class__.__name__, e)))
+        else:
+            conn.send(("done", None))
+
+def _wait_readable(workers, timeout):
+    """
+    Return the workers with a message waiting to be read from their connections, waiting up to 'timeout' seconds
+    """
+    if not workers:
+        time.sleep(timeout)
+        return []
+    if sys.platform == "win32": # select only works on sockets, so poll
+        deadline = time.time() + timeout
+        while True:
+            ready = [ worker for worker in workers if worker.conn.poll() ]
+            if ready or time.time() >= deadline:
+                return ready
+            time.sleep(0.01)
+    conns = dict((worker.conn.fileno(), worker) for worker in workers)
+    return [ conns[fd] for fd in select.select(list(conns), [], [], timeout)[0] ]
+
+def get_rss(pid):
+    """
+    Return the resident memory (bytes) of process 'pid', or None if it can't be found (only works on Linux)
+    """
+    try:
+        with open("/proc/%d/statm" % pid) as f:
+            return int(f.read().split()[1]) * os.sysconf(str("SC_PAGE_SIZE"))
+    except (IOError, OSError, ValueError, IndexError):
+        return None
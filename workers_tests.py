@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""Tests for the SupervisedPool, with a stand-in converter that sleeps, allocates memory,
+exits or raises when asked to.
+
+Copyright (C) 2014 Angus Gratton
+Licensed under New BSD License as described in the file LICENSE.
+
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+import os, time, unittest
+import workers
+
+MB = 1024 * 1024
+
+def convert(item):
+    """ item is (action, argument), yields the action before and after doing it """
+    action, argument = item
+    yield "start"
+    if action == "sleep":
+        time.sleep(argument)
+    elif action == "allocate":
+        data = b"x" * argument
+        time.sleep(10)
+    elif action == "exit":
+        os._exit(argument)
+    elif action == "sleep_exit":
+        time.sleep(argument)
+        os._exit(1)
+    elif action == "raise":
+        raise ValueError(argument)
+    yield action
+
+class SupervisedPoolTests(unittest.TestCase):
+    def run_pool(self, items, processes=2, **kwargs):
+        pool = workers.SupervisedPool(processes, convert, **kwargs)
+        try:
+            return list(pool.imap(items, 2 * processes))
+        finally:
+            pool.terminate()
+
+    def test_values_in_order(self):
+        items = [ ("sleep", 0.2), ("sleep", 0), ("nothing", None), ("sleep", 0.1) ]
+        self.assertEqual(self.run_pool(items, processes=3),
+                         [ ([ "start", action ], None) for action, argument in items ])
+
+    def test_time_limit(self):
+        results = self.run_pool([ ("sleep", 0), ("sleep", 30), ("sleep", 0) ], time_limit=0.5)
+        self.assertEqual(results, [ ([ "start", "sleep" ], None), ([ "start" ], "took more than 0.5 seconds"), ([ "start", "sleep" ], None) ])
+
+    def test_memory_limit(self):
+        if workers.get_rss(os.getpid()) is None:
+            self.skipTest("memory use can't be checked on this platform")
+        results = self.run_pool([ ("allocate", 200 * MB), ("sleep", 0) ], memory_limit=100 * MB)
+        self.assertEqual(results, [ ([ "start" ], "used more than 100 MB of memory"), ([ "start", "sleep" ], None) ])
+
+    def test_worker_exits(self):
+        results = self.run_pool([ ("exit", 3), ("sleep", 0), ("exit", 4), ("sleep", 0) ], processes=1)
+        self.assertEqual(results, [ ([ "start" ], "the worker process died (exit code 3)"), ([ "start", "sleep" ], None),
+                                    ([ "start" ], "the worker process died (exit code 4)"), ([ "start", "sleep" ], None) ])
+
+    def test_exception(self):
+        results = self.run_pool([ ("raise", "bad item"), ("sleep", 0) ])
+        self.assertEqual(results, [ ([ "start" ], "ValueError: bad item"), ([ "start", "sleep" ], None) ])
+
+    def test_worker_exits_when_over_time_limit(self):
+        # the worker dies after going over its time limit, but before the limits are checked. It is
+        # already replaced when they are checked (straight after), and mustn't be replaced again
+        check_interval = workers.CHECK_INTERVAL
+        workers.CHECK_INTERVAL = 2
+        pool = workers.SupervisedPool(1, convert, time_limit=0.5)
+        try:
+            pool.last_check = time.time() - 1.5
+            results = list(pool.imap([ ("sleep_exit", 1), ("sleep", 0) ], 2))
+        finally:
+            pool.terminate()
+            workers.CHECK_INTERVAL = check_interval
+        self.assertEqual(results, [ ([ "start" ], "the worker process died (exit code 1)"), ([ "start", "sleep" ], None) ])
+
+    def test_idle_worker_dies(self):
+        # a worker killed between items is replaced before it is given the next one
+        pool = workers.SupervisedPool(2, convert)
+        try:
+            self.assertEqual(list(pool.imap([ ("sleep", 0) ], 2)), [ ([ "start", "sleep" ], None) ])
+            for worker in pool.workers:
+                worker.process.terminate()
+                worker.process.join()
+            results = list(pool.imap([ ("sleep", 0), ("sleep", 0) ], 2))
+        finally:
+            pool.terminate()
+        self.assertEqual(results, [ ([ "start", "sleep" ], None) ] * 2)
+
+if __name__ == "__main__":
+    unittest.main()
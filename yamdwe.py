@@ -14,66 +14,97 @@ Licensed under New BSD License as described in the file LICENSE.
 from __future__ import print_function, unicode_literals, absolute_import, division
 import argparse, sys, codecs, locale, getpass, datetime
 from pprint import pprint
-import mediawiki, dokuwiki, wikicontent
+import mediawiki, mediawiki_dump, mediawiki_db, revstore, dokuwiki, wikicontent, httpsession, convcache
 # only needed to check for domain functionality
 import simplemediawiki, inspect
 
 def main():
-    # the wikicontent code (that uses visitor module) tends to recurse quite deeply for complex pages
-    sys.setrecursionlimit(20000)
-
     # try not to crash if the output/console has a character we can't encode
     sys.stdout = codecs.getwriter(locale.getpreferredencoding())(sys.stdout, "replace")
 
-    args = arguments.parse_args()
+    args = parse_arguments()
+
+    sources = [ value for value in (args.mediawiki, args.dump, args.db, args.replay) if value is not None ]
+    if len(sources) != 1:
+        raise RuntimeError("ERROR: Need exactly one of the Mediawiki API URL (or --api), an XML dump (--dump), a database (--db) or a store (--replay) to read from")
 
     if args.http_pass is not None and args.http_user is None:
         raise RuntimeError("ERROR: Option --http_pass requires --http_user to also be specified")
     if args.wiki_pass is not None and args.wiki_user is None:
         raise RuntimeError("ERROR: Option --wiki_pass requires --wiki_user to also be specified")
+    if args.incremental and (args.dump is not None or args.replay is not None or args.db is not None):
+        raise RuntimeError("ERROR: Option --incremental needs the Mediawiki API, it can't be used with --dump, --db or --replay")
+    sharded = args.namespace is not None or args.title_from is not None or args.title_to is not None
+    if sharded and (args.dump is not None or args.replay is not None or args.db is not None or args.incremental):
+        raise RuntimeError("ERROR: Options --namespace, --from and --to need the Mediawiki API, they can't be used with --dump, --db, --replay or --incremental")
 
     if args.http_user is not None and args.http_pass is None:
         args.http_pass = getpass.getpass("Enter password for HTTP auth (%s):" % args.http_user)
     if args.wiki_user is not None and args.wiki_pass is None:
         args.wiki_pass = getpass.getpass("Enter password for Wiki login (%s):" % args.wiki_user)
+    if args.db is not None and args.db_pass is None:
+        args.db_pass = getpass.getpass("Enter MySQL password for user %s (leave empty for none):" % args.db_user)
 
-    if not args.mediawiki.endswith("api.php"):
-        print("WARNING: Mediawiki URL does not end in 'api.php'... This has to be the URL of the Mediawiki API, not just the wiki. If you can't export anything, try adding '/api.php' to the wiki URL.")
+    # one pool of keep-alive connections for all API calls and image downloads
+    session = httpsession.make_session(args.http_user, args.http_pass, max(args.http_connections, args.fetch_workers, args.image_workers))
 
-    if "domain" in inspect.getargspec(simplemediawiki.MediaWiki.__init__)[0]:
-        importer = mediawiki.Importer(args.mediawiki, args.http_user, args.http_pass, args.wiki_user, args.wiki_pass, args.wiki_domain, args.verbose)
-    else:
-        importer = mediawiki.Importer(args.mediawiki, args.http_user, args.http_pass, args.wiki_user, args.wiki_pass, args.verbose)
-    exporter = dokuwiki.Exporter(args.dokuwiki)
+    importer = make_importer(args, session)
+    if args.store is not None:
+        importer = revstore.Recorder(importer, args.store)
+    cache = convcache.ConversionCache(args.cache_size, args.conversion_cache)
+    exporter = dokuwiki.Exporter(args.dokuwiki, cache, not args.no_section_reuse)
 
     # Set the wikicontent's definition of File: and Image: prefixes (varies by language settings)
     canonical_file, aliases = importer.get_file_namespaces()
     wikicontent.set_file_namespaces(canonical_file, aliases)
 
-    # Read all pages and page revisions
-    pages = importer.get_all_pages()
-    print("Found %d pages to export..." % len(pages))
-
     # Add a shameless "exported by yamdwe" note to the front page of the wiki
     mainpage = importer.get_main_pagetitle()
 
-    for page in pages:
-        if page["title"] == mainpage:
-            latest = dict(page["revisions"][0])
-            latest["user"] = "yamdwe"
-            now = datetime.datetime.utcnow().replace(microsecond=0)
-            latest["timestamp"] = now.isoformat() + "Z"
-            latest["comment"] = "Automated note about use of yamdwe Dokuwiki import tool"
-            latest["*"] += "\n\n(Automatically exported to Dokuwiki from Mediawiki by [https://github.com/projectgus/yamdwe Yamdwe] on %s.)" % (datetime.date.today().strftime("%x"))
-            page["revisions"].insert(0, latest)
-
-    # Export pages to Dokuwiki format
-    exporter.write_pages(pages)
+    # For incremental runs, only export what changed since the last run (if there was one)
+    since = None
+    if args.incremental:
+        since = exporter.read_sync_timestamp()
+        sync_timestamp = importer.get_sync_timestamp()
+
+    if since is None:
+        # Read all pages and page revisions (just this shard's pages, if the work is split between
+        # several runs to be combined with yamdwe_merge.py), exporting each page to Dokuwiki format as it arrives
+        shard = {}
+        if args.namespace is not None:
+            shard["namespace"] = args.namespace
+        if args.title_from is not None:
+            shard["title_from"] = args.title_from
+        if args.title_to is not None:
+            shard["title_to"] = args.title_to
+        pages = add_yamdwe_note(importer.get_all_pages(**shard), mainpage)
+    else:
+        print("Exporting changes since the last run (%s)..." % since)
+        pages = importer.get_changed_pages(since)
+    exporter.write_pages(pages, append=since is not None, convert_workers=args.convert_workers,
+                         time_limit=args.convert_timeout, memory_limit=args.convert_memory * 1024 * 1024,
+                         raw_on_failure=args.keep_failed_pages)
+    if exporter.failures:
+        print("%d pages failed to convert%s:" % (len(exporter.failures), "" if args.keep_failed_pages else " and were not exported"))
+        for title, reason in exporter.failures:
+            print("    %s (%s)" % (title, reason))
+    if args.failure_report is not None:
+        with codecs.open(args.failure_report, "w", "utf-8") as f:
+            for title, reason in exporter.failures:
+                print("%s\t%s" % (title, reason), file=f)
+
+    cache.close()
+    print("%d revisions exported, %d were found in the conversion cache." % (cache.hits + cache.misses, cache.hits))
 
     # Bring over images
-    images = importer.get_all_images()
-    print("Found %d images to export..." % len(images))
-    exporter.write_images(images, canonical_file, args.http_user, args.http_pass)
+    if args.no_images:
+        print("Not exporting images (--no-images).")
+    else:
+        images = importer.get_all_images()
+        if since is not None:
+            images = [ image for image in images if image['timestamp'] >= since ]
+        print("Found %d images to export..." % len(images))
+        exporter.write_images(images, canonical_file, session, args.image_workers)
 
     # fix permissions on data directory if possible
     exporter.fixup_permissions()
@@ -81,20 +112,126 @@ def main():
     # touch conf file to invalidate cached pages
     exporter.invalidate_cache()
 
+    if args.incremental:
+        exporter.write_sync_timestamp(sync_timestamp)
+
     print("Done.")
 
-# Parser for command line arguments
-arguments = argparse.ArgumentParser(description='Convert a Mediawiki installation to a Dokuwiki installation.')
-#arguments.add_argument('-y', '--yes',help="Don't pause for confirmation before exporting", action="store_true")
-arguments.add_argument('--http_user', help="Username for HTTP basic auth")
-arguments.add_argument('--http_pass', help="Password for HTTP basic auth (if --http_user is specified but not --http_pass, yamdwe will prompt for a password)")
-arguments.add_argument('--wiki_user', help="Mediawiki login username")
-arguments.add_argument('--wiki_pass', help="Mediawiki login password (if --wiki_user is specified but not --wiki_pass, yamdwe will prompt for a password)")
-if "domain" in inspect.getargspec(simplemediawiki.MediaWiki.__init__)[0]:
-    arguments.add_argument('--wiki_domain', help="Mediawiki login domain (needs a non-standard simplemediawiki library)")
-arguments.add_argument('-v', '--verbose',help="Print verbose progress and error messages", action="store_true")
-arguments.add_argument('mediawiki', metavar='MEDIAWIKI_API_URL', help="URL of mediawiki's api.php file (something like http://mysite/wiki/api.php)")
-arguments.add_argument('dokuwiki', metavar='DOKUWIKI_ROOT', help="Root path to an existing dokuwiki installation to add the Mediawiki pages to (can be a brand new install.)")
+def make_importer(args, session):
+    """
+    Return the importer to read the wiki from, depending on the command line arguments
+    """
+    if args.replay is not None:
+        if args.store is not None:
+            raise RuntimeError("ERROR: Can't record to a store (--store) while replaying from one (--replay)")
+        return revstore.StoreImporter(args.replay, args.verbose)
+
+    if args.dump is not None:
+        return mediawiki_dump.DumpImporter(args.dump, args.verbose)
+
+    if args.db is not None:
+        db = mediawiki_db.connect_mysql(args.db_host, args.db_user, args.db_pass, args.db)
+        return mediawiki_db.DatabaseImporter(db, args.db_prefix, args.verbose)
+
+    if not args.mediawiki.endswith("api.php"):
+        print("WARNING: Mediawiki URL does not end in 'api.php'... This has to be the URL of the Mediawiki API, not just the wiki. If you can't export anything, try adding '/api.php' to the wiki URL.")
+
+    if "domain" in inspect.getargspec(simplemediawiki.MediaWiki.__init__)[0]:
+        return mediawiki.Importer(args.mediawiki, args.http_user, args.http_pass, args.wiki_user, args.wiki_pass, args.wiki_domain, verbose=args.verbose, fetch_workers=args.fetch_workers,
+                                  target_bytes=args.batch_kb * 1024, target_seconds=args.batch_seconds, session=session,
+                                  maxlag=args.maxlag, max_rate=args.max_rate)
+    else:
+        return mediawiki.Importer(args.mediawiki, args.http_user, args.http_pass, args.wiki_user, args.wiki_pass, verbose=args.verbose, fetch_workers=args.fetch_workers,
+                                  target_bytes=args.batch_kb * 1024, target_seconds=args.batch_seconds, session=session,
+                                  maxlag=args.maxlag, max_rate=args.max_rate)
+
+def add_yamdwe_note(pages, mainpage):
+    """
+    Yield each page from the iterable 'pages', adding a shameless "exported by yamdwe"
+    revision to the page titled 'mainpage' on the way through.
+    """
+    for page in pages:
+        if page["title"] == mainpage:
+            latest = dict(page["revisions"][0])
+            latest["user"] = "yamdwe"
+            now = datetime.datetime.utcnow().replace(microsecond=0)
+            latest["timestamp"] = now.isoformat() + "Z"
+            latest["comment"] = "Automated note about use of yamdwe Dokuwiki import tool"
+            latest["*"] += "\n\n(Automatically exported to Dokuwiki from Mediawiki by [https://github.com/projectgus/yamdwe Yamdwe] on %s.)" % (datetime.date.today().strftime("%x"))
+            page["revisions"].insert(0, latest)
+        yield page
+
+def parse_arguments(argv=None):
+    """
+    Parse the command line arguments 'argv' (default sys.argv[1:].)
+
+    The Mediawiki API URL is the first positional argument, followed by the Dokuwiki root. If the
+    pages are read from somewhere given by an option instead (--api, --dump, --db or --replay)
+    then the Dokuwiki root is the only positional argument.
+    """
+    source, _ = source_options.parse_known_args(argv)
+    if all(value is None for value in (source.mediawiki, source.dump, source.db, source.replay)):
+        return arguments.parse_args(argv)
+    return source_arguments.parse_args(argv)
+
+def make_arguments(api_url_positional):
+    """
+    Return the parser for the command line arguments, with or without MEDIAWIKI_API_URL as a positional argument
+    """
+    parser = argparse.ArgumentParser(description='Convert a Mediawiki installation to a Dokuwiki installation.')
+    #parser.add_argument('-y', '--yes',help="Don't pause for confirmation before exporting", action="store_true")
+    parser.add_argument('--http_user', help="Username for HTTP basic auth")
+    parser.add_argument('--http_pass', help="Password for HTTP basic auth (if --http_user is specified but not --http_pass, yamdwe will prompt for a password)")
+    parser.add_argument('--wiki_user', help="Mediawiki login username")
+    parser.add_argument('--wiki_pass', help="Mediawiki login password (if --wiki_user is specified but not --wiki_pass, yamdwe will prompt for a password)")
+    if "domain" in inspect.getargspec(simplemediawiki.MediaWiki.__init__)[0]:
+        parser.add_argument('--wiki_domain', help="Mediawiki login domain (needs a non-standard simplemediawiki library)")
+    parser.add_argument('--fetch-workers', metavar='N', type=int, default=1, help="Fetch revisions for N batches of pages at once, sharing the pool of HTTP connections (default 1.) No more than N requests are in flight at a time, but please check with the wiki operator before raising this.")
+    parser.add_argument('--image-workers', metavar='N', type=int, default=4, help="Download N images at once (default 4.)")
+    parser.add_argument('--http-connections', metavar='N', type=int, default=10, help="Keep up to N HTTP connections to the wiki server open for reuse by API calls and image downloads (default 10, raised to --fetch-workers or --image-workers if either is higher.)")
+    parser.add_argument('--maxlag', metavar='SECONDS', type=int, default=5, help="Ask the Mediawiki server to refuse API calls while its database replicas are lagging more than SECONDS behind (default 5.) Refused calls are retried after the delay the server asks for, and yamdwe slows down.")
+    parser.add_argument('--max-rate', metavar='N', type=float, default=0, help="Never make more than N API calls per second (default no limit.) With a limit, yamdwe starts at a quarter of it and speeds up while the server keeps up. Either way it backs off whenever the server reports it is lagged or overloaded.")
+    parser.add_argument('--batch-kb', metavar='KB', type=int, default=1024, help="Size API batches (within the limits the server allows) so each response is about this many kilobytes (default 1024.)")
+    parser.add_argument('--batch-seconds', metavar='SECONDS', type=float, default=2.0, help="Size API batches (within the limits the server allows) so each response takes about this long (default 2.0.) Pass --verbose to see the chosen sizes.")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--api', dest='mediawiki', metavar='MEDIAWIKI_API_URL', help="Read pages from the Mediawiki API at this URL (the same as giving MEDIAWIKI_API_URL before DOKUWIKI_ROOT.)")
+    source.add_argument('--dump', metavar='DUMPFILE', help="Read pages from a Mediawiki XML dump (made with dumpBackup.php or Special:Export, can be .gz or .bz2 compressed) instead of the API. No network access is needed, and only DOKUWIKI_ROOT is given. Images are not exported.")
+    source.add_argument('--db', metavar='MEDIAWIKI_DBNAME', help="Read pages straight from the Mediawiki MySQL database MEDIAWIKI_DBNAME instead of the API (needs MySQLdb.) Much faster than the API, and only DOKUWIKI_ROOT is given. Images are not exported.")
+    parser.add_argument('--db-host', metavar='MEDIAWIKI_DBHOST', help="Database server for the Mediawiki database, with --db (default localhost.)", default="localhost")
+    parser.add_argument('--db-user', metavar='MEDIAWIKI_USER', help="Database user for the Mediawiki database, with --db (default root.)", default="root")
+    parser.add_argument('--db-pass', metavar='PASSWORD', help="Password for the Mediawiki database user, with --db (if not specified, yamdwe will prompt for a password.)")
+    parser.add_argument('--db-prefix', metavar='TABLE_PREFIX', help="Mediawiki table prefix, optionally set in the $wgDBPrefix variable in LocalSettings.php.", default="")
+    parser.add_argument('--store', metavar='STORE', help="Record the raw pages and revisions as they are read to the SQLite file STORE (created if it doesn't exist), so later runs can use --replay STORE instead of fetching them again.")
+    source.add_argument('--replay', metavar='STORE', help="Read pages from a store recorded by an earlier run with --store, instead of the API or a dump. No network access is needed, and only DOKUWIKI_ROOT is given. Images are not exported.")
+    parser.add_argument('--incremental', help="Only export pages, revisions and images added since the last --incremental run into the same Dokuwiki (the first run exports everything.) The Mediawiki has to still have the changes in its recent changes list (kept for 90 days by default.) Deleted and moved pages are not updated.", action="store_true")
+    parser.add_argument('--convert-workers', metavar='N', type=int, default=1, help="Convert pages to Dokuwiki format in N processes at once (default 1.) Up to the number of CPU cores helps, if converting is the slow part.")
+    parser.add_argument('--convert-timeout', metavar='SECONDS', type=float, default=0, help="Give up converting a page if any revision takes longer than SECONDS (default 0, no limit.) Pages are converted in separate processes (see --convert-workers) when this is set, so a page which is too slow doesn't hold up the rest.")
+    parser.add_argument('--convert-memory', metavar='MB', type=int, default=0, help="Give up converting a page if the process converting it uses more than MB megabytes of memory (default 0, no limit. Only works on Linux.)")
+    parser.add_argument('--keep-failed-pages', help="Export pages that fail to convert anyway, with the revisions which weren't converted shown as plain Mediawiki markup in a <code> block.", action="store_true")
+    parser.add_argument('--failure-report', metavar='FILE', help="Write the title of each page that failed to convert, and why, to FILE.")
+    parser.add_argument('--cache-size', metavar='N', type=int, default=200, help="Remember the last N converted revisions, so identical revisions (ie reverts) aren't converted again (default 200, 0 to disable.)")
+    parser.add_argument('--no-section-reuse', help="Convert every revision of a page in full. By default only the sections (between headings) that changed since the revision before are converted, which gives the same result much faster for pages with long histories.", action="store_true")
+    parser.add_argument('--conversion-cache', metavar='CACHEFILE', help="Also keep converted revisions in the SQLite file CACHEFILE, so later runs only convert revisions that changed (or all of them if the conversion code changed.)")
+    parser.add_argument('--namespace', metavar='NAMESPACE_ID', type=int, help="Only export pages in the Mediawiki namespace with this id (default 0, the main namespace.) Use with --from/--to to split a big wiki between several runs, then combine them with yamdwe_merge.py.")
+    parser.add_argument('--from', dest='title_from', metavar='TITLE', help="Only export pages with titles from TITLE onwards (in the order Mediawiki lists them.)")
+    parser.add_argument('--to', dest='title_to', metavar='TITLE', help="Only export pages with titles before TITLE (so a run with --to TITLE and a run with --from TITLE cover every page once.)")
+    parser.add_argument('--no-images', help="Don't export any images (ie when splitting a wiki between several runs, only one run needs to export images.)", action="store_true")
+    parser.add_argument('-v', '--verbose',help="Print verbose progress and error messages", action="store_true")
+    if api_url_positional:
+        parser.add_argument('mediawiki', metavar='MEDIAWIKI_API_URL', help="URL of mediawiki's api.php file (something like http://mysite/wiki/api.php)")
+    parser.add_argument('dokuwiki', metavar='DOKUWIKI_ROOT', help="Root path to an existing dokuwiki installation to add the Mediawiki pages to (can be a brand new install.)")
+    return parser
+
+# Parsers for command line arguments, with the Mediawiki API URL as the first positional argument or without it
+arguments = make_arguments(True)
+source_arguments = make_arguments(False)
+
+# Just the options which say where to read pages from, to choose between the two parsers
+source_options = argparse.ArgumentParser(add_help=False)
+source_options.add_argument('--api', dest='mediawiki')
+source_options.add_argument('--dump')
+source_options.add_argument('--db')
+source_options.add_argument('--replay')
 
 if __name__ == "__main__":
     try:
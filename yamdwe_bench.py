@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+"""Benchmark of a whole yamdwe export, fetch->convert->write.
+
+Generates a synthetic wiki (see mockwiki.py), serves it from a local
+stand-in for the Mediawiki API and runs yamdwe.main() against it,
+exporting to a new Dokuwiki data directory. Then prints the wall time
+spent in each stage of the export, the number of requests yamdwe made
+(and bytes the server sent) and the number of files and bytes written.
+It also counts the filesystem calls made during the export (and, on
+Linux, the write system calls.)
+
+Time in each stage doesn't include the stages it calls, ie "fetch pages"
+is the time spent waiting for the importer to produce pages, and "write
+pages" is the time the exporter spends on everything else but fetching
+and converting them. With --convert-workers, "convert" is the time spent
+waiting for the conversion processes.
+
+Any options which aren't for the benchmark are passed on to yamdwe.py,
+ie to time an export with four fetch & convert workers:
+
+yamdwe_bench.py --pages 500 --fetch-workers 4 --convert-workers 4
+
+The API call rate limit is off (--max-rate 0) unless an option says otherwise.
+
+Copyright (C) 2014 Angus Gratton
+Licensed under New BSD License as described in the file LICENSE.
+
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+import argparse, sys, os, time, shutil, tempfile, collections, threading
+import __builtin__
+import mockwiki, mediawiki, dokuwiki, workers, yamdwe
+
+class StageTimer(object):
+    """
+    Adds up the wall time spent in each stage of the export. A stage is timed by wrapping
+    the functions and generators that make it up, time spent in a stage that is called from
+    inside another stage is only counted against the inner stage.
+
+    Not thread safe, all the wrapped functions have to be called from the same thread.
+    """
+    def __init__(self):
+        self.seconds = collections.OrderedDict()
+        self._stack = []
+        self._started = None
+        self._patched = []
+
+    def wrap(self, owner, name, stage, generator=False):
+        """ Time each call of owner.name as part of 'stage' (each step, if it returns a generator) """
+        func = getattr(owner, name)
+        self.seconds.setdefault(stage, 0.0)
+        self._patched.append((owner, name, owner.__dict__[name]))
+        timer = self
+        if generator:
+            def timed(*args, **kwargs):
+                steps = timer._call(stage, func, args, kwargs)
+                while True:
+                    try:
+                        step = timer._call(stage, next, (steps,), {})
+                    except StopIteration:
+                        return
+                    yield step
+        else:
+            def timed(*args, **kwargs):
+                return timer._call(stage, func, args, kwargs)
+        setattr(owner, name, timed)
+
+    def restore(self):
+        for owner, name, func in reversed(self._patched):
+            setattr(owner, name, func)
+        self._patched = []
+
+    def _call(self, stage, func, args, kwargs):
+        now = time.time()
+        if self._stack:
+            self.seconds[self._stack[-1]] += now - self._started
+        self._stack.append(stage)
+        self._started = now
+        try:
+            return func(*args, **kwargs)
+        finally:
+            now = time.time()
+            self.seconds[self._stack.pop()] += now - self._started
+            self._started = now
+
+# (module, function name, name to count calls as) of the filesystem calls to count
+FILESYSTEM_CALLS = [ (__builtin__, "open", "open"),
+                     (os, "stat", "stat"),
+                     (os, "lstat", "stat"),
+                     (os, "listdir", "listdir"),
+                     (os, "mkdir", "mkdir"),
+                     (os, "utime", "utime"),
+                     (os, "rename", "rename"),
+                     (os, "remove", "remove"),
+                     (os, "chmod", "chmod"),
+                     (os, "chown", "chown") ]
+
+class CallCounter(object):
+    """
+    Counts the calls made to each of FILESYSTEM_CALLS (from any thread) while it is installed
+    """
+    def __init__(self):
+        self.counts = collections.OrderedDict((name, 0) for module, function, name in FILESYSTEM_CALLS)
+        self._lock = threading.Lock()
+        self._patched = []
+
+    def install(self):
+        for module, function, name in FILESYSTEM_CALLS:
+            func = getattr(module, function)
+            self._patched.append((module, function, func))
+            setattr(module, function, self._counted(func, name))
+
+    def restore(self):
+        for module, function, func in reversed(self._patched):
+            setattr(module, function, func)
+        self._patched = []
+
+    def _counted(self, func, name):
+        def counted(*args, **kwargs):
+            with self._lock:
+                self.counts[name] += 1
+            return func(*args, **kwargs)
+        return counted
+
+def write_syscalls():
+    """ Return the number of write system calls this process has made, or None if it can't be found (only works on Linux) """
+    try:
+        with open("/proc/self/io") as f:
+            fields = dict(line.split(":", 1) for line in f.read().splitlines())
+        return int(fields["syscw"])
+    except (IOError, ValueError, KeyError):
+        return None
+
+def run_export(server, dokuwiki_root, yamdwe_args, show_output=False):
+    """
+    Run yamdwe.main() to export the wiki served by 'server' to 'dokuwiki_root', with the extra
+    command line arguments 'yamdwe_args'. Returns (total seconds, dict of stage -> seconds,
+    dict of filesystem call -> count)
+    """
+    timer = StageTimer()
+    timer.wrap(mediawiki.Importer, "__init__", "connect")
+    timer.wrap(mediawiki.Importer, "get_all_pages", "fetch pages", generator=True)
+    timer.wrap(mediawiki.Importer, "get_changed_pages", "fetch pages", generator=True)
+    timer.wrap(dokuwiki.Exporter, "write_pages", "write pages")
+    timer.wrap(dokuwiki.Exporter, "_convert_content", "convert")
+    timer.wrap(workers.SupervisedPool, "imap", "convert", generator=True)
+    timer.wrap(mediawiki.Importer, "get_all_images", "fetch image list")
+    timer.wrap(dokuwiki.Exporter, "write_images", "write images")
+    timer.wrap(dokuwiki.Exporter, "fixup_permissions", "finish")
+    timer.wrap(dokuwiki.Exporter, "invalidate_cache", "finish")
+
+    argv, stdout = sys.argv, sys.stdout
+    sys.argv = [ "yamdwe.py", "--max-rate", "0" ] + yamdwe_args + [ server.api_url, dokuwiki_root ]
+    output = None
+    if not show_output:
+        output = open(os.devnull, "w")
+        sys.stdout = output
+    counter = CallCounter()
+    writes = write_syscalls()
+    counter.install()
+    start = time.time()
+    try:
+        yamdwe.main()
+    finally:
+        elapsed = time.time() - start
+        counter.restore()
+        sys.argv, sys.stdout = argv, stdout
+        if output is not None:
+            output.close()
+        timer.restore()
+    calls = counter.counts
+    if writes is not None:
+        calls["write"] = write_syscalls() - writes
+    return elapsed, timer.seconds, calls
+
+def directory_size(path):
+    """ Return (number of files, total bytes) under 'path' """
+    files = size = 0
+    for root, dirs, filenames in os.walk(path):
+        for name in filenames:
+            files += 1
+            size += os.path.getsize(os.path.join(root, name))
+    return files, size
+
+def main():
+    args, yamdwe_args = arguments.parse_known_args()
+    print("Generating %d pages with %d revisions each and %d images..." % (args.pages, args.revisions, args.images))
+    wiki = mockwiki.make_wiki(args.pages, args.revisions, args.kb, args.images, args.image_kb, args.seed)
+    markup = sum(len(revision["*"].encode("utf-8")) for page in wiki.pages for revision in page["revisions"])
+    print("%d revisions, %.1f MB of markup." % (len(wiki.revisions), markup / (1024 * 1024)))
+
+    server = mockwiki.MockWikiServer(wiki, latency=args.latency / 1000)
+    server.start()
+    root = args.dokuwiki or tempfile.mkdtemp(prefix="yamdwe_bench")
+    try:
+        if not os.path.isdir(os.path.join(root, "data")):
+            os.makedirs(os.path.join(root, "data"))
+        print("Exporting to %s..." % root)
+        elapsed, stages, calls = run_export(server, root, yamdwe_args, args.show_output)
+        files, written = directory_size(os.path.join(root, "data"))
+    finally:
+        server.stop()
+        if args.dokuwiki is None:
+            shutil.rmtree(root)
+
+    print()
+    print("%-18s %10s %8s" % ("stage", "seconds", "share"))
+    other = elapsed - sum(stages.values())
+    for stage, seconds in list(stages.items()) + [ ("other", other) ]:
+        print("%-18s %10.3f %7.1f%%" % (stage, seconds, seconds * 100 / elapsed))
+    print("%-18s %10.3f" % ("total", elapsed))
+    print()
+    print("%.1f pages/s, %.1f revisions/s" % (len(wiki.pages) / elapsed, len(wiki.revisions) / elapsed))
+    print("%d requests, %.1f MB received" % (server.requests, server.bytes_sent / (1024 * 1024)))
+    print("%d files, %.1f MB written" % (files, written / (1024 * 1024)))
+    print("Filesystem calls: %s" % ", ".join("%s %d" % (name, count) for name, count in calls.items()))
+
+# Parser for command line arguments
+arguments = argparse.ArgumentParser(description='Benchmark a whole yamdwe export from a synthetic wiki served by a local stand-in for the Mediawiki API. Options not listed here are passed on to yamdwe.py.')
+arguments.add_argument('--pages', metavar='N', type=int, default=100, help="Number of pages in the synthetic wiki (default 100.)")
+arguments.add_argument('--revisions', metavar='N', type=int, default=10, help="Revisions of each page (default 10.)")
+arguments.add_argument('--kb', metavar='KB', type=int, default=4, help="Approximate size of the first revision of each page, in kilobytes (default 4.)")
+arguments.add_argument('--images', metavar='N', type=int, default=10, help="Number of images (default 10.)")
+arguments.add_argument('--image-kb', metavar='KB', type=int, default=32, help="Size of each image, in kilobytes (default 32.)")
+arguments.add_argument('--seed', metavar='N', type=int, default=1, help="Random seed for generating the wiki (default 1.)")
+arguments.add_argument('--latency', metavar='MS', type=float, default=0, help="Delay every response from the server by MS milliseconds (default 0.)")
+arguments.add_argument('--dokuwiki', metavar='DOKUWIKI_ROOT', help="Export to this Dokuwiki root (and keep it afterwards) instead of a temporary directory.")
+arguments.add_argument('--show-output', help="Show yamdwe's output (pass --verbose as well for more.)", action="store_true")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+Combine the output of several yamdwe.py runs into one Dokuwiki install.
+
+A big wiki can be split between several runs of yamdwe.py (as separate
+processes or on separate hosts) with the --namespace, --from and --to
+options, each run exporting to its own (empty) Dokuwiki data directory.
+yamdwe_merge.py then copies all of them into the real Dokuwiki install,
+checks no two runs exported the same page or image, and rebuilds the
+wiki-wide changelogs.
+
+Requirements:
+Python 2.7 (and the same libraries as yamdwe.py)
+
+Copyright (C) 2014 Angus Gratton
+Licensed under New BSD License as described in the file LICENSE.
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+import argparse, sys, os, os.path, shutil, collections
+import dokuwiki
+
+# subdirectories of data/ that yamdwe.py writes to
+DATA_SUBDIRS = [ "pages", "attic", "meta", "media", "media_meta" ]
+
+# files which are rebuilt or merged rather than copied
+AGGREGATE_FILES = [ os.path.join("meta", "_dokuwiki.changes"),
+                    os.path.join("meta", dokuwiki.SYNC_FILE),
+                    os.path.join("media_meta", "_media.changes"),
+                    os.path.join("media_meta", dokuwiki.MEDIA_HASH_FILE) ]
+
+def main():
+    args = arguments.parse_args()
+
+    exporter = dokuwiki.Exporter(args.dokuwiki)
+    shards = [ get_shard_files(shard) for shard in args.shards ]
+    print("Found %d files to merge from %d exports..." % (sum(len(files) for files in shards), len(shards)))
+
+    collisions = find_collisions(args.shards, shards)
+    if collisions:
+        for relpath, owners in sorted(collisions.items()):
+            if relpath.startswith("pages") or relpath.startswith("media" + os.sep):
+                print("%s was exported by more than one run: %s" % (relpath, ", ".join(owners)))
+        if not args.overwrite:
+            raise RuntimeError("%d files were exported by more than one run (do the --from/--to ranges overlap?) "
+                               "Nothing was merged. Pass --overwrite to merge anyway, with later exports replacing earlier ones." % len(collisions))
+        print("WARNING: %d files were exported by more than one run, later exports replace earlier ones." % len(collisions))
+
+    for shard, files in zip(args.shards, shards):
+        print("Merging %d files from %s..." % (len(files), shard))
+        for relpath in files:
+            src = os.path.join(shard, "data", relpath)
+            dst = os.path.join(exporter.data, relpath)
+            dokuwiki.ensure_directory_exists(os.path.dirname(dst))
+            shutil.copy2(src, dst) # keeps the modification times yamdwe set
+
+    # hashes of the merged images are still valid, as the files keep their sizes & modification times
+    hashes = dokuwiki.MediaHashIndex(os.path.join(exporter.data, "media_meta", dokuwiki.MEDIA_HASH_FILE))
+    for shard in args.shards:
+        hashes.entries.update(dokuwiki.MediaHashIndex(os.path.join(shard, "data", "media_meta", dokuwiki.MEDIA_HASH_FILE)).entries)
+    if hashes.entries:
+        hashes.save()
+
+    print("Rebuilding changelogs...")
+    exporter.rebuild_changelogs()
+    exporter.fixup_permissions()
+    exporter.invalidate_cache()
+    print("Done.")
+
+def get_shard_files(shard):
+    """
+    Return a list of the paths (relative to data/) of every file yamdwe exported to the Dokuwiki
+    root path 'shard', leaving out the files which are rebuilt after merging.
+    """
+    data = os.path.join(shard, "data")
+    if not os.path.isdir(data):
+        raise RuntimeError("Export path '%s' does not contain a data directory" % shard)
+    files = []
+    for subdir in DATA_SUBDIRS:
+        for root, dirs, filenames in os.walk(os.path.join(data, subdir)):
+            for filename in filenames:
+                relpath = os.path.relpath(os.path.join(root, filename), data)
+                if not relpath in AGGREGATE_FILES:
+                    files.append(relpath)
+    return files
+
+def find_collisions(shard_paths, shards):
+    """
+    Return a dict of each relative path found in more than one shard, to the list of those shards
+    """
+    owners = collections.defaultdict(list)
+    for shard, files in zip(shard_paths, shards):
+        for relpath in files:
+            owners[relpath].append(shard)
+    return dict((relpath, paths) for (relpath, paths) in owners.items() if len(paths) > 1)
+
+# Parser for command line arguments
+arguments = argparse.ArgumentParser(description='Combine the output of several yamdwe.py runs (ie split with --namespace, --from and --to) into one Dokuwiki installation.')
+arguments.add_argument('--overwrite', help="Merge even if more than one run exported the same page or image (later exports replace earlier ones.)", action="store_true")
+arguments.add_argument('dokuwiki', metavar='DOKUWIKI_ROOT', help="Root path to an existing dokuwiki installation to merge the exports into")
+arguments.add_argument('shards', metavar='EXPORT_ROOT', nargs='+', help="Root path of a dokuwiki installation (or just a directory containing a data directory) that yamdwe.py exported to")
+
+if __name__ == "__main__":
+    try:
+        main()
+    except RuntimeError as e:
+        print("ERROR: %s" % e)
+        sys.exit(3)
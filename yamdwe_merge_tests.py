@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""Tests for combining several exports into one Dokuwiki with yamdwe_merge.py.
+
+Copyright (C) 2014 Angus Gratton
+Licensed under New BSD License as described in the file LICENSE.
+
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+import sys, os, shutil, tempfile, unittest
+import dokuwiki, mockwiki, yamdwe_merge
+from mediawiki_tests import make_importer, quietly
+
+class MergeTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        """ Fetch a small wiki from the mock server once, each test exports its own parts of it """
+        cls.server = mockwiki.MockWikiServer(mockwiki.make_wiki(pages=5, revisions=2, kb=1, images=2, image_kb=1))
+        cls.server.start()
+        importer = make_importer(cls.server)
+        cls.pages = sorted(quietly(importer.get_all_pages), key=lambda page: page["title"])
+        cls.images = quietly(importer.get_all_images)
+        cls.session = importer.session
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.dokuwiki = self.make_root("dokuwiki")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def make_root(self, name):
+        root = os.path.join(self.tempdir, name)
+        os.makedirs(os.path.join(root, "data"))
+        return root
+
+    def export(self, name, pages, images=False):
+        """ Export 'pages' (and all the images, if set) to a new root path 'name', as one run of yamdwe.py would """
+        root = self.make_root(name)
+        exporter = dokuwiki.Exporter(root)
+        quietly(exporter.write_pages, pages)
+        if images:
+            quietly(exporter.write_images, self.images, "File", self.session)
+        return root
+
+    def merge(self, *args):
+        argv = sys.argv
+        sys.argv = [ "yamdwe_merge.py" ] + list(args)
+        try:
+            quietly(yamdwe_merge.main)
+        finally:
+            sys.argv = argv
+
+    def data_files(self, root):
+        data = os.path.join(root, "data")
+        return set(os.path.relpath(os.path.join(path, filename), data)
+                   for path, dirs, filenames in os.walk(data) for filename in filenames)
+
+    def page_path(self, root, page):
+        return os.path.join(root, "data", "pages", dokuwiki.make_dokuwiki_pagename(page["title"]) + ".txt")
+
+    def changelog(self, root, *path):
+        with open(os.path.join(root, "data", *path)) as f:
+            return f.read().splitlines()
+
+    def test_merge(self):
+        export1 = self.export("export1", self.pages[:2], images=True)
+        export2 = self.export("export2", self.pages[2:])
+        self.merge(self.dokuwiki, export1, export2)
+        for export in export1, export2:
+            for relpath in self.data_files(export) - set(yamdwe_merge.AGGREGATE_FILES):
+                merged = os.path.join(self.dokuwiki, "data", relpath)
+                self.assertTrue(os.path.exists(merged), relpath)
+                self.assertEqual(int(os.path.getmtime(merged)), int(os.path.getmtime(os.path.join(export, "data", relpath))), relpath)
+        # the wiki-wide changelog is rebuilt from both exports, oldest first
+        changes = self.changelog(self.dokuwiki, "meta", "_dokuwiki.changes")
+        self.assertEqual(sorted(changes), sorted(self.changelog(export1, "meta", "_dokuwiki.changes") +
+                                                 self.changelog(export2, "meta", "_dokuwiki.changes")))
+        self.assertEqual(changes, sorted(changes, key=dokuwiki.change_timestamp))
+        self.assertEqual(len(self.changelog(self.dokuwiki, "media_meta", "_media.changes")), len(self.images))
+
+    def test_image_hashes_merged(self):
+        export1 = self.export("export1", self.pages[:2], images=True)
+        export2 = self.export("export2", self.pages[2:])
+        self.merge(self.dokuwiki, export1, export2)
+        hashes = dokuwiki.MediaHashIndex(os.path.join(self.dokuwiki, "data", "media_meta", dokuwiki.MEDIA_HASH_FILE))
+        self.assertEqual(len(hashes.entries), len(self.images))
+        # so the merged images aren't downloaded again
+        requests = self.server.requests
+        quietly(dokuwiki.Exporter(self.dokuwiki).write_images, self.images, "File", self.session)
+        self.assertEqual(self.server.requests, requests)
+
+    def test_overlapping_exports_refused(self):
+        export1 = self.export("export1", self.pages[:3])
+        export2 = self.export("export2", self.pages[2:])
+        self.assertRaises(RuntimeError, self.merge, self.dokuwiki, export1, export2)
+        self.assertEqual(self.data_files(self.dokuwiki), set()) # nothing was merged
+
+    def test_overwrite(self):
+        export1 = self.export("export1", self.pages[:3])
+        overlap = dict(self.pages[2], revisions=self.pages[2]["revisions"][:1]) # only the newest revision
+        overlap["revisions"][0] = dict(overlap["revisions"][0], **{ "*" : "Replaced" })
+        export2 = self.export("export2", [ overlap ] + self.pages[3:])
+        self.merge("--overwrite", self.dokuwiki, export1, export2)
+        self.assertEqual(self.data_files(self.dokuwiki) - set(yamdwe_merge.AGGREGATE_FILES),
+                         (self.data_files(export1) | self.data_files(export2)) - set(yamdwe_merge.AGGREGATE_FILES))
+        with open(self.page_path(self.dokuwiki, overlap)) as f:
+            self.assertEqual(f.read().strip(), "Replaced") # the later export wins
+
+if __name__ == "__main__":
+    unittest.main()
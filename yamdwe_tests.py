@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""Tests for yamdwe.py's command line parsing.
+
+Copyright (C) 2014 Angus Gratton
+Licensed under New BSD License as described in the file LICENSE.
+
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+import sys, os, unittest
+import yamdwe
+
+class ParseArgumentsTests(unittest.TestCase):
+    def assertRejected(self, argv):
+        stderr = sys.stderr
+        sys.stderr = open(os.devnull, "w")
+        try:
+            self.assertRaises(SystemExit, yamdwe.parse_arguments, argv)
+        finally:
+            sys.stderr.close()
+            sys.stderr = stderr
+
+    def test_api_url_and_root(self):
+        args = yamdwe.parse_arguments([ "http://x/api.php", "/tmp/dokuwiki" ])
+        self.assertEqual(args.mediawiki, "http://x/api.php")
+        self.assertEqual(args.dokuwiki, "/tmp/dokuwiki")
+        self.assertEqual((args.dump, args.db, args.replay), (None, None, None))
+
+    def test_options_between_positionals(self):
+        args = yamdwe.parse_arguments([ "http://x/api.php", "-v", "/tmp/dokuwiki" ])
+        self.assertEqual(args.mediawiki, "http://x/api.php")
+        self.assertEqual(args.dokuwiki, "/tmp/dokuwiki")
+        self.assertTrue(args.verbose)
+
+    def test_options_first(self):
+        args = yamdwe.parse_arguments([ "--fetch-workers", "3", "-v", "http://x/api.php", "/tmp/dokuwiki" ])
+        self.assertEqual((args.mediawiki, args.dokuwiki, args.fetch_workers), ("http://x/api.php", "/tmp/dokuwiki", 3))
+
+    def test_no_rate_limit_by_default(self):
+        args = yamdwe.parse_arguments([ "http://x/api.php", "/tmp/dokuwiki" ])
+        self.assertEqual(args.max_rate, 0)
+
+    def test_api_url_required(self):
+        self.assertRejected([ "/tmp/dokuwiki" ])
+
+    def test_api_option(self):
+        args = yamdwe.parse_arguments([ "--api", "http://x/api.php", "-v", "/tmp/dokuwiki" ])
+        self.assertEqual((args.mediawiki, args.dokuwiki), ("http://x/api.php", "/tmp/dokuwiki"))
+
+    def test_other_sources(self):
+        for option, dest in ("--dump", "dump"), ("--db", "db"), ("--replay", "replay"):
+            args = yamdwe.parse_arguments([ "/tmp/dokuwiki", option, "source", "-v" ])
+            self.assertEqual(getattr(args, dest), "source")
+            self.assertEqual(args.dokuwiki, "/tmp/dokuwiki")
+            self.assertEqual(args.mediawiki, None)
+
+    def test_one_source_only(self):
+        self.assertRejected([ "--dump", "dump.xml", "--replay", "wiki.db", "/tmp/dokuwiki" ])
+        self.assertRejected([ "--dump", "dump.xml", "http://x/api.php", "/tmp/dokuwiki" ])
+        self.assertRejected([ "--api", "http://x/api.php", "http://x/api.php", "/tmp/dokuwiki" ])
+
+if __name__ == "__main__":
+    unittest.main()